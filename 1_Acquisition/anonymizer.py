@@ -0,0 +1,299 @@
+import numpy as np
+import threading
+import time
+import lazyModules as lm
+
+cv2 = lm.lazyImport("cv2")
+
+MODEL_PATH       = "Models/face_detection_yunet_2022mar.onnx"
+DETECT_EVERY     = 3     # The detector runs at least once every DETECT_EVERY frames
+DETECT_SCALE     = 0.5   # Scale of the image given to the detector
+BOX_MARGIN       = 0.15  # Margin added around boxes, relative to their size, per frame since the face was seen
+HOLD_FRAMES      = 5     # Number of detections a face can be missed before its box is dropped
+MOTION_THRESHOLD = 6.    # Mean absolute difference (0-255) between thumbnails forcing a detection
+THUMBNAIL_SIZE   = (32, 24)
+
+# Loaded detectors not in use, indexed by model path, see createDetector()
+detectorCache: dict = {}
+detectorLock        = threading.Lock()
+
+class Anonymizer:
+
+    def __init__(self, width: int, height: int, detectEvery: int = DETECT_EVERY,
+                 detectScale: float = DETECT_SCALE, margin: float = BOX_MARGIN,
+                 holdFrames: int = HOLD_FRAMES, motionThreshold: float = MOTION_THRESHOLD,
+                 modelPath: str = MODEL_PATH):
+        """Finds the faces to mask in a stream of images. The YuNet detector runs
+           on a downscaled image every detectEvery frames, the boxes found are
+           propagated to the frames in between with a margin growing with the
+           number of frames since the face was last seen.
+
+           To never leave a face unmasked, the detector also runs when the
+           image changes noticeably, boxes are kept holdFrames detections after
+           the face is lost, and a lost face is searched again at full
+           resolution before its box starts aging. While fullDetection is set
+           (frames being recorded), every frame runs the detector at full
+           resolution instead.
+
+        Args:
+            width (int): width of the images
+            height (int): height of the images
+            detectEvery (int): maximum number of frames between two detections
+            detectScale (float): scale of the image given to the detector
+            margin (float): margin added around boxes, per frame since the face was seen
+            holdFrames (int): number of detections a lost box is kept
+            motionThreshold (float): image difference forcing a detection
+            modelPath (str): path of the YuNet ONNX model
+        """
+        self.width            = width
+        self.height           = height
+        self.detectEvery      = detectEvery
+        self.detectScale      = detectScale
+        self.margin           = margin
+        self.holdFrames       = holdFrames
+        self.motionThreshold  = motionThreshold
+        self.modelPath        = modelPath
+
+        self.fullDetection: bool        = False  # Detect at full resolution on every frame
+        self.fullDetectionDone: bool    = False  # Faces of the last frame were searched at full resolution
+        self.tracks: list               = []    # [box (x, y, w, h), missed detections, last frame seen]
+        self.framesSinceDetection: int  = 0
+        self.thumbnail: np.ndarray      = None
+        self.frames: int                = 0
+        self.detections: int            = 0
+        self.detectorTime: float        = 0.    # Time spent in the detector for the last frame (ms)
+        self.totalDetectorTime: float   = 0.
+
+        self.detector         = self.createDetector(int(width * detectScale),
+                                                    int(height * detectScale))
+        self.fullSizeDetector = None
+
+    def createDetector(self, width: int, height: int):
+        return createDetector(width, height, self.modelPath)
+
+    def close(self):
+        """Puts the detectors back in the cache, where resize() takes them
+           back instead of loading the model again
+        """
+        for detector in (self.detector, self.fullSizeDetector):
+            if detector is not None:
+                releaseDetector(detector, self.modelPath)
+
+        self.detector         = None
+        self.fullSizeDetector = None
+
+    def reset(self):
+        """Forgets the tracked boxes, the next frame runs the detector
+        """
+        self.tracks    = []
+        self.thumbnail = None
+
+    def resize(self, width: int, height: int):
+        """Recreates the detectors for images of another size, e.g. when
+           the color stream is aligned to the depth stream
+        """
+        self.close()
+        self.width            = width
+        self.height           = height
+        self.detector         = self.createDetector(int(width * self.detectScale),
+                                                    int(height * self.detectScale))
+        self.fullSizeDetector = None
+        self.reset()
+
+    def anonymize(self, enableAnonymization: bool, color: np.ndarray, *images) -> list:
+        """Draws a black rectangle on the faces of the color image, and at the
+           same place in the other images (aligned with it)
+
+        Args:
+            enableAnonymization (bool): if false, nothing is drawn and the
+                                        tracked boxes are forgotten
+            color (np.ndarray): BGR image in which faces are searched
+            images (np.ndarray): other images to mask
+
+        Returns:
+            list: (x, y, w, h) boxes masked
+        """
+        if not enableAnonymization:
+            self.reset()
+            self.detectorTime      = 0.
+            self.fullDetectionDone = False
+            return []
+
+        faces = self.getBoxes(color)
+
+        for face in faces:
+            for image in (color, *images):
+                cv2.rectangle(image, face, 0, -1)
+
+        return faces
+
+    def getBoxes(self, image: np.ndarray) -> list:
+        """Returns the boxes to mask in the image
+
+        Args:
+            image (np.ndarray): BGR image of size (width, height)
+
+        Returns:
+            list: (x, y, w, h) integer boxes
+        """
+        self.frames           += 1
+        self.detectorTime      = 0.
+        self.fullDetectionDone = False
+
+        if image.shape[:2] != (self.height, self.width):
+            self.resize(image.shape[1], image.shape[0])
+
+        thumbnail = cv2.resize(image, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        motion    = np.inf if self.thumbnail is None else \
+                    cv2.absdiff(thumbnail, self.thumbnail).mean()
+
+        # Boxes are only propagated to frames that are not recorded
+        if self.fullDetection or motion > self.motionThreshold or \
+           self.framesSinceDetection + 1 >= self.detectEvery:
+            self.thumbnail = thumbnail
+            self.updateTracks(image, self.fullDetection)
+        else:
+            self.framesSinceDetection += 1
+
+        self.totalDetectorTime += self.detectorTime
+
+        return [self.expandBox(box, self.frames - seen) for box, _, seen in self.tracks]
+
+    def updateTracks(self, image: np.ndarray, fullSize: bool = False):
+        """Runs the detector and matches its results with the tracked boxes
+
+        Args:
+            image (np.ndarray): BGR image of size (width, height)
+            fullSize (bool): if true, detects at full resolution directly
+        """
+        if fullSize:
+            boxes = self.detect(image, self.getFullSizeDetector(), 1.)
+        else:
+            boxes = self.detect(image, self.detector, self.detectScale)
+
+        lost = [track for track in self.tracks
+                if not any(overlaps(track[0], box) for box in boxes)]
+
+        if lost and not fullSize:
+            # Small or partially hidden faces can be missed at low resolution
+            boxes    = self.detect(image, self.getFullSizeDetector(), 1.)
+            lost     = [track for track in self.tracks
+                        if not any(overlaps(track[0], box) for box in boxes)]
+            fullSize = True
+
+        self.fullDetectionDone = fullSize
+
+        self.tracks = [[box, 0, self.frames] for box in boxes] + \
+                      [[box, missed + 1, seen] for box, missed, seen in lost 
+                       if missed + 1 < self.holdFrames]
+
+        self.framesSinceDetection = 0
+        self.detections += 1
+
+    def getFullSizeDetector(self):
+        if self.fullSizeDetector is None:
+            self.fullSizeDetector = self.createDetector(self.width, self.height)
+
+        return self.fullSizeDetector
+
+    def detect(self, image: np.ndarray, detector, scale: float) -> list:
+        """Runs a detector on the image
+
+        Returns:
+            list: (x, y, w, h) boxes at the resolution of the image
+        """
+        start = time.perf_counter()
+
+        if scale != 1.:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        faces = detectFaces(detector, image)
+
+        self.detectorTime += 1000 * (time.perf_counter() - start)
+
+        return [face / scale for face in faces]
+
+    def expandBox(self, box, age: int) -> tuple:
+        """Adds the margin to a box and clips it to the image
+
+        Args:
+            box (tuple): (x, y, w, h) box
+            age (int): number of frames since the face was seen
+
+        Returns:
+            tuple: (x, y, w, h) integer box
+        """
+        x, y, w, h = box
+        margin     = self.margin * age
+
+        x0 = max(0,           int(x - w * margin))
+        y0 = max(0,           int(y - h * margin))
+        x1 = min(self.width,  int(np.ceil(x + w * (1 + margin))))
+        y1 = min(self.height, int(np.ceil(y + h * (1 + margin))))
+
+        return x0, y0, x1 - x0, y1 - y0
+
+    def getStats(self) -> dict:
+        """Returns the cost of the anonymization
+
+        Returns:
+            dict: frames, detections, detectorTime (ms, last frame) and
+                  meanDetectorTime (ms per frame)
+        """
+        return {
+            "frames":           self.frames,
+            "detections":       self.detections,
+            "detectorTime":     self.detectorTime,
+            "meanDetectorTime": self.totalDetectorTime / self.frames if self.frames else 0.
+        }
+
+def createDetector(width: int, height: int, modelPath: str = MODEL_PATH):
+    """Returns a YuNet face detector, taken from the cache if one was
+       released or preloaded, loaded from the model file otherwise
+
+    Args:
+        width (int): width of the images given to the detector
+        height (int): height of the images given to the detector
+        modelPath (str): path of the YuNet ONNX model
+
+    Returns:
+        cv2.FaceDetectorYN: face detector
+    """
+    with detectorLock:
+        cached   = detectorCache.get(modelPath)
+        detector = cached.pop() if cached else None
+
+    if detector is None:
+        detector = cv2.FaceDetectorYN.create(modelPath, "", (320, 320))
+
+    detector.setInputSize((width, height))
+    return detector
+
+def releaseDetector(detector, modelPath: str = MODEL_PATH):
+    """Puts a detector no longer used in the cache of createDetector()
+    """
+    with detectorLock:
+        detectorCache.setdefault(modelPath, []).append(detector)
+
+def preloadDetector(modelPath: str = MODEL_PATH):
+    """Loads a detector in the cache, e.g. while the GUI starts
+    """
+    releaseDetector(createDetector(320, 320, modelPath), modelPath)
+
+def detectFaces(detector, image: np.ndarray) -> list:
+    """Runs the detector on an image of its input size
+
+    Returns:
+        list: (x, y, w, h) float boxes
+    """
+    _, faces = detector.detect(image)
+
+    faces = faces if faces is not None else []
+
+    return [face[:4] for face in faces]
+
+def overlaps(boxA, boxB) -> bool:
+    """Returns True if two (x, y, w, h) boxes intersect
+    """
+    return boxA[0] < boxB[0] + boxB[2] and boxB[0] < boxA[0] + boxA[2] and \
+           boxA[1] < boxB[1] + boxB[3] and boxB[1] < boxA[1] + boxA[3]
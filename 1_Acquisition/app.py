@@ -1,14 +1,44 @@
-from datetime import datetime
-import cameraWrapper as cw
+import time
+STARTUP_TIME = time.perf_counter()  # Origin of the time-to-window measurement
+
+import frameSources as fs
+import frameWriter as fw
+import framePool as pl
+import sessionJournal as sj
+import anonymizer as an
+import metrics as mt
+import blobStore as bs
+import frames as fr
+import preview as pv
+import lazyModules as lm
 import PySimpleGUI as sg
 import subprocess
+import functools
+import threading
+import importlib
+import argparse
 import json
+import math
 import sys
-import cv2
 import os
 
+# Only needed once the camera is started
+fp  = lm.lazyImport("frameProducer")
+fpl = lm.lazyImport("framePipeline")
+rc  = lm.lazyImport("recorders")
+bu  = lm.lazyImport("burst")
+
 DATABASE_PATH = "Database"
+CONFIG_PATH   = "config.json"  # Derived from the journal, see sessionJournal.py
+JOURNAL_PATH  = os.path.join(DATABASE_PATH, sj.JOURNAL_FILE)
 TARGET_IMAGES = 15
+BURST_FRAMES  = 0  # Frames captured per location in burst mode, only the best TARGET_IMAGES are written. 0 to write every frame
+RECORDING_FORMAT = "files"  # "files": one image per frame, "session": chunked session container, "video": MJPG + depth stream, "blobs": deduplicated store
+DEPTH_FORMAT     = "raw"    # "raw": 16-bit PNG + calibration.json, "colorized": 8-bit TIFF
+NEW_FRAMES_EVENT = "_newFrames"  # Posted by the capture thread when frames are available
+METRICS_EVENT    = "_metrics"    # Posted every metrics.METRICS_PERIOD seconds
+CAMERA_PROGRESS_EVENT = "_cameraProgress"  # Posted by the camera thread with a progress message
+CAMERA_READY_EVENT    = "_cameraReady"     # Posted by the camera thread with the opened source or the exception raised
 LOCATIONS = [
     "Location 1",
     "Location 2"
@@ -16,31 +46,89 @@ LOCATIONS = [
 
 class GUI:
     
-    def __init__(self):
+    def __init__(self, source: str = "camera", processes: bool = False):
+        """
+        Args:
+            source (str): source of the frames, see frameSources.openSource()
+            processes (bool): if true, the capture, the anonymization and the
+                              writing run in their own processes, see 
+                              framePipeline.ProcessPipeline
+        """
+        self.source: str                    = source
+        self.processes: bool                = processes
         self.isPlaying: bool                = False
         self.isRecording: bool              = False
         self.enableAnonymization: bool      = True
         self.autoIncrementLocation: bool    = True
         self.autoIncrementID: bool          = True
         self.frameCount: int                = 0
-        self.camera: cw.CameraWrapper       = None
+        self.burstFrames: int               = BURST_FRAMES
+        self.capturedImages: int            = BURST_FRAMES or TARGET_IMAGES
+        self.enabledFilters: set            = set()
+        self.camera: fs.FrameSource         = None
+        self.producer                       = None
+        self.writer: fw.FrameWriter         = fw.FrameWriter()
+        self.recorder                       = None
+        self.recordingAlignment             = None
+        self.recordingDirectory             = None
+        self.preview: pv.Preview            = pv.Preview()
+        self.blobStore: bs.BlobStore        = bs.BlobStore(os.path.join(DATABASE_PATH, 
+                                                                        bs.BLOBS_DIRECTORY))
+        self.metrics: mt.MetricsRegistry    = mt.MetricsRegistry()
+        self.closing                        = threading.Event()
+        self.cameraThread                   = None
+        self.cameraStartTime: float         = None
+        self.firstFrameTime: float          = None
+        self.preloadThread                  = threading.Thread(target=self.preload, 
+                                                               name="Preload", daemon=True)
         
         self.loadConfig()
         self.initUI()
         self.bindTkinterEvents()
+        self.recoverRecording()
+        self.initMetrics()
+        self.preloadThread.start()
+        
+        windowTime = 1000 * (time.perf_counter() - STARTUP_TIME)
+        self.metrics.gauge("window_ms", "Time from the start of the app to the window (ms)").set(windowTime)
+        self.window["textStatus"].update(f"Window shown after {windowTime:.0f} ms")
     
     def loadConfig(self):
         try:
-            with open("config.json", "r") as f:
+            with open(CONFIG_PATH, "r") as f:
                 self.config = json.load(f)
         except:
-            sg.popup_error("Could not find 'config.json'")
+            sg.popup_error(f"Could not find '{CONFIG_PATH}'")
             sys.exit()
+        
+        # The journal is the reference, config.json may be older after a crash
+        self.journal = sj.SessionJournal(JOURNAL_PATH)
+        
+        if self.journal.state["nextID"] is not None:
+            self.config["nextID"] = self.journal.state["nextID"]
     
     def updateConfigFile(self):
         
-        with open("config.json", "w") as f:
-            json.dump(self.config, f)
+        self.journal.log("id", nextID=self.config["nextID"])
+        sj.writeConfig(CONFIG_PATH, self.journal.state, self.config)
+    
+    def recoverRecording(self):
+        """Restores the location of the previous run, and reports the
+           recording it did not stop (crash or forced exit)
+        """
+        location  = self.journal.state["location"]
+        recording = self.journal.state["recording"]
+        
+        if location in LOCATIONS:
+            self.window["comboLocations"].update(location)
+        
+        if recording:
+            frames = recording["frames"]
+            sg.popup(f"The recording of {recording['directory']} started at "
+                     f"{recording['time']} was interrupted after {frames} frames. "
+                     f"The next frames may be incomplete.", title="Interrupted recording")
+            self.journal.log("recovered", directory=recording["directory"], 
+                             frames=frames)
             
     def initUI(self):
         """Sets the layout of the window and instanciates the sg.window object
@@ -48,12 +136,15 @@ class GUI:
         sg.LOOK_AND_FEEL_TABLE["SystemDefaultForReal"]["BACKGROUND"] = "#ffffff"
         sg.theme("SystemDefaultForReal")
         
+        previewSize = (int(fs.TARGET_WIDTH  * self.preview.scale), 
+                       int(fs.TARGET_HEIGHT * self.preview.scale))
+        
         layoutColumnRGB = [
-            [sg.Image(k="imageRGB",   s=(640, 480))]
+            [sg.Image(k="imageRGB",   s=previewSize)]
         ]
         
         layoutColumnDepth = [
-            [sg.Image(k="imageDepth", s=(640, 480))]
+            [sg.Image(k="imageDepth", s=previewSize)]
         ]
         
         layout = [
@@ -65,14 +156,19 @@ class GUI:
              sg.Button("NEXT", k="_buttonNextID"),
              sg.Button("Open folder", k="_buttonOpenPatientFolder")],
             [sg.Text("Current location", s=(15, 1)), 
-             sg.Combo(LOCATIONS, s=(20, 1), readonly=True, 
+             sg.Combo(LOCATIONS, s=(20, 1), readonly=True, enable_events=True,
                       default_value=LOCATIONS[0], k="comboLocations"),
              sg.Checkbox("Auto increment", k="_checkboxAutoIncrementLocations", 
                          default=self.autoIncrementLocation, enable_events=True),
              sg.Button("Start recording", k="_buttonToggleRecording", disabled=True),
              sg.Text("...", k="textNumberFrames")],
+            [sg.Text("", k="textMetrics", font=("Courier", 9))],
             [sg.Button("Start camera", k="_buttonToggleCamera"),
-             sg.Button("Disable anonymization", k="_buttonToggleAnonymization")],
+             sg.Text("", k="textStatus", s=(28, 1)),
+             sg.Button("Disable anonymization", k="_buttonToggleAnonymization"),
+             sg.Text("Depth filters")] +
+            [sg.Checkbox(name.replace("_", " "), k="_checkboxFilter_" + name,
+                         default=False, enable_events=True) for name in fr.DEPTH_FILTERS],
             [sg.P(), sg.HorizontalSeparator(pad=(10, 30)), sg.P()],
             [sg.Column(layout=layoutColumnRGB, k="columnImageRGB"), 
              sg.VerticalSeparator(), 
@@ -101,43 +197,206 @@ class GUI:
             Toggles the visual feedback of the camera on the GUI
         """
         if not self.camera:
-            try:
-                self.camera = cw.CameraWrapper()
-                self.isPlaying = True
-                text = "Stop playback"
-                self.window["_buttonToggleRecording"].update(disabled=False)
-            except Exception as e:
-                sg.popup_error(e)
-                return
+            # The source is opened in the background, see cameraReady()
+            self.cameraStartTime = time.perf_counter()
+            self.cameraThread    = threading.Thread(target=self.openCamera, 
+                                                    name="OpenCamera", daemon=True)
+            self.cameraThread.start()
+            self.window["_buttonToggleCamera"].update(disabled=True)
+            return
             
         elif self.isPlaying:
+            if self.isRecording:
+                self.buttonToggleRecordingClicked()
+                
             self.isPlaying   = False
-            self.isRecording = False
+            self.producer.pause()
             text = "Start playback"
             self.window["_buttonToggleRecording"].update(disabled=True)
             
         else:
             self.isPlaying = True
+            self.drainFrames()
+            self.producer.resume()
             text = "Stop playback"
             self.window["_buttonToggleRecording"].update(disabled=False)
         
         self.window["_buttonToggleCamera"].update(text)
     
+    def preload(self):
+        """Loads OpenCV, the face detector and pyrealsense2 while the window is
+           shown, executed by the preload thread
+        """
+        try:
+            an.preloadDetector()
+        except Exception as e:
+            # Raised again when the camera is opened
+            print(e)
+        
+        if self.source in ("camera", "multi") or self.source.endswith(".bag"):
+            try:
+                importlib.import_module("cameraWrapper")
+            except ImportError as e:
+                print(e)
+    
+    def openCamera(self):
+        """Opens the source once the preload is done and posts CAMERA_READY_EVENT,
+           executed by the camera thread
+        """
+        progress = lambda message: self.window.write_event_value(CAMERA_PROGRESS_EVENT, message)
+        
+        try:
+            if self.preloadThread.is_alive():
+                progress("Loading face detector...")
+                self.preloadThread.join()
+            
+            progress("Starting camera...")
+            
+            if self.processes:
+                camera = fpl.ProcessPipeline(self.source)
+            else:
+                camera = fs.openSource(self.source)
+        except Exception as e:
+            camera = e
+        
+        self.window.write_event_value(CAMERA_READY_EVENT, camera)
+    
+    def cameraReady(self, camera):
+        """Starts the capture of the source opened by the camera thread
+        
+        Args:
+            camera: source returned by frameSources.openSource() or 
+                    ProcessPipeline, or the exception raised when opening it
+        """
+        self.window["_buttonToggleCamera"].update(disabled=False)
+        
+        if isinstance(camera, Exception):
+            self.window["textStatus"].update("")
+            sg.popup_error(camera)
+            return
+        
+        self.camera = camera
+        
+        # BurstRecorder keeps the best frames of the burst, which neither
+        # MultiFrames nor the slots of the frame bus of ProcessPipeline allow
+        if BURST_FRAMES and (self.processes or hasattr(self.camera, "writers")):
+            self.burstFrames = 0
+            sg.popup("Burst mode is not available with several cameras or --processes, "
+                     f"the {TARGET_IMAGES + 1} frames of each recording will be written.", 
+                     title="Burst mode")
+        else:
+            self.burstFrames = BURST_FRAMES
+        
+        self.capturedImages = self.burstFrames or TARGET_IMAGES
+        
+        # MultiCamera runs one producer per camera and synchronizes them,
+        # ProcessPipeline runs its own capture process
+        if hasattr(self.camera, "getLatestFrames"):
+            self.producer = self.camera
+        else:
+            self.producer = fp.FrameProducer(self.camera)
+        self.producer.enableAnonymization = self.enableAnonymization
+        self.producer.onNewFrames = lambda: self.window.write_event_value(NEW_FRAMES_EVENT, None)
+        self.producer.start()
+        self.updateDepthFilters()
+        self.isPlaying = True
+        self.window["_buttonToggleRecording"].update(disabled=False)
+        self.window["_buttonToggleCamera"].update("Stop playback")
+        self.window["textStatus"].update("Waiting for the first frame...")
+    
     def buttonToggleRecordingClicked(self):
         """
             Toggles the writing of the images on disk
         """
         if self.isRecording:
+            self.closeRecorder()
+            
+            if self.burstFrames:
+                self.window["textStatus"].update(f"Best {self.recorder.written} of "
+                                                 f"{self.recorder.captured} frames written")
+            
+            if getattr(self.recorder, "error", None):
+                sg.popup_error(self.recorder.error)
+            
             self.frameCount = 0
             self.isRecording = False
             text = "Start recording"
-            self.window["textNumberFrames"].update(str(self.frameCount) + " / " + str(TARGET_IMAGES))
+            self.recorder = None
+            self.setRecordingMode(False)
+            self.window["textNumberFrames"].update(str(self.frameCount) + " / " + str(self.capturedImages))
         else:
+            self.setRecordingMode(True)
+            self.recorder    = self.createRecorder()
             self.isRecording = True
             text = "Stop recording"
         
         self.window["_buttonToggleRecording"].update(text)
         
+    def closeRecorder(self):
+        """Closes the recorder once its frames are written and journals the
+           end of the recording, with the error of PipelineRecorder if any
+        """
+        self.recorder.close()
+        self.journal.log("stop", directory=self.recordingDirectory, 
+                         frames=self.frameCount, error=getattr(self.recorder, "error", None))
+    
+    def createRecorder(self):
+        """Creates the folder of the current ID and location and the recorder
+           writing the frames in it, according to RECORDING_FORMAT and 
+           BURST_FRAMES
+        """
+        writeDirectoryPath = os.path.join(DATABASE_PATH, 
+                                          self.window["inputID"].get(),
+                                          self.window["comboLocations"].get())
+        
+        if os.path.exists(writeDirectoryPath):
+            print("folder already exists")
+        else:
+            os.makedirs(writeDirectoryPath)
+        
+        self.recordingDirectory = writeDirectoryPath
+        self.journal.log("start", directory=writeDirectoryPath, 
+                         id=self.window["inputID"].get(),
+                         location=self.window["comboLocations"].get(),
+                         format=RECORDING_FORMAT)
+        
+        calibration = self.camera.getCalibration()
+        self.recordingAlignment = calibration.get("alignedTo")
+        
+        if "views" in calibration:
+            return rc.MultiRecorder(writeDirectoryPath, self.camera.writers, calibration,
+                                    RECORDING_FORMAT, DEPTH_FORMAT, self.blobStore, 
+                                    fs.TARGET_FPS)
+        
+        # The writer process of ProcessPipeline records the frames
+        if hasattr(self.camera, "createRecorder"):
+            return self.camera.createRecorder(writeDirectoryPath, calibration, 
+                                              RECORDING_FORMAT, DEPTH_FORMAT, 
+                                              self.blobStore.path)
+        
+        recorder = rc.createRecorder(writeDirectoryPath, self.writer, calibration, 
+                                     RECORDING_FORMAT, DEPTH_FORMAT, self.blobStore, 
+                                     fs.TARGET_FPS)
+        
+        if self.burstFrames:
+            # Same number of frames as a normal recording (0 to TARGET_IMAGES)
+            return bu.BurstRecorder(recorder, TARGET_IMAGES + 1)
+        
+        return recorder
+    
+    def setRecordingMode(self, enabled: bool):
+        """Aligns the frames while recording when the camera only aligns
+           recorded frames (cameraWrapper.ALIGN_MODE = "recording"), and
+           searches the faces of every frame at full resolution
+        """
+        if hasattr(self.camera, "alignRecordedFrames"):
+            self.camera.alignRecordedFrames = enabled
+        
+        if hasattr(self.camera, "anonymizer"):
+            self.camera.anonymizer.fullDetection = enabled
+        else:
+            self.camera.fullDetection = enabled
+    
     def buttonNextIDClicked(self):
         self.config["nextID"] += 1
         self.updateConfigFile()
@@ -149,54 +408,178 @@ class GUI:
         self.window["inputID"].update(self.config["nextID"])
             
     def handleFrames(self):
-        """Recovers the latest frames from the camera, writes them on disk if
-           isRecording is set to True
+        """Recovers the latest frames captured by the producer thread, writes 
+           them on disk if isRecording is set to True
         """
-        frames = self.camera.getNextFrames(self.enableAnonymization)
+        frames = self.producer.getLatestFrames()
                 
         if not frames:
             return
         
-        RGBFrame    = frames[0]
-        DepthFrame  = frames[1]
+        if self.firstFrameTime is None:
+            self.firstFrameTime = 1000 * (time.perf_counter() - self.cameraStartTime)
+            self.metrics.gauge("first_frame_ms", "Time from the camera click to the first frame (ms)") \
+                .set(self.firstFrameTime)
+            self.window["textStatus"].update(f"First frame after {self.firstFrameTime:.0f} ms")
         
-        dateTime         = datetime.now().strftime("%Y%m%d_%H%M%S")
-        frameCountString = '{:0>5}'.format(self.frameCount)
+        views = frames.views.values() if isinstance(frames, fr.MultiFrames) else [frames]
+        
+        for view in views:
+            self.metrics.histogram("detector_ms").observe(view.metadata["detectorTime"])
             
-        if self.isRecording:
+            if math.isfinite(view.metadata.get("latency", math.nan)):
+                self.metrics.histogram("latency_ms").observe(view.metadata["latency"])
+        
+        try:
+            self.recordFrames(frames)
             
-            writeDirectoryPath = os.path.join(DATABASE_PATH, 
-                                              self.window["inputID"].get(),
-                                              self.window["comboLocations"].get())
+            if self.preview.isDue():
+                self.previewFrames(frames)
+        finally:
+            # The writer holds its own references until the frames are written
+            self.producer.release(frames)
+    
+    def drainFrames(self):
+        """Discards the frames captured before a pause, so that the producer
+           notifies the next ones
+        """
+        frames = self.producer.getLatestFrames()
         
-            if not os.path.exists(writeDirectoryPath):
-                os.makedirs(writeDirectoryPath)
-                
-            elif self.frameCount == 0:
-                print("folder already exists")
-                pass
-                
-            rgbImagePath   = os.path.join(writeDirectoryPath, 
-                                          f"RGB_{dateTime}_{frameCountString}.jpeg")
-            depthImagePath = os.path.join(writeDirectoryPath, 
-                                          f"D_{dateTime}_{frameCountString}.tiff")
+        if frames:
+            self.producer.release(frames)
+    
+    def recordFrames(self, frames):
+        """Queues the writing of the frames if they belong to the recording
+        """
+        # Frames captured before the alignment of recorded frames or the full
+        # face detection were enabled are only previewed
+        if self.isRecording and \
+           frames.metadata.get("alignedTo") == self.recordingAlignment and \
+           (frames.metadata["fullDetection"] or not frames.metadata["anonymized"]):
             
-            cv2.imwrite(rgbImagePath,   RGBFrame)
-            cv2.imwrite(depthImagePath, DepthFrame)
+            self.recorder.write(frames, self.frameCount,
+                                functools.partial(self.journal.log, "frame", 
+                                                  frameCount=self.frameCount,
+                                                  timestamp=frames.metadata["timestamp"]))
+            self.metrics.counter("frames_recorded_total").inc()
             
-            if self.frameCount >= TARGET_IMAGES:
+            # Recorded frames are searched at full resolution, see anonymizer.py
+            for view in (frames.views.values() if isinstance(frames, fr.MultiFrames) else [frames]):
+                self.metrics.histogram("recorded_detector_ms").observe(view.metadata["detectorTime"])
+            
+            if self.frameCount >= self.capturedImages:
                 self.buttonToggleRecordingClicked()
                 if self.autoIncrementLocation:
                     self.updateComboLocation("next")
             else:
                 self.frameCount += 1
-                self.window["textNumberFrames"].update(str(self.frameCount) + " / " + str(TARGET_IMAGES))
+                self.window["textNumberFrames"].update(str(self.frameCount) + " / " + str(self.capturedImages))
+    
+    def previewFrames(self, frames):
+        """Displays the frames in the window
+        """
+        if isinstance(frames, fr.MultiFrames):
+            # Grid of the views of the cameras
+            views      = frames.views.values()
+            RGBFrame   = pv.tileImages([view.color for view in views], 
+                                       fs.TARGET_WIDTH, fs.TARGET_HEIGHT)
+            DepthFrame = pv.tileImages([view.depth for view in views], 
+                                       fs.TARGET_WIDTH, fs.TARGET_HEIGHT)
+        else:
+            RGBFrame   = frames.color
+            DepthFrame = frames.depth
+            
+        self.preview.update(self.window, {"imageRGB":   RGBFrame, 
+                                          "imageDepth": DepthFrame})
+    
+    def initMetrics(self):
+        """Creates the metrics of the acquisition and starts the thread 
+           posting METRICS_EVENT
+        """
+        self.metrics.counter("frames_captured_total",  "Frames captured by the source")
+        self.metrics.counter("frames_dropped_total",   "Frames dropped before being displayed")
+        self.metrics.counter("frames_recorded_total",  "Frames queued for writing")
+        self.metrics.histogram("detector_ms",          "Time spent in the face detector per frame (ms)")
+        self.metrics.histogram("recorded_detector_ms", "Time spent in the face detector per recorded frame (ms)")
+        self.metrics.histogram("latency_ms",           "Time between capture and arrival on the host (ms)")
+        self.metrics.gauge("writer_queue_depth",       "Jobs waiting in the writer queues")
+        self.metrics.counter("written_bytes_total",    "Bytes written by the writer queues")
+        self.metrics.counter("written_files_total",    "Files written by the writer queues")
+        self.metrics.counter("writer_errors_total",    "Jobs of the writer queues that failed")
+        self.metrics.counter("writer_blocked_seconds_total", "Time spent waiting for a full writer queue (s)")
+        self.metrics.gauge("pool_buffers_in_use",      "Frame buffers in use, see framePool.py")
+        self.metrics.counter("pool_buffers_allocated_total", "Frame buffers allocated by the pool")
+        self.metrics.counter("pool_buffers_reused_total",    "Frame buffers taken from the pool")
+        self.metrics.counter("pool_misses_total",            "Arrays allocated because every buffer was in use")
+        self.metrics.gauge("recording",                "1 while recording")
+        self.metrics.counter("blobs_stored_total",     "Images written in the blob store")
+        self.metrics.counter("blobs_duplicate_total",  "Images already in the blob store, not written")
+        self.metrics.counter("blobs_saved_bytes_total", "Bytes not written thanks to the deduplication")
+        
+        threading.Thread(target=self.postMetricsEvents, name="Metrics", daemon=True).start()
+    
+    def postMetricsEvents(self):
+        """Wakes up the GUI every METRICS_PERIOD seconds, even when no frames
+           arrive, executed by the metrics thread
+        """
+        while not self.closing.wait(mt.METRICS_PERIOD):
+            self.window.write_event_value(METRICS_EVENT, None)
+    
+    def updateMetrics(self):
+        """Refreshes the overlay and writes the metrics files
+        """
+        snapshot = self.writeMetrics()
+        self.window["textMetrics"].update(mt.formatSummary(snapshot))
+    
+    def writeMetrics(self) -> dict:
+        """Reads the counters of the producer and the writers and writes the
+           metrics files, also called when the app is closed
+        
+        Returns:
+            dict: snapshot of the metrics, see MetricsRegistry.snapshot()
+        """
+        writers = {id(self.writer): self.writer}
+        
+        # MultiCamera and VideoRecorder have their own writers
+        for writer in list(getattr(self.camera, "writers", {}).values()) + \
+                      [getattr(self.recorder, "writer", None)]:
+            if isinstance(writer, fw.FrameWriter):
+                writers[id(writer)] = writer
+        
+        if self.producer:
+            self.metrics.counter("frames_captured_total").set(self.producer.capturedFrames)
+            self.metrics.counter("frames_dropped_total").set(self.producer.droppedFrames)
+        
+        self.metrics.gauge("writer_queue_depth").set(sum(writer.queue.qsize() 
+                                                         for writer in writers.values()))
+        self.metrics.counter("written_bytes_total").set(sum(writer.writtenBytes 
+                                                            for writer in writers.values()))
+        self.metrics.counter("written_files_total").set(sum(writer.writtenFiles 
+                                                            for writer in writers.values()))
+        self.metrics.counter("writer_errors_total").set(sum(writer.errors 
+                                                            for writer in writers.values()))
+        self.metrics.counter("writer_blocked_seconds_total").set(sum(writer.blockedTime 
+                                                                     for writer in writers.values()))
+        poolStats = pl.sharedPool.getStats()
+        self.metrics.gauge("pool_buffers_in_use").set(poolStats["inUse"])
+        self.metrics.counter("pool_buffers_allocated_total").set(poolStats["allocated"])
+        self.metrics.counter("pool_buffers_reused_total").set(poolStats["reused"])
+        self.metrics.counter("pool_misses_total").set(poolStats["misses"])
+        self.metrics.gauge("recording").set(int(self.isRecording))
+        
+        blobStats = self.blobStore.getStats()
+        self.metrics.counter("blobs_stored_total").set(blobStats["storedBlobs"])
+        self.metrics.counter("blobs_duplicate_total").set(blobStats["duplicateBlobs"])
+        self.metrics.counter("blobs_saved_bytes_total").set(blobStats["savedBytes"])
         
-        bufferRGB = cv2.imencode('.png', RGBFrame)[1].tobytes()
-        bufferDPT = cv2.imencode('.png', DepthFrame)[1].tobytes()
+        snapshot = self.metrics.snapshot()
         
-        self.window["imageRGB"].update(data=bufferRGB)
-        self.window["imageDepth"].update(data=bufferDPT)
+        try:
+            self.metrics.writeFiles(DATABASE_PATH, snapshot)
+        except OSError as e:
+            print(e)
+        
+        return snapshot
     
     def buttonToggleAnonymizationClicked(self):
         if self.enableAnonymization:
@@ -205,6 +588,20 @@ class GUI:
            self.window["_buttonToggleAnonymization"].update("Disable anonymization")
            
         self.enableAnonymization = not self.enableAnonymization
+        
+        if self.producer:
+            self.producer.enableAnonymization = self.enableAnonymization
+    
+    def updateDepthFilters(self):
+        """Applies the state of the depth filter checkboxes to the camera, only
+           RealSense cameras have filters
+        """
+        self.enabledFilters = set(name for name in fr.DEPTH_FILTERS 
+                                  if self.window["_checkboxFilter_" + name].get())
+        
+        if hasattr(self.camera, "setFilterEnabled"):
+            for name in fr.DEPTH_FILTERS:
+                self.camera.setFilterEnabled(name, name in self.enabledFilters)
     
     def buttonOpenFolderClicked(self):
         """Opens the current target folder for writing the images (or its closest 
@@ -250,20 +647,49 @@ class GUI:
             raise Exception("Not implemented")
         
         self.window["comboLocations"].update(newSelection)
+        self.journal.log("location", location=newSelection)
         
     def run(self):
-        """Starts the gui
+        """Starts the gui. The loop sleeps until a UI event happens or the
+           capture thread posts NEW_FRAMES_EVENT
         """
         while True:
-            event, _ = self.window.read(timeout=0)
+            event, values = self.window.read()
 
             if event == sg.WINDOW_CLOSED:
+                self.closing.set()
+                
+                # The writer process of ProcessPipeline closes the recording
+                # before the pipeline stops
+                if self.recorder:
+                    self.closeRecorder()
+                if self.producer:
+                    self.producer.stop()
+                    print(f"{self.producer.capturedFrames} frames captured, "
+                          f"{self.producer.droppedFrames} dropped")
+                    print(self.camera.getStats() if hasattr(self.camera, "getStats") 
+                          else self.camera.anonymizer.getStats())
+                self.writer.close()
+                self.journal.close()
+                self.writeMetrics()
                 break
             
-            if self.isPlaying:
-                self.handleFrames()
+            if event == NEW_FRAMES_EVENT:
+                if self.isPlaying:
+                    self.handleFrames()
+                else:
+                    self.drainFrames()
+            
+            elif event == METRICS_EVENT:
+                self.updateMetrics()
+            
+            elif event == CAMERA_PROGRESS_EVENT:
+                self.window["textStatus"].update(values[event])
+            
+            elif event == CAMERA_READY_EVENT:
+                self.cameraReady(values[event])
                 
-            if event == "_buttonToggleCamera":
+            elif event == "_buttonToggleCamera":
                 self.buttonToggleCameraClicked()
             
             elif event in ("_buttonToggleRecording", "_spacebar"):
@@ -287,12 +713,27 @@ class GUI:
             elif event == "_down":
                 self.updateComboLocation("next")
             
+            elif event == "comboLocations":
+                # Selected in the drop-down list
+                self.journal.log("location", location=values[event])
+            
             elif event == "_checkboxAutoIncrementID":
                 self.autoIncrementID = self.window["_checkboxAutoIncrementID"].get()
                 
+            elif event.startswith("_checkboxFilter_"):
+                self.updateDepthFilters()
+            
             elif event == "_checkboxAutoIncrementLocations":
                 self.autoIncrementLocation = self.window["_checkboxAutoIncrementLocations"].get()
                 print(self.autoIncrementLocation)
             
 if __name__ == "__main__":
-    GUI().run()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="camera",
+                        help="camera, a .bag file, synthetic[:<width>x<height>@<fps>] "
+                             "or a folder of saved frames")
+    parser.add_argument("--processes", action="store_true",
+                        help="captures, anonymizes and writes the frames in separate processes")
+    args = parser.parse_args()
+    
+    GUI(args.source, args.processes).run()
\ No newline at end of file
@@ -0,0 +1,291 @@
+from collections import defaultdict
+import multiprocessing as mp
+import frameSources as fs
+import sessionStore as ss
+import calibration as cb
+import anonymizer as an
+import frameIndex as fi
+import recorders as rc
+import videoStore as vs
+import blobStore as bs
+import argparse
+import math
+import time
+import cv2
+import re
+import os
+
+DATABASE_PATH    = "Database"
+CHECKPOINT_FILE  = "anonymization_checkpoint.txt"
+REPORT_PERIOD    = 5  # Seconds between two progress reports
+TEMPORARY_PREFIX = ".tmp_"  # Images being written, never matched by fs.findFramePairs()
+
+# Name of the frames written by recorders.FileRecorder: date and frame count
+FRAME_FILE_PATTERN = re.compile(r"RGB_(\d{8}_\d{6})_(\d+)\.jpeg")
+
+# State of each worker process
+workerDetector     = None
+workerDetectorSize = None
+workerModelPath    = an.MODEL_PATH
+
+def findFrames(databasePath: str) -> list:
+    """Lists the RGB images of the database and their paired depth image,
+       except the frames anonymized during the acquisition
+
+    Returns:
+        list: (rgbPath, depthPath) tuples, depthPath is None if not found
+    """
+    frames = []
+
+    for directory, _, _ in os.walk(databasePath):
+        anonymized = findAnonymizedFrames(directory)
+        frames    += [pair for pair in fs.findFramePairs(directory)
+                      if pair[0] not in anonymized]
+
+    return frames
+
+def findAnonymizedFrames(directory: str) -> set:
+    """Returns the RGB images of a folder flagged as anonymized by the frame
+       index of their recording (the last one started before the frame)
+    """
+    prefix, suffix = rc.FRAME_INDEX_FILE.split("{}")
+    indexPattern   = re.compile(re.escape(prefix) + r"_(\d{8}_\d{6})" + re.escape(suffix))
+    fileNames      = os.listdir(directory)
+    indexNames     = set(map(fi.getIndexPath, fileNames))  # Interrupted recordings only have rows
+    starts         = sorted(match.group(1) for match in map(indexPattern.fullmatch, indexNames)
+                            if match)
+    indexes        = {}
+    anonymized     = set()
+
+    for fileName in fileNames:
+        match = FRAME_FILE_PATTERN.fullmatch(fileName)
+
+        if not match:
+            continue
+
+        dateTime, frameCount = match.group(1), int(match.group(2))
+        recording = [start for start in starts if start <= dateTime]
+
+        if not recording:
+            continue
+
+        if recording[-1] not in indexes:
+            indexes[recording[-1]] = fi.FrameIndex(os.path.join(
+                directory, rc.FRAME_INDEX_FILE.format("_" + recording[-1])))
+
+        index = indexes[recording[-1]]
+
+        if index["anonymized"][index["frameIndex"] == frameCount].any():
+            anonymized.add(os.path.join(directory, fileName))
+
+    return anonymized
+
+def findUnsupportedRecordings(databasePath: str) -> list:
+    """Lists the recordings that are not saved as image files (sessions,
+       videos and blobs), which cannot be anonymized afterwards
+    """
+    prefix, suffix = bs.REFERENCES_FILE.split("{}")
+    recordings     = []
+
+    for directory, _, fileNames in os.walk(databasePath):
+        if directory.endswith(ss.SESSION_EXTENSION):
+            recordings.append(directory)
+            continue
+
+        recordings += [os.path.join(directory, fileName) for fileName in sorted(fileNames)
+                       if fileName.endswith((vs.COLOR_EXTENSION, vs.DEPTH_EXTENSION))
+                       or (fileName.startswith(prefix) and fileName.endswith(suffix))]
+
+    return recordings
+
+def removeTemporaryFiles(databasePath: str):
+    """Removes the images left half written by an interrupted run
+    """
+    for directory, _, fileNames in os.walk(databasePath):
+        for fileName in fileNames:
+            if fileName.startswith(TEMPORARY_PREFIX):
+                os.remove(os.path.join(directory, fileName))
+
+def loadCheckpoint(checkpointPath: str) -> set:
+    """Returns the RGB paths already processed
+    """
+    if not os.path.exists(checkpointPath):
+        return set()
+
+    with open(checkpointPath, "r") as f:
+        return set(line.rstrip("\n") for line in f)
+
+def initWorker(modelPath: str):
+    global workerModelPath
+    workerModelPath = modelPath
+
+def writeImageAtomic(path: str, image):
+    """Writes an image through a temporary file, so that it is never left
+       half written
+    """
+    directory, fileName = os.path.split(path)
+    temporaryPath       = os.path.join(directory, TEMPORARY_PREFIX + fileName)
+
+    if not cv2.imwrite(temporaryPath, image):
+        raise IOError(f"Could not write {path}")
+
+    os.replace(temporaryPath, path)
+
+def getDepthBox(face: list, colorShape: tuple, depthShape: tuple, calibration: dict) -> tuple:
+    """Returns the box of a face of the RGB image in the paired depth image
+
+    Args:
+        face (list): (x, y, w, h) box in the RGB image
+        colorShape (tuple): shape of the RGB image
+        depthShape (tuple): shape of the depth image
+        calibration (dict): calibration of the recording, None if it has none
+
+    Returns:
+        tuple: (x, y, w, h) box in the depth image
+    """
+    if calibration and not calibration.get("alignedTo"):
+        # Depth recorded without alignment ("offline" mode)
+        return cb.colorBoxToDepth(face, depthShape, calibration)
+
+    # Aligned images only differ by their resolution, e.g. decimated depth
+    scaleX     = depthShape[1] / colorShape[1]
+    scaleY     = depthShape[0] / colorShape[0]
+    x, y, w, h = face
+
+    return (int(x * scaleX), int(y * scaleY),
+            int(math.ceil(w * scaleX)), int(math.ceil(h * scaleY)))
+
+def anonymizeFrame(paths: tuple) -> tuple:
+    """Masks the faces of a frame, executed in the worker processes
+
+    Args:
+        paths (tuple): (rgbPath, depthPath)
+
+    Returns:
+        tuple: rgbPath, number of faces, processing time (s), worker pid and
+               the message of the error that stopped the processing of the
+               frame (None if it was anonymized)
+    """
+    start = time.perf_counter()
+
+    try:
+        faces = maskFaces(*paths)
+    except Exception as e:
+        return paths[0], 0, time.perf_counter() - start, os.getpid(), str(e) or repr(e)
+
+    return paths[0], faces, time.perf_counter() - start, os.getpid(), None
+
+def maskFaces(rgbPath: str, depthPath: str) -> int:
+    """Masks the faces found in an RGB image in the image and in its depth
+       image
+
+    Returns:
+        int: number of faces
+    """
+    global workerDetector, workerDetectorSize
+
+    image = cv2.imread(rgbPath)
+
+    if image is None:
+        raise IOError(f"Could not read {rgbPath}")
+
+    size = (image.shape[1], image.shape[0])
+
+    if size != workerDetectorSize:
+        workerDetector     = an.createDetector(*size, workerModelPath)
+        workerDetectorSize = size
+
+    faces = [list(map(int, face)) for face in an.detectFaces(workerDetector, image)]
+
+    if faces:
+        for face in faces:
+            cv2.rectangle(image, face, (0, 0, 0), -1)
+
+        # The depth image is replaced first: if interrupted, the faces are still
+        # visible in the RGB image and are found again when resuming
+        if depthPath:
+            depth = cv2.imread(depthPath, cv2.IMREAD_UNCHANGED)
+
+            if depth is None:
+                raise IOError(f"Could not read {depthPath}")
+
+            calibration = cb.loadCalibration(os.path.dirname(depthPath))
+
+            for face in faces:
+                cv2.rectangle(depth, getDepthBox(face, image.shape, depth.shape, calibration),
+                              0, -1)
+
+            writeImageAtomic(depthPath, depth)
+
+        writeImageAtomic(rgbPath, image)
+
+    return len(faces)
+
+def run(databasePath: str, workers: int, checkpointPath: str, modelPath: str):
+    """Anonymizes the frames of the database not listed in the checkpoint file
+    """
+    removeTemporaryFiles(databasePath)
+
+    for path in findUnsupportedRecordings(databasePath):
+        print(f"Skipped {path}: only recordings saved as image files can be anonymized")
+
+    done   = loadCheckpoint(checkpointPath)
+    frames = [paths for paths in findFrames(databasePath) if paths[0] not in done]
+
+    print(f"{len(frames)} frames to anonymize ({len(done)} already done)")
+
+    if not frames:
+        return
+
+    workerFrames = defaultdict(int)
+    workerTime   = defaultdict(float)
+    facesFound   = 0
+    failed       = 0
+    start        = time.perf_counter()
+    lastReport   = start
+
+    with mp.Pool(workers, initializer=initWorker, initargs=(modelPath,)) as pool, \
+         open(checkpointPath, "a") as checkpoint:
+
+        results = pool.imap_unordered(anonymizeFrame, frames, chunksize=8)
+
+        for i, (rgbPath, faces, elapsed, pid, error) in enumerate(results, 1):
+            # Failed frames are not listed, they are processed again by the next run
+            if error:
+                print(f"Could not anonymize {rgbPath}: {error}")
+                failed += 1
+            else:
+                checkpoint.write(rgbPath + "\n")
+                checkpoint.flush()
+
+            workerFrames[pid] += 1
+            workerTime[pid]   += elapsed
+            facesFound        += faces
+
+            if time.perf_counter() - lastReport > REPORT_PERIOD or i == len(frames):
+                lastReport = time.perf_counter()
+                report(i, len(frames), facesFound, failed, lastReport - start,
+                       workerFrames, workerTime)
+
+def report(processed: int, total: int, faces: int, failed: int, elapsed: float,
+           workerFrames: dict, workerTime: dict):
+    """Prints the progress and the number of frames per second of each worker
+    """
+    print(f"{processed}/{total} frames, {faces} faces, {failed} failed, "
+          f"{processed / elapsed:.1f} frames/s")
+
+    for pid in sorted(workerFrames):
+        print(f"    worker {pid}: {workerFrames[pid]} frames, "
+              f"{workerFrames[pid] / workerTime[pid]:.1f} frames/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Anonymizes the frames of a database")
+    parser.add_argument("--database",   default=DATABASE_PATH)
+    parser.add_argument("--workers",    type=int, default=os.cpu_count())
+    parser.add_argument("--checkpoint", default=None,
+                        help=f"defaults to <database>/{CHECKPOINT_FILE}")
+    parser.add_argument("--model",      default=an.MODEL_PATH)
+    args = parser.parse_args()
+
+    run(args.database, args.workers,
+        args.checkpoint or os.path.join(args.database, CHECKPOINT_FILE), args.model)
@@ -0,0 +1,185 @@
+from datetime import datetime
+import frameSources as fs
+import frameWriter as fw
+import framePool as pl
+import preview as pv
+import numpy as np
+import platform
+import tempfile
+import argparse
+import json
+import time
+import sys
+import cv2
+import os
+
+BENCHMARK_FRAMES = 300
+WARMUP_FRAMES    = 10
+PERCENTILES      = (50, 90, 99)
+TOLERANCE        = 0.15  # Relative slowdown reported as a regression by --compare
+
+def getPeakMemory() -> float:
+    """Returns the peak resident memory of the process (MB), None if unknown
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+    except ImportError:
+        pass
+
+    try:
+        # resource is not available on Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1e6
+    except (ImportError, AttributeError):
+        return None
+
+def summarize(times: list) -> dict:
+    """Returns the mean, percentiles and maximum of durations (ms)
+    """
+    times   = np.asarray(times)
+    summary = {"mean": float(times.mean()), "max": float(times.max())}
+
+    for percentile in PERCENTILES:
+        summary[f"p{percentile}"] = float(np.percentile(times, percentile))
+
+    return summary
+
+def run(source: str, frames: int, enableAnonymization: bool, write: bool) -> dict:
+    """Runs the acquisition pipeline synchronously and measures each stage
+
+    Args:
+        source (str): source of the frames, see frameSources.openSource()
+        frames (int): number of frames measured, after WARMUP_FRAMES frames
+        enableAnonymization (bool): whether faces are searched and masked
+        write (bool): whether frames are encoded and written in a temporary folder
+
+    Returns:
+        dict: configuration, per-stage latencies (ms), fps, cpu (% of one
+              core) and peak memory (MB)
+    """
+    camera      = fs.openSource(source)
+    stages      = {}
+    directory   = tempfile.mkdtemp(prefix="benchmark_")
+    calibration = camera.getCalibration()
+
+    for i in range(WARMUP_FRAMES + frames):
+        if i == WARMUP_FRAMES:
+            start    = time.perf_counter()
+            cpuStart = time.process_time()
+            stages   = {}
+
+        frameStart = time.perf_counter()
+        result     = camera.getNextFrames(enableAnonymization)
+
+        if not result:
+            continue
+
+        times = dict(camera.stageTimes)
+
+        stageStart = time.perf_counter()
+        pv.toPPM(result.color)
+        pv.toPPM(result.depth)
+        times["preview"] = 1000 * (time.perf_counter() - stageStart)
+
+        if write:
+            stageStart = time.perf_counter()
+            fw.writeImageFile(os.path.join(directory, "RGB.jpeg"), result.color, [], False)
+            fw.writeImageFile(os.path.join(directory, "D.png"), result.rawDepth,
+                              [cv2.IMWRITE_PNG_COMPRESSION, 1], False)
+            times["write"] = 1000 * (time.perf_counter() - stageStart)
+
+        pl.sharedPool.release(result)
+        times["total"] = 1000 * (time.perf_counter() - frameStart)
+
+        for stage, duration in times.items():
+            stages.setdefault(stage, []).append(duration)
+
+    elapsed = time.perf_counter() - start
+    cpuTime = time.process_time() - cpuStart
+
+    for fileName in os.listdir(directory):
+        os.remove(os.path.join(directory, fileName))
+    os.rmdir(directory)
+
+    return {
+        "date":   datetime.now().isoformat(),
+        "config": {
+            "source":        source,
+            "frames":        frames,
+            "width":         calibration["color"]["width"],
+            "height":        calibration["color"]["height"],
+            "anonymization": enableAnonymization,
+            "write":         write,
+            "platform":      platform.platform(),
+            "processor":     platform.processor()
+        },
+        "stages":   {stage: summarize(times) for stage, times in stages.items()},
+        "fps":      frames / elapsed,
+        "cpu":      100 * cpuTime / elapsed,
+        "memoryMB": getPeakMemory()
+    }
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    """Lists the regressions of results compared to a baseline
+
+    Returns:
+        list: descriptions of the stages whose median latency, and of the fps,
+              got worse by more than tolerance
+    """
+    regressions = []
+
+    for stage, summary in results["stages"].items():
+        reference = baseline["stages"].get(stage)
+
+        # Stages shorter than 0.5 ms are too noisy to be compared
+        if reference and reference["p50"] > 0.5 and \
+           summary["p50"] > reference["p50"] * (1 + tolerance):
+            regressions.append(f"{stage}: p50 {reference['p50']:.2f} -> {summary['p50']:.2f} ms")
+
+    if results["fps"] < baseline["fps"] * (1 - tolerance):
+        regressions.append(f"fps: {baseline['fps']:.1f} -> {results['fps']:.1f}")
+
+    return regressions
+
+def printResults(results: dict):
+    print(f"{results['config']['source']}: {results['fps']:.1f} fps, "
+          f"cpu {results['cpu']:.0f}%, memory {results['memoryMB'] or 0:.0f} MB")
+
+    for stage, summary in results["stages"].items():
+        print(f"    {stage:<10}" + "  ".join(f"{name} {value:7.2f}"
+                                            for name, value in summary.items()))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the acquisition pipeline")
+    parser.add_argument("--source", default="synthetic:640x480@0",
+                        help="see frameSources.openSource(), @0 for as fast as possible")
+    parser.add_argument("--frames",  type=int, default=BENCHMARK_FRAMES)
+    parser.add_argument("--no-anonymization", action="store_true")
+    parser.add_argument("--no-write",         action="store_true")
+    parser.add_argument("--output",  help="JSON file where results are saved")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    results = run(args.source, args.frames, not args.no_anonymization, not args.no_write)
+    printResults(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+        for key in ("source", "width", "height", "anonymization", "write"):
+            if baseline["config"][key] != results["config"][key]:
+                print(f"WARNING {key} differs from the baseline: {baseline['config'][key]}")
+
+        regressions = compare(results, baseline)
+
+        for regression in regressions:
+            print("REGRESSION", regression)
+
+        sys.exit(1 if regressions else 0)
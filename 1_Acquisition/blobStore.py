@@ -0,0 +1,135 @@
+import frameWriter as fw
+import numpy as np
+import threading
+import hashlib
+import json
+import lazyModules as lm
+import os
+
+cv2 = lm.lazyImport("cv2")
+
+try:
+    import xxhash
+except ImportError:
+    # Slower, but always available
+    xxhash = None
+
+BLOBS_DIRECTORY         = "blobs"
+REFERENCES_FILE         = "blobs{}.json"
+NEAR_DUPLICATE_DISTANCE = 6  # Maximum number of differing bits between the dHash of near-duplicate images
+
+def hashBuffers(*buffers) -> str:
+    """Returns the digest of raw buffers: XXH3 128 bits if xxhash is
+       installed, BLAKE2b 128 bits otherwise
+    """
+    digest = xxhash.xxh3_128() if xxhash else hashlib.blake2b(digest_size=16)
+
+    for buffer in buffers:
+        digest.update(buffer)
+
+    return digest.hexdigest()
+
+def hashImage(image: np.ndarray, extension: str) -> str:
+    """Returns the key of an image in the store, from its pixels, its shape
+       and the format it is stored in
+    """
+    header = f"{image.shape}{image.dtype}{extension}".encode()
+
+    return hashBuffers(header, np.ascontiguousarray(image).data)
+
+def getPerceptualHash(image: np.ndarray) -> int:
+    """Returns the 64 bits difference hash (dHash) of an image: whether each
+       pixel of a 9 x 8 grayscale thumbnail is brighter than its right
+       neighbour. Near-identical images have hashes differing by a few bits
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    gray = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+
+    return int(np.packbits(bits).view(">u8")[0])
+
+def hammingDistance(hashA: int, hashB: int) -> int:
+    return bin(hashA ^ hashB).count("1")
+
+class BlobStore:
+
+    def __init__(self, path: str):
+        """Content-addressed storage: each image is stored once, in a file
+           named after the hash of its pixels. Images already stored are
+           neither encoded nor written again
+
+        Args:
+            path (str): folder of the store, created if needed
+        """
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.storedBlobs: int     = 0
+        self.duplicateBlobs: int  = 0
+        self.savedBytes: int      = 0
+
+    def getPath(self, key: str) -> str:
+        """Returns the file of a blob, <store>/<2 first characters>/<key>.<extension>
+        """
+        return os.path.join(self.path, key[:2], key)
+
+    def putImage(self, image: np.ndarray, extension: str, params: list = None) -> tuple:
+        """Stores an image if it is not already in the store
+
+        Args:
+            image (np.ndarray): image to store
+            extension (str): format of the image, e.g. ".jpeg"
+            params (list, optional): encoding parameters given to cv2.imencode
+
+        Returns:
+            tuple: key of the blob, number of bytes written (0 for a duplicate)
+        """
+        key  = hashImage(image, extension) + extension
+        path = self.getPath(key)
+
+        if os.path.exists(path):
+            with self.lock:
+                self.duplicateBlobs += 1
+                self.savedBytes     += os.path.getsize(path)
+
+            return key, 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Unique per thread, the same blob can be written by two threads at once
+        temporaryPath = f"{path}.{threading.get_ident()}.tmp{extension}"
+        size          = fw.writeImageFile(temporaryPath, image, params or [], False)
+        os.replace(temporaryPath, path)
+
+        with self.lock:
+            self.storedBlobs += 1
+
+        return key, size
+
+    def getStats(self) -> dict:
+        """Returns the number of blobs written and of duplicates skipped, and
+           the bytes saved by the deduplication
+        """
+        with self.lock:
+            return {
+                "storedBlobs":    self.storedBlobs,
+                "duplicateBlobs": self.duplicateBlobs,
+                "savedBytes":     self.savedBytes
+            }
+
+def readReferences(directory: str) -> list:
+    """Returns the references of every blob recording of a folder
+
+    Returns:
+        list: frameCount, color and depth keys, perceptualHash and
+              nearDuplicate of each frame
+    """
+    prefix, suffix = REFERENCES_FILE.split("{}")
+    references     = []
+
+    for fileName in sorted(os.listdir(directory)):
+        if fileName.startswith(prefix) and fileName.endswith(suffix):
+            with open(os.path.join(directory, fileName), "r") as f:
+                references += json.load(f)
+
+    return references
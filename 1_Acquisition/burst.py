@@ -0,0 +1,99 @@
+import framePool as pl
+import numpy as np
+import heapq
+import cv2
+
+DEPTH_ROI       = (0.25, 0.25, 0.5, 0.5)  # (x, y, w, h) region where depth must be valid, relative to the image size
+SHARPNESS_SCALE = 0.5                     # Scale of the image whose Laplacian variance is measured
+
+def getSharpness(color: np.ndarray, scale: float = SHARPNESS_SCALE) -> float:
+    """Measures the sharpness of an image as the variance of its Laplacian,
+       blurred images have few edges and a low variance
+
+    Args:
+        color (np.ndarray): BGR image
+        scale (float): the image is downscaled first, which is faster and
+                       less sensitive to noise
+
+    Returns:
+        float: variance of the Laplacian of the grayscale image
+    """
+    gray = cv2.cvtColor(color, cv2.COLOR_BGR2GRAY)
+
+    if scale != 1.:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    _, deviation = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+
+    return float(deviation[0, 0] ** 2)
+
+def getDepthValidity(rawDepth: np.ndarray, roi: tuple = DEPTH_ROI) -> float:
+    """Returns the fraction of valid (non zero) depth pixels in a region of
+       interest
+    """
+    height, width = rawDepth.shape
+    x, y, w, h    = roi
+    region        = rawDepth[int(y * height):int((y + h) * height),
+                             int(x * width):int((x + w) * width)]
+
+    return np.count_nonzero(region) / region.size if region.size else 0.
+
+class BurstRecorder:
+
+    def __init__(self, recorder, keep: int):
+        """Keeps the best frames of a burst in memory and only writes them
+           when the burst ends. Frames are ranked by their sharpness times
+           the fraction of valid depth in DEPTH_ROI
+
+        Args:
+            recorder (FileRecorder or SessionRecorder): recorder writing the
+                                                        frames kept
+            keep (int): number of frames written
+        """
+        self.recorder = recorder
+        self.keep     = keep
+
+        self.best: list     = []  # Min-heap of (score, position, frames, onWritten), at most keep frames
+        self.captured: int  = 0
+        self.written: int   = 0   # Frames written by close()
+
+    def write(self, frames, frameCount: int, onWritten=None):
+        """Scores the frames, they are kept if they are among the best so far
+
+        Args:
+            frames (Frames): frames returned by the camera
+            frameCount (int): position of the frames in the burst
+            onWritten (callable, optional): called without arguments if the
+                                            frames are written, by close()
+        """
+        score = getSharpness(frames.color) * getDepthValidity(frames.rawDepth)
+        entry = (score, frameCount, frames, onWritten)
+
+        self.captured += 1
+
+        # Frames kept are retained until they are written, see framePool.py
+        if len(self.best) < self.keep:
+            pl.sharedPool.retain(frames)
+            heapq.heappush(self.best, entry)
+        elif score > self.best[0][0]:
+            pl.sharedPool.retain(frames)
+            pl.sharedPool.release(heapq.heapreplace(self.best, entry)[2])
+
+    def getScores(self) -> list:
+        """Returns the positions and scores of the frames kept, best first
+        """
+        return [(position, score) for score, position, _, _ in sorted(self.best, reverse=True)]
+
+    def close(self):
+        """Writes the frames kept, in the order of capture, and closes the
+           recorder
+        """
+        kept = sorted(self.best, key=lambda entry: entry[1])
+
+        for i, (_, _, frames, onWritten) in enumerate(kept):
+            self.recorder.write(frames, i, onWritten)
+            pl.sharedPool.release(frames)
+
+        self.written = len(kept)
+        self.best    = []
+        self.recorder.close()
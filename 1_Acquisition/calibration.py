@@ -0,0 +1,119 @@
+from functools import lru_cache
+import sessionStore as ss
+import json
+import math
+import os
+
+CALIBRATION_FILE = "calibration.json"
+CACHE_SIZE       = 64   # Number of recordings whose calibration is kept in memory
+DEPTH_BOX_MARGIN = 0.2  # Margin of the face boxes mapped to unaligned depth images
+
+def writeCalibration(directory: str, calibration: dict) -> bool:
+    """Writes the calibration of a recording next to its frames, once: the
+       file is only replaced if the calibration changed
+
+    Args:
+        directory (str): folder of the recording
+        calibration (dict): see CameraWrapper.getCalibration()
+
+    Returns:
+        bool: True if the file was written
+    """
+    path = os.path.join(directory, CALIBRATION_FILE)
+
+    if os.path.exists(path) and loadCalibration(directory) == calibration:
+        return False
+
+    ss.writeJsonAtomic(path, calibration)
+    return True
+
+def findCalibrationFile(path: str) -> str:
+    """Returns the file holding the calibration of a recording: the header of
+       a .session container, or the calibration.json of the folder or of its
+       closest parent
+
+    Args:
+        path (str): .session container, folder of frames or frame file
+
+    Returns:
+        str: path of the file, None if not found
+    """
+    path = os.path.abspath(path)
+
+    if path.rstrip("/\\").endswith(ss.SESSION_EXTENSION):
+        return os.path.join(path, ss.HEADER_FILE)
+
+    if os.path.isfile(path):
+        path = os.path.dirname(path)
+
+    while True:
+        candidate = os.path.join(path, CALIBRATION_FILE)
+
+        if os.path.exists(candidate):
+            return candidate
+
+        parent = os.path.dirname(path)
+
+        if parent == path:
+            return None
+
+        path = parent
+
+def loadCalibration(path: str) -> dict:
+    """Returns the calibration of a recording, read once and then served from
+       a cache until the file is modified
+
+    Args:
+        path (str): .session container, folder of frames or frame file
+
+    Returns:
+        dict: see CameraWrapper.getCalibration(), None if the recording has no
+              calibration. Shared by the callers, must not be modified
+    """
+    calibrationPath = findCalibrationFile(path)
+
+    if not calibrationPath:
+        return None
+
+    return readCalibration(calibrationPath, os.path.getmtime(calibrationPath))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def readCalibration(calibrationPath: str, modificationTime: float) -> dict:
+    with open(calibrationPath, "r") as f:
+        data = json.load(f)
+
+    if os.path.basename(calibrationPath) == ss.HEADER_FILE:
+        return data["calibration"]
+
+    return data
+
+def colorBoxToDepth(box: tuple, depthShape: tuple, calibration: dict) -> tuple:
+    """Maps a box of the color image to an unaligned depth image. The 
+       distance between the sensors is ignored, DEPTH_BOX_MARGIN covers the
+       resulting parallax
+
+    Args:
+        box (tuple): (x, y, w, h) box in the color image
+        depthShape (tuple): shape of the depth image
+        calibration (dict): color and depth intrinsics, see 
+                            CameraWrapper.getCalibration()
+
+    Returns:
+        tuple: (x, y, w, h) box in the depth image
+    """
+    color = calibration["color"]
+    depth = calibration["depth"]
+    scale = depthShape[1] / depth["width"]  # Decimation
+    
+    x, y, w, h = box
+    x -= w * DEPTH_BOX_MARGIN
+    y -= h * DEPTH_BOX_MARGIN
+    w *= 1 + 2 * DEPTH_BOX_MARGIN
+    h *= 1 + 2 * DEPTH_BOX_MARGIN
+    
+    x0 = ((x - color["ppx"]) / color["fx"] * depth["fx"] + depth["ppx"]) * scale
+    y0 = ((y - color["ppy"]) / color["fy"] * depth["fy"] + depth["ppy"]) * scale
+    
+    return (int(x0), int(y0), 
+            int(math.ceil(w / color["fx"] * depth["fx"] * scale)), 
+            int(math.ceil(h / color["fy"] * depth["fy"] * scale)))
@@ -1,4 +1,10 @@
+from frames import Frames, StageTimer, DEPTH_FILTERS
+import time
 import pyrealsense2 as rs
+import deprojection as dp
+import calibration as cb
+import framePool as pl
+import anonymizer as an
 import numpy as np
 import cv2
 
@@ -6,18 +12,42 @@ TARGET_WIDTH  = 640  # Width of captured images
 TARGET_HEIGHT = 480  # Height of captured images
 TARGET_FPS    = 6    # Number of FPS
 
+# "color": depth aligned to color, "depth": color aligned to depth, "recording": 
+# frames are aligned to color only while alignRecordedFrames is set (preview is 
+# not aligned), "offline": frames are never aligned, see registration.py
+ALIGN_MODE = "color"
+
+# Depth post-processing filters working in the disparity domain
+DISPARITY_FILTERS    = ("spatial", "temporal")
+DECIMATION_MAGNITUDE = 2  # Depth is processed at 1/DECIMATION_MAGNITUDE of its resolution
+
 class CameraWrapper:
     
-    def __init__(self):
+    def __init__(self, bagFile: str = None, realTime: bool = True, serial: str = None):
         """Gets the camera object from realsense API and initialize the pipeline
 
+        Args:
+            bagFile (str, optional): plays a recorded .bag file instead of 
+                                     using a connected camera
+            realTime (bool): if false, a .bag file is played as fast as the
+                             frames are requested instead of at its recorded rate
+            serial (str, optional): serial number of the camera to use when
+                                    several are connected, the first by default
+
         Raises:
             Exception: If no realsense device is not connected
         """
-        self.camera = getCamera()
+        self.bagFile  = bagFile
+        self.realTime = realTime
+        self.serial   = serial
         
-        if not self.camera:  
-            raise Exception("Could not find any RealSense Device")
+        if not bagFile:
+            self.camera = getCamera(serial)
+            
+            if not self.camera:  
+                raise Exception("Could not find any RealSense Device")
+            
+            self.serial = self.camera.get_info(rs.camera_info.serial_number)
         
         self.initCamera()
         
@@ -27,20 +57,45 @@ class CameraWrapper:
         self.config      = rs.config()
         self.pipe        = rs.pipeline()  
         self.colorizer   = rs.colorizer(3)
-        self.align       = rs.align(rs.stream.color)
+        self.aligners    = {"color": rs.align(rs.stream.color),
+                            "depth": rs.align(rs.stream.depth)}
+        self.alignMode   = ALIGN_MODE
+        self.depthScale  = None
+        
+        self.alignRecordedFrames: bool = False
+        self.stageTimes  = {}
+        self.framePool   = pl.sharedPool
         
-        self.config.enable_stream(rs.stream.depth, TARGET_WIDTH, TARGET_HEIGHT, rs.format.z16,  TARGET_FPS)
-        self.config.enable_stream(rs.stream.color, TARGET_WIDTH, TARGET_HEIGHT, rs.format.bgr8, TARGET_FPS)
+        # Built once: the temporal filter keeps the previous frames in its state
+        self.depthFilters        = createDepthFilters()
+        self.enabledFilters: set = set()
+        
+        if self.bagFile:
+            # Streams are played as they were recorded
+            self.config.enable_device_from_file(self.bagFile, repeat_playback=True)
+        else:
+            # Each pipeline must own its device when several cameras are used
+            self.config.enable_device(self.serial)
+            self.config.enable_stream(rs.stream.depth, TARGET_WIDTH, TARGET_HEIGHT, rs.format.z16,  TARGET_FPS)
+            self.config.enable_stream(rs.stream.color, TARGET_WIDTH, TARGET_HEIGHT, rs.format.bgr8, TARGET_FPS)
 
-        self.pipe.start(self.config)
+        self.profile = self.pipe.start(self.config)
+        
+        if self.bagFile:
+            self.profile.get_device().as_playback().set_real_time(self.realTime)
 
-        self.detector = cv2.FaceDetectorYN.create("Models/face_detection_yunet_2022mar.onnx", "", (320, 320))
-        self.detector.setInputSize((TARGET_WIDTH, TARGET_HEIGHT))
+        self.colorIntrinsics = getIntrinsics(self.profile, rs.stream.color)
+        self.depthIntrinsics = getIntrinsics(self.profile, rs.stream.depth)
+        self.anonymizer      = an.Anonymizer(self.colorIntrinsics.width, 
+                                             self.colorIntrinsics.height)
+        
+        # Captured once, the profile does not change while the pipeline runs
+        self.deviceCalibration = captureCalibration(self.profile)
             
         rgb_sensor   = None
         depth_sensor = None
 
-        for s in self.camera.sensors:                              
+        for s in self.profile.get_device().sensors:                              
             if s.get_info(rs.camera_info.name) == 'RGB Camera':
                 rgb_sensor = s 
             if s.get_info(rs.camera_info.name) == 'Stereo Module':
@@ -54,74 +109,342 @@ class CameraWrapper:
             print("No depth sensor")
             return
         
+        self.depthScale = depth_sensor.get_depth_scale()
+        
+    def getCalibration(self) -> dict:
+        """Returns the parameters needed to use the raw depth images offline.
+           When frames are aligned, both images share the intrinsics of the 
+           stream given by alignedTo. Otherwise the extrinsics are used to
+           align them offline
+
+        Returns:
+            dict: depthScale (meters per depth unit), alignedTo ("color", 
+                  "depth" or None), color and depth intrinsics, extrinsics
+                  from depth to color and from color to depth
+        """
+        calibration = dict(self.deviceCalibration)
+        
+        if "decimation" in self.enabledFilters:
+            calibration["depth"] = scaleIntrinsics(calibration["depth"], 1 / DECIMATION_MAGNITUDE)
+        
+        calibration["alignedTo"] = self.getAlignTarget()
+        
+        return calibration
+    
+    def getAlignTarget(self) -> str:
+        """Returns the stream the next frames are aligned to, according to
+           alignMode
+
+        Returns:
+            str: "color", "depth" or None if frames are not aligned
+        """
+        if self.alignMode in ("color", "depth"):
+            return self.alignMode
+        
+        if self.alignMode == "recording" and self.alignRecordedFrames:
+            return "color"
+        
+        return None
+    
+    def colorBoxToDepth(self, box: tuple, depthShape: tuple) -> tuple:
+        """Maps a box of the color image to an unaligned depth image, see
+           calibration.colorBoxToDepth()
+        """
+        return cb.colorBoxToDepth(box, depthShape, self.deviceCalibration)
+        
+    def setFilterEnabled(self, name: str, enabled: bool):
+        """Enables or disables a depth post-processing filter
+
+        Args:
+            name (str): one of DEPTH_FILTERS
+            enabled (bool): whether the filter is applied to the next frames
+        """
+        if name not in DEPTH_FILTERS:
+            raise Exception(f"Unknown depth filter {name}")
+        
+        if enabled:
+            self.enabledFilters.add(name)
+        else:
+            self.enabledFilters.discard(name)
+    
+    def filterDepth(self, frameset, timer: StageTimer):
+        """Applies the enabled depth filters to the frameset, before alignment
+           so that decimation reduces the cost of every following stage
+
+        Args:
+            frameset (rs.composite_frame): frames returned by the pipeline
+            timer (StageTimer): timer measuring each filter
+
+        Returns:
+            rs.composite_frame: frameset with the filtered depth frame
+        """
+        inDisparity = False
+        
+        for name in DEPTH_FILTERS:
+            if name not in self.enabledFilters:
+                continue
+            
+            if (name in DISPARITY_FILTERS) != inDisparity:
+                transform   = "to_depth" if inDisparity else "to_disparity"
+                frameset    = self.depthFilters[transform].process(frameset).as_frameset()
+                inDisparity = not inDisparity
+            
+            frameset = self.depthFilters[name].process(frameset).as_frameset()
+            timer.lap(name)
+        
+        if inDisparity:
+            frameset = self.depthFilters["to_depth"].process(frameset).as_frameset()
+        
+        return frameset
+        
     def getNextFrames(self, enableAnonymization: bool) -> tuple:
         """Recovers the lastest aligned frames from the camera feed and returns them
            as numpy arrays
 
         Args:
-            enableAnonymization (bool): if true, will run face detection model and 
-                                        draw a black rectangle on faces
+            enableAnonymization (bool): if true, will find faces with the anonymizer
+                                        and draw a black rectangle on them
 
         Returns:
-            color_image: np.array, depth_image: np.array
+            Frames: color image, colorized depth image, raw z16 depth image and
+                    metadata of the frames. The images are pooled buffers, see
+                    FramePool.release()
         """
-        frameset = self.pipe.wait_for_frames()                  
+        timer       = StageTimer()
+        frameset    = self.pipe.wait_for_frames()                  
+        arrivalTime = time.time() * 1000
+        timer.lap("wait")
         
-        aligned_frames = self.align.process(frameset)
-        color_frame    = aligned_frames.first(rs.stream.color)
-        depth_frame    = aligned_frames.get_depth_frame()
-
-        # depth_frame = rs.decimation_filter(1).process(depth_frame)
-        # depth_frame = rs.disparity_transform(True).process(depth_frame)
-        # depth_frame = rs.spatial_filter().process(depth_frame)
-        # depth_frame = rs.temporal_filter().process(depth_frame)
-        # depth_frame = rs.disparity_transform(False).process(depth_frame)
-        # depth_frame = rs.hole_filling_filter().process(depth_frame)
+        frameset = self.filterDepth(frameset, timer)
+        alignTo  = self.getAlignTarget()
+        
+        if alignTo:
+            frameset = self.aligners[alignTo].process(frameset)
+            
+        color_frame = frameset.first(rs.stream.color)
+        depth_frame = frameset.get_depth_frame()
+        timer.lap("align")
         
         if not depth_frame or not color_frame:
             return
 
-        depth_image = np.asanyarray(self.colorizer.colorize(depth_frame).get_data())
-        color_image = np.asanyarray(color_frame.get_data())
+        # Copied to pooled buffers: holding the realsense frames would stall
+        # the pipeline once its own frame queue is exhausted
+        depth_image = self.copyToPool(self.colorizer.colorize(depth_frame))
+        timer.lap("colorize")
+        
+        raw_depth = self.copyToPool(depth_frame)
         
-        if enableAnonymization:
-            _, faces = self.detector.detect(color_image) 
+        if color_frame.get_profile().format() == rs.format.rgb8:
+            # .bag files may contain RGB images
+            color_data  = np.asanyarray(color_frame.get_data())
+            color_image = self.framePool.acquire(color_data.shape, color_data.dtype)
+            cv2.cvtColor(color_data, cv2.COLOR_RGB2BGR, dst=color_image)
+        else:
+            color_image = self.copyToPool(color_frame)
+        
+        if alignTo:
+            faces = self.anonymizer.anonymize(enableAnonymization, color_image, 
+                                              depth_image, raw_depth)
+        else:
+            faces = self.anonymizer.anonymize(enableAnonymization, color_image)
             
-            faces = faces if faces is not None else []
-
             for face in faces:
-                cv2.rectangle(color_image, list(map(int, face[:4])), (0, 0, 0), -1)
-                cv2.rectangle(depth_image, list(map(int, face[:4])), (0, 0, 0), -1)
+                depthFace = self.colorBoxToDepth(face, raw_depth.shape)
+                cv2.rectangle(depth_image, depthFace, (0, 0, 0), -1)
+                cv2.rectangle(raw_depth,   depthFace, 0, -1)
+        timer.lap("detect")
+        self.stageTimes = timer.times
+        
+        metadata = getFrameMetadata(color_frame, depth_frame, arrivalTime)
+        metadata["anonymized"]    = enableAnonymization
+        metadata["fullDetection"] = self.anonymizer.fullDetectionDone
+        metadata["faces"]         = len(faces)
+        metadata["detectorTime"]  = self.anonymizer.detectorTime
+        metadata["alignedTo"]     = alignTo
             
-        return color_image, depth_image
+        return Frames(color_image, depth_image, raw_depth, metadata)
+    
+    def copyToPool(self, frame) -> np.ndarray:
+        """Copies the image of a realsense frame to a buffer of framePool
+
+        Returns:
+            np.ndarray: buffer holding one reference, see FramePool.acquire()
+        """
+        data   = np.asanyarray(frame.get_data())
+        buffer = self.framePool.acquire(data.shape, data.dtype)
+        np.copyto(buffer, data)
         
-def getCamera():
-    """Revocers the camera object
+        return buffer
+        
+def getCameras() -> list:
+    """Lists the connected RealSense devices
 
     Returns:
-        rs.device: camera object
+        list: rs.device objects
     """
     cameras = list()
-    device  = None
     
     try:
-        cameras = rs.context().devices
+        cameras = list(rs.context().devices)
     except Exception as e:
         print(e)
+        
+    return cameras
+
+def getCamera(serial: str = None):
+    """Revocers the camera object
+
+    Args:
+        serial (str, optional): serial number of the camera, the first camera
+                                found by default
+
+    Returns:
+        rs.device: camera object, None if not found
+    """
+    for device in getCameras():
+        if not serial or device.get_info(rs.camera_info.serial_number) == serial:
+            return device
+        
+    return None
+
+def createDepthFilters() -> dict:
+    """Creates the RealSense depth post-processing filters
+
+    Returns:
+        dict: filters indexed by the names of DEPTH_FILTERS, plus the
+              "to_disparity" and "to_depth" transforms
+    """
+    return {
+        "decimation":   rs.decimation_filter(DECIMATION_MAGNITUDE),
+        "spatial":      rs.spatial_filter(),
+        "temporal":     rs.temporal_filter(),
+        "hole_filling": rs.hole_filling_filter(),
+        "to_disparity": rs.disparity_transform(True),
+        "to_depth":     rs.disparity_transform(False)
+    }
+
+def scaleIntrinsics(intrinsics: dict, scale: float) -> dict:
+    """Returns the intrinsics of a resized stream, given as a dict
+    """
+    scaled = dict(intrinsics)
     
-    if cameras:
-        device = cameras[0]
+    for key in ("width", "height"):
+        scaled[key] = int(intrinsics[key] * scale)
+    
+    for key in ("ppx", "ppy", "fx", "fy"):
+        scaled[key] = intrinsics[key] * scale
         
-    return device
+    return scaled
+
+def getFrameMetadata(color_frame, depth_frame, arrivalTime: float) -> dict:
+    """Reads the hardware metadata of a pair of frames
+
+    Args:
+        color_frame (rs.frame): color frame
+        depth_frame (rs.frame): depth frame of the same frameset
+        arrivalTime (float): host time when the frameset was received (ms)
+
+    Returns:
+        dict: timestamp (ms, sensor timestamp in the global time domain),
+              frameNumber, depthFrameNumber, arrivalTime (ms), latency
+              (arrivalTime - timestamp, NaN if the timestamp is not in host 
+              time) and exposure (us, NaN if not reported by the camera)
+    """
+    timestamp = color_frame.get_timestamp()
+    domain    = color_frame.get_frame_timestamp_domain()
+    latency   = float("nan")
+    exposure  = float("nan")
+    
+    if domain in (rs.timestamp_domain.global_time, rs.timestamp_domain.system_time):
+        latency = arrivalTime - timestamp
+    
+    if color_frame.supports_frame_metadata(rs.frame_metadata_value.actual_exposure):
+        exposure = color_frame.get_frame_metadata(rs.frame_metadata_value.actual_exposure)
+    
+    return {
+        "timestamp":        timestamp,
+        "frameNumber":      color_frame.get_frame_number(),
+        "depthFrameNumber": depth_frame.get_frame_number(),
+        "arrivalTime":      arrivalTime,
+        "latency":          latency,
+        "exposure":         exposure
+    }
+
+def getIntrinsics(profile, stream):
+    """Returns the intrinsics of a stream of a running pipeline
+
+    Args:
+        profile (rs.pipeline_profile): profile returned by pipeline.start()
+        stream (rs.stream): rs.stream.color or rs.stream.depth
+
+    Returns:
+        rs.intrinsics: intrinsics of the active stream profile
+    """
+    return profile.get_stream(stream).as_video_stream_profile().get_intrinsics()
+
+def captureCalibration(profile) -> dict:
+    """Reads the parameters needed to use the frames offline from a running
+       pipeline
+
+    Args:
+        profile (rs.pipeline_profile): profile returned by pipeline.start()
+
+    Returns:
+        dict: serial number and name of the device, depthScale, color and 
+              depth intrinsics, extrinsics from depth to color and from color
+              to depth
+    """
+    device       = profile.get_device()
+    colorProfile = profile.get_stream(rs.stream.color)
+    depthProfile = profile.get_stream(rs.stream.depth)
+    
+    return {
+        "serial":       device.get_info(rs.camera_info.serial_number),
+        "device":       device.get_info(rs.camera_info.name),
+        "depthScale":   device.first_depth_sensor().get_depth_scale(),
+        "color":        intrinsicsToDict(getIntrinsics(profile, rs.stream.color)),
+        "depth":        intrinsicsToDict(getIntrinsics(profile, rs.stream.depth)),
+        "depthToColor": extrinsicsToDict(depthProfile.get_extrinsics_to(colorProfile)),
+        "colorToDepth": extrinsicsToDict(colorProfile.get_extrinsics_to(depthProfile))
+    }
+
+def intrinsicsToDict(intrinsics) -> dict:
+    """Converts rs.intrinsics to a JSON serializable dict
+
+    Args:
+        intrinsics (rs.intrinsics): intrinsics of a video stream
+
+    Returns:
+        dict: width, height, ppx, ppy, fx, fy, model and coeffs
+    """
+    return {
+        "width":  intrinsics.width,
+        "height": intrinsics.height,
+        "ppx":    intrinsics.ppx,
+        "ppy":    intrinsics.ppy,
+        "fx":     intrinsics.fx,
+        "fy":     intrinsics.fy,
+        "model":  str(intrinsics.model),
+        "coeffs": list(intrinsics.coeffs)
+    }
+
+def extrinsicsToDict(extrinsics) -> dict:
+    """Converts rs.extrinsics to a JSON serializable dict
 
-def getIntrinsics():
-    return rs.intrinsics
+    Args:
+        extrinsics (rs.extrinsics): transformation between two streams
 
-def frameToPointCloud(depth_frame, color_frame):
-    pc = rs.pointcloud()
-    points = pc.calculate(depth_frame)
-    pc.map_to(color_frame)
+    Returns:
+        dict: rotation (3x3 row-major list) and translation (meters)
+    """
+    rotation = np.array(extrinsics.rotation).reshape(3, 3).T  # Column-major in librealsense
     
+    return {
+        "rotation":    rotation.tolist(),
+        "translation": list(extrinsics.translation)
+    }
+
 def run():     
   
     device = getCamera()
@@ -170,13 +493,6 @@ def run():
         color_frame    = aligned_frames.first(rs.stream.color)
         depth_frame    = aligned_frames.get_depth_frame()
 
-        # depth_frame = rs.decimation_filter(1).process(depth_frame)
-        # depth_frame = rs.disparity_transform(True).process(depth_frame)
-        # depth_frame = rs.spatial_filter().process(depth_frame)
-        # depth_frame = rs.temporal_filter().process(depth_frame)
-        # depth_frame = rs.disparity_transform(False).process(depth_frame)
-        # depth_frame = rs.hole_filling_filter().process(depth_frame)
-        
         if not depth_frame or not color_frame:
             continue
 
@@ -198,13 +514,10 @@ def run():
             return
 
 if __name__ == "__main__":
-    # print(getIntrinsics().fx)
-    imgD   = cv2.imread("D_20230426_144008_00000.tiff", cv2.IMREAD_ANYDEPTH)
-    imgD = imgD / 255
-    # imgRGB = cv2.imread("RGB_20230426_144008_00000.jpeg")
-
-    for x, row in enumerate(imgD):
-        for y, value in enumerate(row):
-            print( rs.rs2_deproject_pixel_to_point(rs.intrinsics(), [float(x), float(y)], float(imgD[x][y])) )
-    # rs.rs2_deproject_pixel_to_point()
-    # frameToPointCloud(imgD, imgRGB)
\ No newline at end of file
+    calibration = cb.loadCalibration(".")
+    
+    imgD   = cv2.imread("D_20230426_144008_00000.png", cv2.IMREAD_ANYDEPTH)
+    imgRGB = cv2.imread("RGB_20230426_144008_00000.jpeg")
+    
+    points = dp.depthToPointCloud(imgD, calibration, imgRGB)
+    print(points.shape, points[:, 2].min(), points[:, 2].max())
@@ -0,0 +1,354 @@
+from datetime import datetime
+import sessionJournal as sj
+import sessionStore as ss
+import frameIndex as fi
+import argparse
+import hashlib
+import sqlite3
+import bisect
+import os
+
+DATABASE_PATH = "Database"
+CATALOG_FILE  = "catalog.sqlite"
+HASH_BLOCK    = 1 << 20  # Bytes read at once when hashing a file
+
+# kind of each file of the database, from its prefix and extension
+FILE_KINDS = {
+    ("RGB_", ".jpeg"): "rgb",
+    ("D_",   ".png"):  "depth",
+    ("D_",   ".tiff"): "depthColorized"
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,  -- Relative to the database folder
+    patientID   INTEGER,
+    location    TEXT,
+    camera      TEXT,              -- Serial number for multi-camera recordings
+    kind        TEXT,              -- rgb, depth, depthColorized or session
+    frameCount  INTEGER,           -- Position of the frame in its recording, number of frames of a session
+    captureTime TEXT,              -- Date of the frame (ISO), from its name
+    timestamp   REAL,              -- Hardware timestamp (ms), from the frame index of the recording
+    size        INTEGER,
+    mtime       REAL,
+    checksum    TEXT               -- BLAKE2b (128 bits) of the file content
+);
+CREATE INDEX IF NOT EXISTS filesQuery ON files (location, kind, patientID);
+CREATE TABLE IF NOT EXISTS directories (
+    path  TEXT PRIMARY KEY,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS state (
+    key   TEXT PRIMARY KEY,
+    value
+);
+"""
+
+class Catalog:
+
+    def __init__(self, databasePath: str = DATABASE_PATH, catalogPath: str = None):
+        """SQLite catalog of the frames of the database, updated incrementally:
+           only the folders modified since the last update are listed, and
+           only new or modified files are hashed
+
+        Args:
+            databasePath (str): root of the Database/ID/Location tree
+            catalogPath (str, optional): SQLite file, <databasePath>/catalog.sqlite
+                                         by default
+        """
+        self.databasePath = databasePath
+        self.connection   = sqlite3.connect(catalogPath or
+                                            os.path.join(databasePath, CATALOG_FILE))
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def update(self) -> int:
+        """Indexes the folders of the database modified since the last update
+
+        Returns:
+            int: number of files added or updated
+        """
+        knownDirectories = dict(self.connection.execute("SELECT path, mtime FROM directories"))
+        seenDirectories  = set()
+        updated          = 0
+
+        for directory, _, _ in os.walk(self.databasePath):
+            relativePath = os.path.relpath(directory, self.databasePath)
+
+            if relativePath.endswith(ss.SESSION_EXTENSION):
+                continue
+
+            seenDirectories.add(relativePath)
+
+            if knownDirectories.get(relativePath) != os.path.getmtime(directory):
+                updated += self.updateDirectory(directory)
+
+        # Folders deleted since the last update
+        for relativePath in set(knownDirectories) - seenDirectories:
+            self.removeDirectory(relativePath)
+
+        self.connection.commit()
+        return updated
+
+    def updateFromJournal(self, journalPath: str = None) -> int:
+        """Indexes the folders recorded since the last call, found in the
+           acquisition journal instead of listing the whole database
+
+        Args:
+            journalPath (str, optional): <databasePath>/journal.jsonl by default
+
+        Returns:
+            int: number of files added or updated
+        """
+        journalPath = journalPath or os.path.join(self.databasePath, sj.JOURNAL_FILE)
+        row         = self.connection.execute("SELECT value FROM state WHERE key = 'journalTime'").fetchone()
+        lastTime    = row[0] if row else ""
+        directories = set()
+
+        for entry in sj.readJournal(journalPath):
+            if entry["time"] > lastTime and entry["event"] in ("stop", "recovered"):
+                directories.add(entry["directory"])
+                lastTime = entry["time"]
+
+        updated = 0
+
+        for directory in directories:
+            # Journal paths are relative to the working directory of the app
+            directory = os.path.join(self.databasePath,
+                                     os.path.relpath(directory, DATABASE_PATH))
+
+            if os.path.isdir(directory):
+                updated += self.updateDirectory(directory)
+
+                # Cameras of a multi-camera recording
+                for entry in os.scandir(directory):
+                    if entry.is_dir() and not entry.name.endswith(ss.SESSION_EXTENSION):
+                        updated += self.updateDirectory(entry.path)
+
+        self.connection.execute("INSERT OR REPLACE INTO state VALUES ('journalTime', ?)",
+                                (lastTime,))
+        self.connection.commit()
+        return updated
+
+    def updateDirectory(self, directory: str) -> int:
+        """Indexes the new and modified files of a folder, and forgets the
+           deleted ones
+
+        Returns:
+            int: number of files added or updated
+        """
+        relativeDirectory = os.path.relpath(directory, self.databasePath)
+        patientID, location, camera = parseDirectory(relativeDirectory)
+
+        known = {row["path"]: (row["size"], row["mtime"]) for row in self.connection.execute(
+                 "SELECT path, size, mtime FROM files WHERE path LIKE ? ESCAPE '\\'",
+                 (escapeLike(os.path.join(relativeDirectory, "")) + "%",))
+                 if os.path.dirname(row["path"]) == relativeDirectory}
+
+        timestamps = RecordingTimestamps(directory)
+        rows       = []
+        seen       = set()
+
+        for entry in os.scandir(directory):
+            kind = getKind(entry)
+
+            if not kind:
+                continue
+
+            path = os.path.join(relativeDirectory, entry.name)
+            seen.add(path)
+
+            # The index of a session is the last file written for each frame
+            stat = os.stat(os.path.join(entry.path, ss.INDEX_FILE)) if kind == "session" \
+                   else entry.stat()
+
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                continue
+
+            if kind == "session":
+                frameCount  = len(ss.SessionReader(entry.path))
+                captureTime = parseDate(entry.name[:-len(ss.SESSION_EXTENSION)])
+                timestamp   = None
+                size        = getDirectorySize(entry.path)
+                checksum    = None
+            else:
+                captureTime, frameCount = parseFrameName(entry.name)
+                timestamp   = timestamps.get(captureTime, frameCount)
+                size        = stat.st_size
+                checksum    = hashFile(entry.path)
+
+            rows.append((path, patientID, location, camera, kind, frameCount,
+                         captureTime, timestamp, size, stat.st_mtime, checksum))
+
+        self.connection.executemany("INSERT OR REPLACE INTO files VALUES "
+                                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.connection.executemany("DELETE FROM files WHERE path = ?",
+                                    [(path,) for path in set(known) - seen])
+        self.connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?)",
+                                (relativeDirectory, os.path.getmtime(directory)))
+
+        return len(rows)
+
+    def removeDirectory(self, relativeDirectory: str):
+        self.connection.execute("DELETE FROM directories WHERE path = ?", (relativeDirectory,))
+        self.connection.execute("DELETE FROM files WHERE path LIKE ? ESCAPE '\\'",
+                                (escapeLike(os.path.join(relativeDirectory, "")) + "%",))
+
+    def query(self, kind: str = None, location: str = None, patientIDs: tuple = None,
+              camera: str = None, start: str = None, end: str = None) -> list:
+        """Selects frames of the database
+
+        Args:
+            kind (str, optional): rgb, depth, depthColorized or session
+            location (str, optional): name of the location folder
+            patientIDs (tuple, optional): (first, last) range of patient IDs
+            camera (str, optional): serial number of the camera
+            start (str, optional): minimum capture date (ISO)
+            end (str, optional): maximum capture date (ISO)
+
+        Returns:
+            list: sqlite3.Row with the columns of the files table, sorted by
+                  patient, location and capture
+        """
+        conditions = []
+        parameters = []
+
+        for column, value in (("kind", kind), ("location", location), ("camera", camera)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+
+        if patientIDs is not None:
+            conditions.append("patientID BETWEEN ? AND ?")
+            parameters += list(patientIDs)
+
+        if start is not None:
+            conditions.append("captureTime >= ?")
+            parameters.append(start)
+
+        if end is not None:
+            conditions.append("captureTime <= ?")
+            parameters.append(end)
+
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+        return self.connection.execute(f"SELECT * FROM files{where} ORDER BY "
+                                       "patientID, location, captureTime, frameCount",
+                                       parameters).fetchall()
+
+    def getPaths(self, **filters) -> list:
+        """Returns the absolute paths of the frames selected by query()
+        """
+        return [os.path.join(self.databasePath, row["path"]) for row in self.query(**filters)]
+
+class RecordingTimestamps:
+
+    def __init__(self, directory: str):
+        """Hardware timestamps of the frames of a folder, read from the frame
+           indexes of its recordings. A frame belongs to the last recording
+           started before it
+        """
+        self.indexes = []
+
+        # Interrupted recordings only have the rows file of their index
+        for fileName in sorted(set(map(fi.getIndexPath, os.listdir(directory)))):
+            if fileName.startswith("frames_") and fileName.endswith(fi.INDEX_EXTENSION):
+                startTime = parseDate(fileName[len("frames_"):-len(fi.INDEX_EXTENSION)])
+                self.indexes.append((startTime, os.path.join(directory, fileName)))
+
+        self.startTimes = [startTime for startTime, _ in self.indexes]
+        self.loaded     = {}
+
+    def get(self, captureTime: str, frameCount: int) -> float:
+        """Returns the timestamp of a frame (ms), None if not indexed
+        """
+        if captureTime is None:
+            return None
+
+        position = bisect.bisect_right(self.startTimes, captureTime) - 1
+
+        if position < 0:
+            return None
+
+        if position not in self.loaded:
+            index = fi.FrameIndex(self.indexes[position][1])
+            self.loaded[position] = dict(zip(index["frameIndex"].tolist(),
+                                             index["timestamp"].tolist()))
+
+        return self.loaded[position].get(frameCount)
+
+def parseDirectory(relativeDirectory: str) -> tuple:
+    """Returns the patient ID, location and camera of a folder of the database
+    """
+    parts     = [] if relativeDirectory == "." else relativeDirectory.split(os.sep)
+    parts    += [None] * (3 - len(parts))
+    patientID = int(parts[0]) if parts[0] and parts[0].isdigit() else parts[0]
+
+    return patientID, parts[1], parts[2]
+
+def parseDate(text: str) -> str:
+    """Converts a %Y%m%d_%H%M%S date of a file name to ISO format, None if invalid
+    """
+    try:
+        return datetime.strptime(text, "%Y%m%d_%H%M%S").isoformat()
+    except ValueError:
+        return None
+
+def parseFrameName(fileName: str) -> tuple:
+    """Returns the capture date (ISO) and the frame count of a frame file
+       named <prefix>_<date>_<time>_<count>.<extension>, None if unknown
+    """
+    stem           = os.path.splitext(fileName)[0].split("_", 1)[1]
+    date, _, count = stem.rpartition("_")
+
+    return parseDate(date), int(count) if count.isdigit() else None
+
+def getKind(entry: os.DirEntry) -> str:
+    if entry.is_dir():
+        return "session" if entry.name.endswith(ss.SESSION_EXTENSION) else None
+
+    for (prefix, extension), kind in FILE_KINDS.items():
+        if entry.name.startswith(prefix) and entry.name.endswith(extension) and \
+           ".tmp" not in entry.name:
+            return kind
+
+    return None
+
+def hashFile(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def getDirectorySize(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+def escapeLike(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Indexes the frames of the database")
+    parser.add_argument("--database", default=DATABASE_PATH)
+    parser.add_argument("--journal",  action="store_true",
+                        help="only indexes the recordings found in the journal")
+    parser.add_argument("--kind")
+    parser.add_argument("--location")
+    parser.add_argument("--patients", type=int, nargs=2, metavar=("FIRST", "LAST"))
+    args = parser.parse_args()
+
+    catalog = Catalog(args.database)
+    updated = catalog.updateFromJournal() if args.journal else catalog.update()
+    print(f"{updated} files indexed")
+
+    if args.kind or args.location or args.patients:
+        for path in catalog.getPaths(kind=args.kind, location=args.location,
+                                     patientIDs=args.patients):
+            print(path)
+
+    catalog.close()
@@ -0,0 +1,180 @@
+from functools import lru_cache
+import frameSources as fs
+import sessionStore as ss
+import calibration as cb
+import numpy as np
+import cv2
+
+BATCH_FRAMES    = 16  # Frames deprojected at once by deprojectRecording()
+RAY_CACHE_SIZE  = 8   # Number of ray grids kept, one per distinct intrinsics
+
+def getDepthIntrinsics(calibration: dict) -> dict:
+    """Returns the intrinsics of the recorded depth images: aligned depth
+       images share the intrinsics of the stream they are aligned to
+    """
+    return calibration[calibration.get("alignedTo") or "depth"]
+
+def intrinsicsKey(intrinsics: dict) -> tuple:
+    return (intrinsics["width"], intrinsics["height"], intrinsics["ppx"], intrinsics["ppy"],
+            intrinsics["fx"], intrinsics["fy"], intrinsics["model"], tuple(intrinsics["coeffs"]))
+
+def getRays(intrinsics: dict) -> np.ndarray:
+    """Returns the ray of each pixel: the x / z and y / z coordinates of the
+       points it sees. Computed once per intrinsics
+
+    Args:
+        intrinsics (dict): intrinsics of the image, see cameraWrapper.intrinsicsToDict()
+
+    Returns:
+        np.ndarray: read-only (height, width, 2) float32 grid
+    """
+    return computeRays(intrinsicsKey(intrinsics))
+
+@lru_cache(maxsize=RAY_CACHE_SIZE)
+def computeRays(key: tuple) -> np.ndarray:
+    width, height, ppx, ppy, fx, fy, model, coeffs = key
+
+    u, v = np.meshgrid(np.arange(width, dtype=np.float32),
+                       np.arange(height, dtype=np.float32))
+
+    x = (u - ppx) / fx
+    y = (v - ppy) / fy
+
+    if model == "distortion.inverse_brown_conrady":
+        x, y = undistort(x, y, coeffs)
+
+    rays = np.dstack((x, y)).astype(np.float32)
+    rays.flags.writeable = False
+
+    return rays
+
+def undistort(x: np.ndarray, y: np.ndarray, coeffs: tuple) -> tuple:
+    """Removes the Brown-Conrady distortion of normalized coordinates,
+       iteratively like librealsense
+    """
+    k1, k2, p1, p2, k3 = coeffs
+    x0, y0 = x, y
+
+    for _ in range(10):
+        r2 = x * x + y * y
+        icdist = 1 / (1 + ((k3 * r2 + k2) * r2 + k1) * r2)
+        xq = x0 * icdist
+        yq = y0 * icdist
+        deltaX = 2 * p1 * xq * yq + p2 * (r2 + 2 * xq * xq)
+        deltaY = 2 * p2 * xq * yq + p1 * (r2 + 2 * yq * yq)
+        x = (x0 - deltaX) * icdist
+        y = (y0 - deltaY) * icdist
+
+    return x, y
+
+def projectPoints(points: np.ndarray, intrinsics: dict) -> tuple:
+    """Projects 3D points on an image
+
+    Args:
+        points (np.ndarray): (..., 3) points in meters, z > 0
+        intrinsics (dict): intrinsics of the image
+
+    Returns:
+        tuple: u and v float pixel coordinates
+    """
+    x = points[..., 0] / points[..., 2]
+    y = points[..., 1] / points[..., 2]
+
+    if intrinsics["model"] in ("distortion.modified_brown_conrady",
+                               "distortion.brown_conrady"):
+        k1, k2, p1, p2, k3 = intrinsics["coeffs"]
+        r2 = x * x + y * y
+        f  = 1 + k1 * r2 + k2 * r2 * r2 + k3 * r2 * r2 * r2
+        x, y = (x * f + 2 * p1 * x * y + p2 * (r2 + 2 * x * x),
+                y * f + 2 * p2 * x * y + p1 * (r2 + 2 * y * y))
+
+    return x * intrinsics["fx"] + intrinsics["ppx"], y * intrinsics["fy"] + intrinsics["ppy"]
+
+def deprojectDepth(depth: np.ndarray, intrinsics: dict, depthScale: float) -> np.ndarray:
+    """Converts raw depth images to organized point clouds
+
+    Args:
+        depth (np.ndarray): (height, width) z16 depth image, or a
+                            (frames, height, width) batch of images
+        intrinsics (dict): intrinsics of the depth images
+        depthScale (float): meters per depth unit
+
+    Returns:
+        np.ndarray: (..., height, width, 3) float32 points in meters, (0, 0, 0)
+                    where the depth is invalid
+    """
+    rays   = getRays(intrinsics)
+    z      = depth.astype(np.float32) * np.float32(depthScale)
+    points = np.empty(depth.shape + (3,), dtype=np.float32)
+
+    np.multiply(rays[..., 0], z, out=points[..., 0])
+    np.multiply(rays[..., 1], z, out=points[..., 1])
+    points[..., 2] = z
+
+    return points
+
+def depthToPointCloud(depth: np.ndarray, calibration: dict,
+                      color: np.ndarray = None) -> np.ndarray:
+    """Converts a raw depth image to the list of its valid points
+
+    Args:
+        depth (np.ndarray): z16 depth image
+        calibration (dict): calibration of the recording, see CameraWrapper.getCalibration()
+        color (np.ndarray, optional): BGR image aligned with the depth image
+
+    Returns:
+        np.ndarray: (N, 3) XYZ points in meters, or (N, 6) XYZRGB points with
+                    colors in 0-255 if color is given
+    """
+    points = deprojectDepth(depth, getDepthIntrinsics(calibration),
+                            calibration["depthScale"])
+    valid  = depth > 0
+
+    if color is None:
+        return points[valid]
+
+    rgb = color[valid][:, ::-1].astype(np.float32)
+
+    return np.hstack((points[valid], rgb))
+
+def deprojectRecording(path: str, batchFrames: int = BATCH_FRAMES):
+    """Deprojects the depth images of a recording, batch by batch
+
+    Args:
+        path (str): .session container or folder of D_*.png images with a
+                    calibration.json
+        batchFrames (int): number of frames per batch
+
+    Yields:
+        tuple: positions of the frames in the recording and their
+               (frames, height, width, 3) organized point clouds
+    """
+    if path.rstrip("/\\").endswith(ss.SESSION_EXTENSION):
+        session     = ss.SessionReader(path)
+        calibration = session.calibration
+        readDepth   = lambda i: session[i][1]
+        length      = len(session)
+    else:
+        depthPaths  = [depthPath for _, depthPath in fs.findFramePairs(path)]
+        calibration = cb.loadCalibration(path)
+        readDepth   = lambda i: readRawDepth(depthPaths[i])
+        length      = len(depthPaths)
+
+    if not calibration:
+        raise Exception(f"No calibration found for {path}")
+
+    intrinsics = getDepthIntrinsics(calibration)
+
+    for start in range(0, length, batchFrames):
+        positions = range(start, min(start + batchFrames, length))
+        depths    = np.stack([readDepth(i) for i in positions])
+
+        yield list(positions), deprojectDepth(depths, intrinsics, calibration["depthScale"])
+
+def readRawDepth(path: str) -> np.ndarray:
+    depth = cv2.imread(path, cv2.IMREAD_UNCHANGED) if path else None
+
+    if depth is None or depth.dtype != np.uint16:
+        raise IOError(f"{path} is not a raw depth image")
+
+    return depth
@@ -0,0 +1,273 @@
+from multiprocessing import shared_memory
+from frames import Frames
+import frameIndex as fi
+import numpy as np
+
+BUS_SLOTS = 8  # Frames held in shared memory, between the capture, the anonymizers, the GUI and the writer
+
+# States of a slot, in the order a frame goes through them
+FREE, WRITING, CAPTURED, ANONYMIZING, READY = range(5)
+
+ALIGN_TARGETS = [None, "color", "depth"]  # Values of metadata["alignedTo"], stored as their index
+
+# Metadata of the frames stored in the header of each slot
+METADATA_COLUMNS = {name: dtype for name, dtype in fi.INDEX_COLUMNS.items() if name != "frameIndex"}
+
+SLOT_DTYPE = np.dtype([("sequence",   "<i8"),
+                       ("state",      "<i4"),
+                       ("readers",    "<i4"),   # Processes reading the images in place
+                       ("colorShape", "<i4", 3),
+                       ("depthShape", "<i4", 2),
+                       ("alignedTo",  "<i4")] +
+                      [(name, dtype) for name, dtype in METADATA_COLUMNS.items()])
+
+class FrameBus:
+
+    def __init__(self, condition, width: int, height: int, slots: int = BUS_SLOTS,
+                 name: str = None):
+        """Ring of frames in shared memory, written by the capture process and
+           read in place by the other processes. Each slot has a header giving
+           the sequence number of its frame, its state and the number of
+           processes reading it: a slot is only overwritten when nobody reads
+           it, the oldest frame first
+
+        Args:
+            condition (multiprocessing.Condition): shared by the processes,
+                                                   guards the headers and
+                                                   signals state changes
+            width (int): maximum width of the images
+            height (int): maximum height of the images
+            slots (int): number of frames in the ring
+            name (str, optional): name of the shared memory block to attach
+                                  to, a new block is created by default
+        """
+        self.width     = width
+        self.height    = height
+        self.slots     = slots
+        self.condition = condition
+
+        pixels         = width * height
+        self.slotSizes = [pixels * 3, pixels * 3, pixels * 2]  # color, colorized depth, raw depth
+        self.slotSize  = sum(self.slotSizes)
+        headerSize     = SLOT_DTYPE.itemsize * slots
+        size           = headerSize + self.slotSize * slots
+
+        if name:
+            self.memory = shared_memory.SharedMemory(name=name)
+        else:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+
+        self.headers = np.ndarray(slots, SLOT_DTYPE, self.memory.buf)
+        self.data    = np.ndarray(self.slotSize * slots, np.uint8, self.memory.buf, headerSize)
+
+        if not name:
+            self.headers[:] = 0
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def getArgs(self) -> tuple:
+        """Returns the arguments attaching another process to the bus, after
+           the condition which can only be given to a process when it starts
+        """
+        return self.width, self.height, self.slots, self.name
+
+    def getImages(self, slot: int, colorShape: tuple, depthShape: tuple) -> tuple:
+        """Returns the color, colorized depth and raw depth images of a slot,
+           as views of the shared memory
+        """
+        start  = slot * self.slotSize
+        ends   = np.cumsum(self.slotSizes) + start
+        color  = self.data[start:start + int(np.prod(colorShape))]
+        depth  = self.data[ends[0]:ends[0] + int(np.prod(depthShape)) * 3]
+        raw    = self.data[ends[1]:ends[1] + int(np.prod(depthShape)) * 2]
+
+        return (color.reshape(colorShape),
+                depth.reshape(*depthShape, 3),
+                raw.view(np.uint16).reshape(depthShape))
+
+    def publish(self, frames: Frames, sequence: int) -> bool:
+        """Copies frames to the ring, executed by the capture process
+
+        Args:
+            frames (Frames): frames returned by the source
+            sequence (int): number of the frames, increasing
+
+        Returns:
+            int: number of frames dropped, the new frames if every slot is in
+                 use, or the frames they replace if not anonymized yet
+        """
+        with self.condition:
+            slot = self.claimSlot()
+
+            if slot is None:
+                return 1
+
+            header  = self.headers[slot]
+            dropped = int(header["state"] == CAPTURED)
+            header["state"]      = WRITING
+            header["colorShape"] = frames.color.shape
+            header["depthShape"] = frames.rawDepth.shape
+
+        # The slot belongs to the capture process until it is marked CAPTURED
+        color, depth, raw = self.getImages(slot, frames.color.shape, frames.rawDepth.shape)
+        np.copyto(color, frames.color)
+        np.copyto(depth, frames.depth)
+        np.copyto(raw,   frames.rawDepth)
+
+        for name in METADATA_COLUMNS:
+            header[name] = frames.metadata.get(name, 0)
+
+        header["alignedTo"] = ALIGN_TARGETS.index(frames.metadata.get("alignedTo"))
+
+        with self.condition:
+            header["sequence"] = sequence
+            header["state"]    = CAPTURED
+            self.condition.notify_all()
+
+        return dropped
+
+    def claimSlot(self) -> int:
+        """Returns a free slot, or the one of the oldest frame nobody reads.
+           The condition must be held
+        """
+        candidates = [slot for slot in range(self.slots)
+                      if self.headers[slot]["state"] in (FREE, CAPTURED, READY)
+                      and not self.headers[slot]["readers"]]
+
+        if not candidates:
+            return None
+
+        return min(candidates, key=lambda slot: (self.headers[slot]["state"] != FREE,
+                                                 self.headers[slot]["sequence"]))
+
+    def takeCaptured(self, timeout: float) -> int:
+        """Waits for the oldest frame not anonymized yet and marks it
+           ANONYMIZING, executed by the anonymizer processes
+
+        Returns:
+            int: slot of the frame, None after timeout seconds
+        """
+        with self.condition:
+            slot = self.findSlot(CAPTURED, newest=False)
+
+            if slot is None:
+                self.condition.wait(timeout)
+                slot = self.findSlot(CAPTURED, newest=False)
+
+            if slot is not None:
+                self.headers[slot]["state"] = ANONYMIZING
+
+            return slot
+
+    def setReady(self, slot: int, faces: int, detectorTime: float, fullDetection: bool):
+        """Marks an anonymized frame READY, executed by the anonymizer processes
+        """
+        with self.condition:
+            header = self.headers[slot]
+            header["faces"]         = faces
+            header["detectorTime"]  = detectorTime
+            header["fullDetection"] = fullDetection
+            header["state"]         = READY
+            self.condition.notify_all()
+
+    def waitReady(self, after: int, timeout: float) -> int:
+        """Waits for a READY frame more recent than after
+
+        Returns:
+            int: sequence number of the newest READY frame, None after timeout
+                 seconds
+        """
+        with self.condition:
+            if self.getNewestReady(after) is None:
+                self.condition.wait(timeout)
+
+            slot = self.getNewestReady(after)
+
+            return None if slot is None else int(self.headers[slot]["sequence"])
+
+    def takeLatest(self, after: int) -> tuple:
+        """Returns the newest READY frame more recent than after, retained,
+           and frees the older READY frames nobody reads
+
+        Returns:
+            tuple: slot (None if there is no new frame), number of frames freed
+                   without being returned
+        """
+        with self.condition:
+            slot = self.getNewestReady(after)
+
+            if slot is None:
+                return None, 0
+
+            self.headers[slot]["readers"] += 1
+            sequence = self.headers[slot]["sequence"]
+            freed    = 0
+
+            for older in range(self.slots):
+                header = self.headers[older]
+
+                if header["state"] == READY and not header["readers"] \
+                   and header["sequence"] < sequence:
+                    header["state"] = FREE
+                    freed          += header["sequence"] > after  # Never displayed
+
+            return slot, int(freed)
+
+    def retain(self, slot: int):
+        with self.condition:
+            self.headers[slot]["readers"] += 1
+
+    def release(self, slot: int):
+        with self.condition:
+            self.headers[slot]["readers"] -= 1
+
+    def findSlot(self, state: int, newest: bool, after: int = -1) -> int:
+        """Returns the slot in a state with the newest (or oldest) frame more
+           recent than after. The condition must be held
+        """
+        slots = [slot for slot in range(self.slots)
+                 if self.headers[slot]["state"] == state
+                 and self.headers[slot]["sequence"] > after]
+
+        if not slots:
+            return None
+
+        select = max if newest else min
+
+        return select(slots, key=lambda slot: self.headers[slot]["sequence"])
+
+    def getNewestReady(self, after: int) -> int:
+        return self.findSlot(READY, newest=True, after=after)
+
+    def getFrames(self, slot: int) -> Frames:
+        """Returns the frames of a slot, the images are views of the shared
+           memory: the slot must be retained or owned by the caller
+
+        Returns:
+            Frames: images and metadata, with the slot and sequence number of
+                    the frames
+        """
+        header            = self.headers[slot].copy()
+        color, depth, raw = self.getImages(slot, tuple(header["colorShape"]),
+                                           tuple(header["depthShape"]))
+
+        metadata = {name: header[name].item() for name in METADATA_COLUMNS}
+        metadata["alignedTo"] = ALIGN_TARGETS[header["alignedTo"]]
+        metadata["sequence"]  = int(header["sequence"])
+        metadata["slot"]      = slot
+
+        return Frames(color, depth, raw, metadata)
+
+    def close(self):
+        """Detaches the process from the shared memory
+        """
+        self.headers = None
+        self.data    = None
+        self.memory.close()
+
+    def unlink(self):
+        """Destroys the shared memory, called by the process that created it
+        """
+        self.memory.unlink()
@@ -0,0 +1,183 @@
+import numpy as np
+import threading
+import os
+
+INDEX_EXTENSION = ".npz"
+ROWS_EXTENSION  = ".rows"  # Appended to the path of the index, rows written during the recording
+
+# Columns of the index, one value per recorded frame
+INDEX_COLUMNS = {
+    "frameIndex":       np.int64,    # Position of the frame in the recording
+    "frameNumber":      np.int64,    # Color frame number given by the camera
+    "depthFrameNumber": np.int64,    # Depth frame number given by the camera
+    "timestamp":        np.float64,  # Hardware timestamp (ms)
+    "arrivalTime":      np.float64,  # Host time when the frame was received (ms)
+    "latency":          np.float64,  # arrivalTime - timestamp (ms)
+    "exposure":         np.float64,  # Actual exposure of the color sensor (us)
+    "anonymized":       np.bool_,    # Whether face detection ran on the frame
+    "fullDetection":    np.bool_,    # Whether the faces were searched at full resolution
+    "faces":            np.int32,    # Number of faces masked
+    "detectorTime":     np.float64   # Time spent in the face detector (ms)
+}
+
+ROW_DTYPE = np.dtype(list(INDEX_COLUMNS.items()))
+
+class FrameIndexWriter:
+
+    def __init__(self, path: str):
+        """Collects the metadata of the recorded frames and saves them as a
+           columnar .npz file (one array per column) when closed. Each row is
+           also appended to a rows file when it is added, FrameIndex reads it
+           if the recording was interrupted
+
+        Args:
+            path (str): destination of the index
+        """
+        self.path       = path
+        self.rows: list = []
+        self.lock       = threading.Lock()
+        self.rowsFile   = open(path + ROWS_EXTENSION, "ab")
+
+    def append(self, frameIndex: int, metadata: dict):
+        """Adds a frame to the index
+
+        Args:
+            frameIndex (int): position of the frame in the recording
+            metadata (dict): metadata returned with the frames by the camera
+        """
+        row    = dict(metadata, frameIndex=frameIndex)
+        record = np.array([tuple(row.get(name, -1) for name in INDEX_COLUMNS)], dtype=ROW_DTYPE)
+
+        with self.lock:
+            self.rows.append(row)
+            self.rowsFile.write(record.tobytes())
+            self.rowsFile.flush()
+
+    def close(self):
+        """Writes the index on disk, sorted by frame index, and removes the
+           rows file
+        """
+        with self.lock:
+            if self.rowsFile.closed:
+                return
+
+            self.rowsFile.close()
+
+            if self.rows:
+                rows    = sorted(self.rows, key=lambda row: row["frameIndex"])
+                columns = {name: np.array([row.get(name, -1) for row in rows], dtype=dtype)
+                           for name, dtype in INDEX_COLUMNS.items()}
+
+                # np.savez adds .npz to names that do not end with it
+                temporaryPath = self.path + ".tmp" + INDEX_EXTENSION
+
+                np.savez(temporaryPath, **columns)
+                os.replace(temporaryPath, self.path)
+
+            os.remove(self.path + ROWS_EXTENSION)
+
+class FrameIndex:
+
+    def __init__(self, path: str):
+        """Loads an index written by FrameIndexWriter, or the rows saved
+           before its recording was interrupted if it was not written
+
+        Args:
+            path (str): path of the .npz index
+        """
+        if os.path.exists(path):
+            with np.load(path) as data:
+                self.columns = {name: data[name] for name in data.files}
+        else:
+            self.columns = readRows(path + ROWS_EXTENSION)
+
+    def __len__(self) -> int:
+        return len(self.columns["frameIndex"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def select(self, start: float = None, end: float = None,
+               maxLatency: float = None, exposureRange: tuple = None,
+               anonymized: bool = None) -> np.ndarray:
+        """Selects frames without opening any image
+
+        Args:
+            start (float, optional): minimum hardware timestamp (ms)
+            end (float, optional): maximum hardware timestamp (ms)
+            maxLatency (float, optional): maximum arrival latency (ms)
+            exposureRange (tuple, optional): (min, max) exposure (us)
+            anonymized (bool, optional): anonymization state of the frames
+
+        Returns:
+            np.ndarray: frame indexes of the selected frames
+        """
+        mask = np.ones(len(self), dtype=bool)
+
+        if start is not None:
+            mask &= self["timestamp"] >= start
+
+        if end is not None:
+            mask &= self["timestamp"] <= end
+
+        if maxLatency is not None:
+            mask &= self["latency"] <= maxLatency
+
+        if exposureRange is not None:
+            mask &= (self["exposure"] >= exposureRange[0]) & \
+                    (self["exposure"] <= exposureRange[1])
+
+        if anonymized is not None:
+            mask &= self["anonymized"] == anonymized
+
+        return self["frameIndex"][mask]
+
+    def getCaptureStats(self) -> dict:
+        """Measures the regularity of the capture from the hardware metadata
+
+        Returns:
+            dict: frames, duration (ms), meanInterval, jitter (standard
+                  deviation of the interval, ms), maxInterval (ms),
+                  skippedFrames (frames missing between the first and last
+                  frame numbers), skipRate and meanLatency (ms)
+        """
+        timestamps   = self["timestamp"]
+        frameNumbers = self["frameNumber"]
+
+        if len(self) < 2:
+            return {"frames": len(self)}
+
+        intervals = np.diff(timestamps)
+        expected  = int(frameNumbers[-1] - frameNumbers[0]) + 1
+        skipped   = expected - len(np.unique(frameNumbers))
+        latency   = self["latency"][~np.isnan(self["latency"])]
+
+        return {
+            "frames":        len(self),
+            "duration":      float(timestamps[-1] - timestamps[0]),
+            "meanInterval":  float(intervals.mean()),
+            "jitter":        float(intervals.std()),
+            "maxInterval":   float(intervals.max()),
+            "skippedFrames": skipped,
+            "skipRate":      skipped / expected,
+            "meanLatency":   float(latency.mean()) if len(latency) else float("nan")
+        }
+
+def readRows(path: str) -> dict:
+    """Reads the rows file of an interrupted recording, a truncated last row
+       is ignored
+
+    Returns:
+        dict: one array per column, sorted by frame index
+    """
+    count = os.path.getsize(path) // ROW_DTYPE.itemsize
+    rows  = np.fromfile(path, dtype=ROW_DTYPE, count=count)
+    rows  = rows[np.argsort(rows["frameIndex"], kind="stable")]
+
+    return {name: rows[name] for name in INDEX_COLUMNS}
+
+def getIndexPath(path: str) -> str:
+    """Returns the path of the index of a rows file (accepted by FrameIndex),
+       path itself for any other file
+    """
+    return path[:-len(ROWS_EXTENSION)] if path.endswith(ROWS_EXTENSION) else path
@@ -0,0 +1,446 @@
+import multiprocessing as mp
+import frameSources as fs
+import frameWriter as fw
+import framePool as pl
+import calibration as cb
+import anonymizer as an
+import recorders as rc
+import blobStore as bs
+import frameBus as fb
+import functools
+import threading
+import queue
+import cv2
+import os
+
+ANONYMIZER_PROCESSES = max(1, (os.cpu_count() or 4) - 3)  # The capture, the writer and the GUI use a core each
+START_TIMEOUT        = 30   # Seconds given to the capture process to open the source
+COMMAND_TIMEOUT      = 5    # Seconds to wait for the reply of a process
+CLOSE_TIMEOUT        = 60   # Seconds given to the writer process to write the pending frames of a recording
+POLL_PERIOD          = 0.1  # Seconds between two checks of the stop event by the processes
+
+class ProcessPipeline:
+
+    def __init__(self, source: str, anonymizers: int = ANONYMIZER_PROCESSES):
+        """Runs the acquisition in several processes, each with its own GIL:
+           a capture process publishing the frames in a FrameBus (shared
+           memory), anonymizer processes masking the faces in place and a
+           writer process encoding the recorded frames. The GUI only displays
+           the frames, it exposes the interface of FrameProducer
+
+        Args:
+            source (str): source of the frames, see frameSources.openSource()
+            anonymizers (int): number of anonymizer processes
+
+        Raises:
+            Exception: If the source could not be opened
+        """
+        if source == "multi":
+            raise Exception("Several cameras cannot be captured in separate processes")
+
+        context = mp.get_context("spawn")  # Forking the Tk process is unsafe
+
+        self.onNewFrames                = None
+        self.lastSequence: int          = 0
+        self.skippedFrames: int         = 0
+        self.alignRecording: bool       = False
+
+        self.condition       = context.Condition()
+        self.running         = context.Event()
+        self.stopped         = context.Event()
+        self.anonymize       = context.Value("b", True)
+        self.detectFullSize  = context.Value("b", False)
+        self.counters        = context.Array("q", 2)  # Frames captured, dropped by the capture process
+        self.captureCommands = context.Queue()
+        self.captureReplies  = context.Queue()
+        self.writerCommands  = context.Queue()
+        self.writerReplies   = context.Queue()
+
+        self.captureProcess = context.Process(target=runCapture, name="Capture", daemon=True,
+                                              args=(source, self.condition, self.running,
+                                                    self.stopped, self.anonymize, self.counters,
+                                                    self.captureCommands, self.captureReplies))
+        self.captureProcess.start()
+
+        reply = self.captureReplies.get(timeout=START_TIMEOUT)
+
+        if reply[0] == "error":
+            self.captureProcess.join()
+            raise Exception(reply[1])
+
+        # The bus fits the largest images, the size of depth changes with
+        # decimation and alignment
+        calibration = reply[1]
+        width       = max(calibration["color"]["width"],  calibration["depth"]["width"])
+        height      = max(calibration["color"]["height"], calibration["depth"]["height"])
+
+        self.bus = fb.FrameBus(self.condition, width, height)
+        self.captureCommands.put(("bus", self.bus.getArgs()))
+
+        self.processes = [self.captureProcess]
+        self.processes += [context.Process(target=runAnonymizer, name=f"Anonymizer-{i}", daemon=True,
+                                           args=(self.condition, self.bus.getArgs(), calibration,
+                                                 self.detectFullSize, self.stopped))
+                           for i in range(anonymizers)]
+        self.processes += [context.Process(target=runWriter, name="Writer", daemon=True,
+                                           args=(self.condition, self.bus.getArgs(),
+                                                 self.writerCommands, self.writerReplies))]
+
+        for process in self.processes[1:]:
+            process.start()
+
+        self.thread = threading.Thread(target=self.notify, name="PipelineNotifier", daemon=True)
+
+    @property
+    def capturedFrames(self) -> int:
+        return self.counters[0]
+
+    @property
+    def droppedFrames(self) -> int:
+        return self.counters[1] + self.skippedFrames
+
+    @property
+    def enableAnonymization(self) -> bool:
+        return bool(self.anonymize.value)
+
+    @enableAnonymization.setter
+    def enableAnonymization(self, enabled: bool):
+        self.anonymize.value = enabled
+
+    @property
+    def fullDetection(self) -> bool:
+        return bool(self.detectFullSize.value)
+
+    @fullDetection.setter
+    def fullDetection(self, enabled: bool):
+        self.detectFullSize.value = enabled
+
+    @property
+    def alignRecordedFrames(self) -> bool:
+        return self.alignRecording
+
+    @alignRecordedFrames.setter
+    def alignRecordedFrames(self, enabled: bool):
+        self.alignRecording = enabled
+        self.captureCommands.put(("alignRecordedFrames", enabled))
+
+    def start(self):
+        self.running.set()
+        self.thread.start()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def stop(self):
+        """Stops the processes, the recording must be closed before
+        """
+        self.stopped.set()
+        self.running.set()
+        self.writerCommands.put(("exit",))
+
+        for process in self.processes:
+            process.join(COMMAND_TIMEOUT)
+
+            if process.is_alive():
+                process.terminate()
+
+        if self.thread.is_alive():
+            self.thread.join()
+
+        self.bus.close()
+        self.bus.unlink()
+
+    def notify(self):
+        """Calls onNewFrames when anonymized frames are available, executed
+           by the notifier thread
+        """
+        notified = 0
+
+        while not self.stopped.is_set():
+            sequence = self.bus.waitReady(max(notified, self.lastSequence), POLL_PERIOD)
+
+            if sequence is not None and self.onNewFrames:
+                notified = sequence
+                self.onNewFrames()
+
+    def setFilterEnabled(self, name: str, enabled: bool):
+        self.captureCommands.put(("setFilterEnabled", name, enabled))
+
+    def getCalibration(self) -> dict:
+        """Returns the calibration of the source for the next frames, see
+           CameraWrapper.getCalibration()
+        """
+        self.captureCommands.put(("getCalibration",))
+
+        return self.captureReplies.get(timeout=COMMAND_TIMEOUT)[1]
+
+    def getLatestFrames(self):
+        """Returns the most recent anonymized frames and discards the older
+           ones
+
+        Returns:
+            Frames: images in shared memory, valid until they are released,
+                    None if no new frames were anonymized since the last call
+        """
+        slot, skipped = self.bus.takeLatest(self.lastSequence)
+
+        if slot is None:
+            return None
+
+        frames              = self.bus.getFrames(slot)
+        self.lastSequence   = frames.metadata["sequence"]
+        self.skippedFrames += skipped
+
+        return frames
+
+    def release(self, frames):
+        """Releases frames returned by getLatestFrames()
+        """
+        self.bus.release(frames.metadata["slot"])
+
+    def createRecorder(self, directory: str, calibration: dict, recordingFormat: str = "files",
+                       depthFormat: str = "raw", blobsPath: str = None):
+        """Starts a recording in the writer process
+
+        Args:
+            directory (str): destination folder, must exist
+            calibration (dict): see getCalibration()
+            recordingFormat (str): see app.RECORDING_FORMAT
+            depthFormat (str): "raw" or "colorized", see recorders.FileRecorder
+            blobsPath (str, optional): folder of the BlobStore of the "blobs" format
+
+        Returns:
+            PipelineRecorder: recorder writing the frames in the writer process,
+                              see recorders.createRecorder()
+        """
+        self.writerCommands.put(("start", directory, calibration, recordingFormat,
+                                 depthFormat, blobsPath))
+
+        return PipelineRecorder(self)
+
+    def getStats(self) -> dict:
+        return {
+            "captured":    self.capturedFrames,
+            "dropped":     self.droppedFrames,
+            "anonymizers": len(self.processes) - 2
+        }
+
+class PipelineRecorder:
+
+    def __init__(self, pipeline: ProcessPipeline):
+        """Sends the frames to record to the writer process of a pipeline, which
+           reads them in place
+        """
+        self.pipeline        = pipeline
+        self.onWritten: dict = {}    # Callbacks of the frames being written, indexed by frame count
+        self.error: str      = None  # Set by close() if the recording may be incomplete
+
+    def write(self, frames, frameCount: int, onWritten=None):
+        """Queues the writing of frames returned by ProcessPipeline.getLatestFrames(),
+           their slot is retained until they are written
+
+        Args:
+            frames (Frames): frames in the bus
+            frameCount (int): position of the frames in the recording
+            onWritten (callable, optional): called without arguments, by the
+                                            next call of write() or close(),
+                                            once the frames are written
+        """
+        self.pipeline.bus.retain(frames.metadata["slot"])
+
+        if onWritten:
+            self.onWritten[frameCount] = onWritten
+
+        self.pipeline.writerCommands.put(("write", frames.metadata["slot"], frameCount))
+        self.readReplies(block=False)
+
+    def readReplies(self, block: bool) -> dict:
+        """Calls the callbacks of the frames written by the writer process
+
+        Args:
+            block (bool): if true, waits for the reply to "stop"
+
+        Returns:
+            dict: statistics of the writer, None if not received
+        """
+        while True:
+            try:
+                reply = self.pipeline.writerReplies.get(block, CLOSE_TIMEOUT)
+            except queue.Empty:
+                return None
+
+            if reply[0] == "stopped":
+                return reply[1]
+
+            onWritten = self.onWritten.pop(reply[1], None)
+
+            if onWritten:
+                onWritten()
+
+    def close(self):
+        """Waits for every frame to be written and closes the recording, sets
+           error if the writer process did not reply in time
+        """
+        self.pipeline.writerCommands.put(("stop",))
+
+        if self.readReplies(block=True) is None:
+            self.error = "The writer process did not close the recording"
+
+def runCapture(source: str, condition, running, stopped, anonymize, counters,
+               commands, replies):
+    """Capture process: opens the source and publishes its frames in the bus,
+       the faces are masked by the anonymizer processes
+    """
+    try:
+        camera = fs.openSource(source)
+    except Exception as e:
+        replies.put(("error", str(e)))
+        return
+
+    replies.put(("ready", camera.getCalibration()))
+
+    bus      = fb.FrameBus(condition, *commands.get()[1])
+    sequence = 0
+
+    while not stopped.is_set():
+        try:
+            # Commands are read without delay while capturing
+            command = commands.get(timeout=POLL_PERIOD) if not running.is_set() \
+                      else commands.get_nowait()
+
+            if command[0] == "getCalibration":
+                replies.put(("calibration", camera.getCalibration()))
+            elif command[0] == "setFilterEnabled" and hasattr(camera, "setFilterEnabled"):
+                # Only RealSense cameras have filters
+                camera.setFilterEnabled(*command[1:])
+            elif command[0] == "alignRecordedFrames" and hasattr(camera, "alignRecordedFrames"):
+                camera.alignRecordedFrames = command[1]
+        except queue.Empty:
+            pass
+        except Exception as e:
+            # A failed command must not stop the capture
+            print(e)
+
+        if not running.is_set() or stopped.is_set():
+            continue
+
+        try:
+            frames = camera.getNextFrames(False)
+        except RuntimeError:
+            # wait_for_frames() timed out, keep on trying
+            continue
+
+        if not frames:
+            continue
+
+        frames.metadata["anonymized"] = bool(anonymize.value)
+        sequence += 1
+
+        dropped = bus.publish(frames, sequence)
+        pl.sharedPool.release(frames)
+
+        with counters.get_lock():
+            counters[0] += 1
+            counters[1] += dropped
+
+    bus.close()
+
+def runAnonymizer(condition, busArgs: tuple, calibration: dict, detectFullSize, stopped):
+    """Anonymizer process: masks the faces of the captured frames in place.
+       Each process tracks the faces of the frames it receives
+    """
+    bus        = fb.FrameBus(condition, *busArgs)
+    anonymizer = None
+
+    while not stopped.is_set():
+        slot = bus.takeCaptured(POLL_PERIOD)
+
+        if slot is None:
+            continue
+
+        frames = bus.getFrames(slot)
+        height, width = frames.color.shape[:2]
+
+        if anonymizer is None:
+            # The frames are shared between the processes, a box cannot be
+            # propagated to the next frame of the stream: detect on every frame
+            anonymizer = an.Anonymizer(width, height, detectEvery=1)
+        elif (anonymizer.width, anonymizer.height) != (width, height):
+            anonymizer.resize(width, height)
+
+        enabled = frames.metadata["anonymized"]
+        anonymizer.fullDetection = bool(detectFullSize.value)
+
+        if frames.metadata["alignedTo"]:
+            faces = anonymizer.anonymize(enabled, frames.color, frames.depth, frames.rawDepth)
+        else:
+            faces = anonymizer.anonymize(enabled, frames.color)
+
+            for face in faces:
+                depthFace = cb.colorBoxToDepth(face, frames.rawDepth.shape, calibration)
+                cv2.rectangle(frames.depth,    depthFace, (0, 0, 0), -1)
+                cv2.rectangle(frames.rawDepth, depthFace, 0, -1)
+
+        bus.setReady(slot, len(faces), anonymizer.detectorTime, anonymizer.fullDetectionDone)
+
+    bus.close()
+
+def runWriter(condition, busArgs: tuple, commands, replies):
+    """Writer process: records the frames sent by PipelineRecorder, reading
+       them in place
+    """
+    bus       = fb.FrameBus(condition, *busArgs)
+    writer    = fw.FrameWriter()
+    blobStore = None
+    recorder  = None
+
+    while True:
+        command = commands.get()
+
+        if command[0] == "exit":
+            break
+
+        try:
+            if command[0] == "start":
+                directory, calibration, recordingFormat, depthFormat, blobsPath = command[1:]
+
+                if blobsPath and (blobStore is None or blobStore.path != blobsPath):
+                    blobStore = bs.BlobStore(blobsPath)
+
+                recorder = rc.createRecorder(directory, writer, calibration, recordingFormat,
+                                             depthFormat, blobStore, fs.TARGET_FPS)
+
+            elif command[0] == "write":
+                slot, frameCount = command[1:]
+
+                if recorder is None:
+                    bus.release(slot)
+                    continue
+
+                # The images are read in place, the slot is released once the
+                # files of the frames are written
+                recorder.write(bus.getFrames(slot), frameCount,
+                               functools.partial(frameWritten, bus, slot, frameCount, replies))
+
+            elif command[0] == "stop":
+                recorder.close()
+        except Exception as e:
+            print(e)
+
+        if command[0] == "stop":
+            # Always replied, PipelineRecorder.close() waits for it
+            recorder = None
+            replies.put(("stopped", writer.getStats()))
+
+    writer.close()
+    bus.close()
+
+def frameWritten(bus: fb.FrameBus, slot: int, frameCount: int, replies):
+    """Releases the slot of frames written by the writer process and
+       notifies PipelineRecorder, executed by a writer thread
+    """
+    bus.release(slot)
+    replies.put(("written", frameCount))
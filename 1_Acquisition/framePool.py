@@ -0,0 +1,114 @@
+from frames import Frames, MultiFrames
+import numpy as np
+import threading
+
+POOL_BUFFERS = 48  # Buffers kept per image shape, covers the producer ring, the writer queue and a burst
+
+class FramePool:
+
+    def __init__(self, buffers: int = POOL_BUFFERS):
+        """Reusable image buffers, to avoid allocating (and page faulting)
+           new arrays for every frame. Each buffer has a reference count:
+           acquire() returns it with one reference, retain() and release()
+           add and remove one, it goes back to the pool when none is left.
+           Arrays that do not come from the pool are ignored by retain() and
+           release(), so every source can be handled the same way
+
+        Args:
+            buffers (int): maximum number of buffers per shape and dtype,
+                           acquire() allocates unpooled arrays beyond
+        """
+        self.buffers     = buffers
+        self.lock        = threading.Lock()
+        self.free: dict  = {}  # Available buffers indexed by (shape, dtype)
+        self.owned: dict = {}  # Number of buffers created for each (shape, dtype)
+
+        # Reference count and buffer, indexed by id(buffer). Buffers are never
+        # freed, so their ids cannot be reused by other arrays
+        self.references: dict = {}
+
+        self.allocated: int = 0
+        self.reused: int    = 0
+        self.misses: int    = 0
+
+    def acquire(self, shape: tuple, dtype) -> np.ndarray:
+        """Returns a buffer with one reference, its content is undefined
+
+        Args:
+            shape (tuple): shape of the image
+            dtype (np.dtype): type of the pixels
+        """
+        key = (tuple(shape), np.dtype(dtype))
+
+        with self.lock:
+            free = self.free.setdefault(key, [])
+
+            if free:
+                buffer = free.pop()
+                self.reused += 1
+            elif self.owned.get(key, 0) < self.buffers:
+                buffer = np.empty(shape, dtype)
+                self.owned[key] = self.owned.get(key, 0) + 1
+                self.allocated += 1
+            else:
+                # Every buffer is in use, e.g. the writer is far behind
+                self.misses += 1
+                return np.empty(shape, dtype)
+
+            self.references[id(buffer)] = [1, buffer]
+
+        return buffer
+
+    def retain(self, *items):
+        """Adds a reference to the buffers of arrays, Frames or MultiFrames
+        """
+        with self.lock:
+            for buffer in getArrays(items):
+                reference = self.references.get(id(buffer))
+
+                if reference:
+                    reference[0] += 1
+
+    def release(self, *items):
+        """Removes a reference from the buffers of arrays, Frames or
+           MultiFrames, buffers without references go back to the pool
+        """
+        with self.lock:
+            for buffer in getArrays(items):
+                reference = self.references.get(id(buffer))
+
+                if not reference:
+                    continue
+
+                reference[0] -= 1
+
+                if reference[0] == 0:
+                    del self.references[id(buffer)]
+                    self.free[(buffer.shape, buffer.dtype)].append(buffer)
+
+    def getStats(self) -> dict:
+        """Returns the number of buffers allocated, reused and in use, and the
+           number of arrays allocated because the pool was empty
+        """
+        with self.lock:
+            return {
+                "allocated": self.allocated,
+                "reused":    self.reused,
+                "inUse":     len(self.references),
+                "misses":    self.misses
+            }
+
+def getArrays(items):
+    """Yields the arrays of a list of arrays, Frames and MultiFrames, other
+       values are skipped
+    """
+    for item in items:
+        if isinstance(item, MultiFrames):
+            yield from getArrays(item.views.values())
+        elif isinstance(item, Frames):
+            yield from (image for image in item[:3] if isinstance(image, np.ndarray))
+        elif isinstance(item, np.ndarray):
+            yield item
+
+# Shared by the cameras, the producers, the writers and the GUI
+sharedPool = FramePool()
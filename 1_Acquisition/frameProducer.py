@@ -0,0 +1,172 @@
+from collections import deque
+import framePool as pl
+import threading
+
+RING_SIZE = 4  # Number of frame pairs kept between the capture thread and the GUI
+
+class FrameProducer:
+
+    def __init__(self, camera, ringSize: int = RING_SIZE):
+        """Runs camera.getNextFrames() in a dedicated thread and stores the
+           results in a bounded ring buffer. When the ring is full, the oldest
+           frames are dropped.
+
+        Args:
+            camera (CameraWrapper): object exposing getNextFrames(enableAnonymization)
+            ringSize (int): maximum number of frame pairs kept in memory
+        """
+        self.camera                     = camera
+        self.enableAnonymization: bool  = True
+        self.capturedFrames: int        = 0
+        self.droppedFrames: int         = 0
+        self.lastError: Exception       = None
+        self.onNewFrames                = None   # Called from the capture thread when frames are available
+        self.framePool                  = pl.sharedPool  # Dropped frames are released to it
+
+        self.notified   = False  # onNewFrames was called and the frames were not read yet
+
+        self.ring       = deque(maxlen=ringSize)
+        self.lock       = threading.Lock()
+        self.running    = threading.Event()
+        self.stopped    = threading.Event()
+        self.thread     = threading.Thread(target=self.run, name="FrameProducer", daemon=True)
+
+    def start(self):
+        """Starts the capture thread
+        """
+        self.running.set()
+        self.thread.start()
+
+    def pause(self):
+        """Stops calling the camera until resume() is called, the ring is emptied
+        """
+        self.running.clear()
+
+        with self.lock:
+            self.framePool.release(*self.ring)
+            self.ring.clear()
+            self.notified = False
+
+    def resume(self):
+        """Calls the camera again, the frames captured while paused are dropped
+        """
+        with self.lock:
+            self.framePool.release(*self.ring)
+            self.ring.clear()
+            self.notified = False
+
+        self.running.set()
+
+    def stop(self):
+        """Stops the capture thread and waits for the current frame to complete
+        """
+        self.stopped.set()
+        self.running.set()
+
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def run(self):
+        """Capture loop, executed in the producer thread
+        """
+        while not self.stopped.is_set():
+
+            self.running.wait()
+
+            if self.stopped.is_set():
+                break
+
+            try:
+                frames = self.camera.getNextFrames(self.enableAnonymization)
+            except RuntimeError as e:
+                # wait_for_frames() timed out, keep on trying
+                self.lastError = e
+                continue
+
+            if not frames:
+                continue
+
+            with self.lock:
+                if not self.running.is_set():
+                    # Paused while the frames were captured: the ring was
+                    # emptied and nobody reads it until resume()
+                    self.framePool.release(frames)
+                    continue
+
+                if len(self.ring) == self.ring.maxlen:
+                    self.framePool.release(self.ring.popleft())
+                    self.droppedFrames += 1
+
+                self.ring.append(frames)
+                self.capturedFrames += 1
+
+                # A single notification until the frames are read, so that a
+                # slow consumer is not flooded
+                notify        = self.onNewFrames and not self.notified
+                self.notified = True
+
+            if notify:
+                self.onNewFrames()
+
+    def getLatestFrames(self):
+        """Returns the most recent frames and discards the older ones
+
+        Returns:
+            tuple: the latest result of getNextFrames(), None if no new frames
+                   were captured since the last call. The caller owns the
+                   frames and must release them, see FramePool.release()
+        """
+        with self.lock:
+            if not self.ring:
+                return None
+
+            frames        = self.ring.pop()
+            self.notified = False
+
+            self.droppedFrames += len(self.ring)
+            self.framePool.release(*self.ring)
+            self.ring.clear()
+
+        return frames
+
+    def release(self, frames):
+        """Releases frames returned by getLatestFrames() or getFramesNear()
+        """
+        self.framePool.release(frames)
+
+    def getLatestTimestamp(self) -> float:
+        """Returns the timestamp of the most recent frames, None if the ring
+           is empty
+        """
+        with self.lock:
+            return self.ring[-1].metadata["timestamp"] if self.ring else None
+
+    def getFramesNear(self, timestamp: float):
+        """Returns the frames whose timestamp is the closest to timestamp, and
+           discards them and the older ones
+
+        Args:
+            timestamp (float): hardware timestamp (ms), see getFrameMetadata()
+
+        Returns:
+            tuple: result of getNextFrames(), None if the ring is empty. The
+                   caller owns the frames, as with getLatestFrames()
+        """
+        with self.lock:
+            if not self.ring:
+                return None
+
+            closest = min(range(len(self.ring)), key=lambda i: 
+                          abs(self.ring[i].metadata["timestamp"] - timestamp))
+            frames  = self.ring[closest]
+
+            self.notified = False
+
+            for _ in range(closest):
+                self.framePool.release(self.ring.popleft())
+
+            self.ring.popleft()
+
+            self.droppedFrames += closest
+
+        return frames
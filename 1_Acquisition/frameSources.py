@@ -0,0 +1,235 @@
+from frames import Frames, StageTimer, colorizeDepth, estimateCalibration
+import sessionStore as ss
+import calibration as cb
+import anonymizer as an
+import numpy as np
+import time
+import lazyModules as lm
+import os
+
+cv2 = lm.lazyImport("cv2")
+
+TARGET_WIDTH  = 640  # Same defaults as cameraWrapper, which needs pyrealsense2
+TARGET_HEIGHT = 480
+TARGET_FPS    = 6
+
+class FrameSource:
+
+    def __init__(self, width: int, height: int, fps: float):
+        """Base of the sources replacing a camera, exposing the same interface
+           as CameraWrapper: getNextFrames(enableAnonymization), getCalibration()
+
+        Args:
+            width (int): width of the frames
+            height (int): height of the frames
+            fps (float): number of frames per second, 0 to return frames as
+                         fast as they are requested
+        """
+        self.width              = width
+        self.height             = height
+        self.fps                = fps
+        self.frameNumber: int   = 0
+        self.nextFrameTime      = time.perf_counter()
+        self.anonymizer         = an.Anonymizer(width, height)
+        self.stageTimes: dict   = {}
+
+    def getCalibration(self) -> dict:
+        return estimateCalibration(self.width, self.height)
+
+    def readFrame(self) -> tuple:
+        """Returns the next color and raw depth images, implemented by subclasses
+        """
+        raise NotImplementedError
+
+    def getNextFrames(self, enableAnonymization: bool) -> Frames:
+        """Returns the next frames at the rate of the source
+
+        Args:
+            enableAnonymization (bool): if true, will find faces with the anonymizer
+                                        and draw a black rectangle on them
+
+        Returns:
+            Frames: color image, colorized depth image, raw z16 depth image and
+                    metadata of the frames
+        """
+        if self.fps:
+            delay = self.nextFrameTime - time.perf_counter()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            self.nextFrameTime = max(self.nextFrameTime, time.perf_counter() - 1 / self.fps) \
+                                 + 1 / self.fps
+
+        timer                  = StageTimer()
+        color_image, raw_depth = self.readFrame()
+        arrivalTime            = time.time() * 1000
+        timer.lap("wait")
+
+        depth_image = colorizeDepth(raw_depth)
+        timer.lap("colorize")
+
+        faces = self.anonymizer.anonymize(enableAnonymization, color_image,
+                                          depth_image, raw_depth)
+        timer.lap("detect")
+        self.stageTimes = timer.times
+
+        self.frameNumber += 1
+
+        metadata = {
+            "timestamp":        arrivalTime,
+            "frameNumber":      self.frameNumber,
+            "depthFrameNumber": self.frameNumber,
+            "arrivalTime":      arrivalTime,
+            "latency":          0.,
+            "exposure":         float("nan"),
+            "anonymized":       enableAnonymization,
+            "fullDetection":    self.anonymizer.fullDetectionDone,
+            "faces":            len(faces),
+            "detectorTime":     self.anonymizer.detectorTime,
+            "alignedTo":        self.getCalibration().get("alignedTo", "color")
+        }
+
+        return Frames(color_image, depth_image, raw_depth, metadata)
+
+class SyntheticSource(FrameSource):
+
+    def __init__(self, width: int = TARGET_WIDTH, height: int = TARGET_HEIGHT,
+                 fps: float = TARGET_FPS):
+        """Generates moving test patterns: a color gradient scrolling
+           horizontally, and a tilted plane with noise and holes as depth
+        """
+        super().__init__(width, height, fps)
+
+        x, y = np.meshgrid(np.arange(width), np.arange(height))
+
+        self.gradient  = ((x + y) * 255 // (width + height)).astype(np.uint8)
+        self.plane     = (600 + 2 * y + x // 2).astype(np.uint16)
+        self.generator = np.random.default_rng(0)
+
+    def readFrame(self) -> tuple:
+        shift = 8 * self.frameNumber
+
+        color_image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        color_image[..., 0] = np.roll(self.gradient, shift, axis=1)
+        color_image[..., 1] = self.gradient
+        color_image[..., 2] = 255 - color_image[..., 0]
+
+        noise     = self.generator.integers(0, 8, (self.height, self.width), dtype=np.uint16)
+        raw_depth = self.plane + noise
+        raw_depth[noise == 0] = 0  # 1/8 of invalid pixels
+
+        return color_image, raw_depth
+
+class DirectorySource(FrameSource):
+
+    def __init__(self, path: str, fps: float = TARGET_FPS):
+        """Plays saved frames in a loop: the RGB_* and D_* images of a folder,
+           or a .session container
+
+        Args:
+            path (str): folder of the images or of the session
+            fps (float): number of frames per second, 0 for as fast as possible
+        """
+        self.path        = path
+        self.session     = None
+        self.calibration = None
+        self.position    = 0
+
+        if path.rstrip("/\\").endswith(ss.SESSION_EXTENSION):
+            self.session = ss.SessionReader(path)
+            self.length  = len(self.session)
+        else:
+            self.files  = findFramePairs(path)
+            self.length = len(self.files)
+
+        if not self.length:
+            raise Exception(f"No frames found in {path}")
+
+        if self.session:
+            self.calibration = self.session.calibration
+            height, width    = self.session[0][0].shape[:2]
+        else:
+            self.calibration = cb.loadCalibration(path)
+            height, width    = cv2.imread(self.files[0][0]).shape[:2]
+
+        super().__init__(width, height, fps)
+
+    def getCalibration(self) -> dict:
+        return self.calibration or super().getCalibration()
+
+    def readFrame(self) -> tuple:
+        i = self.position
+        self.position = (self.position + 1) % self.length
+
+        if self.session:
+            color_image, raw_depth = self.session[i]
+            return np.array(color_image), np.array(raw_depth)
+
+        rgbPath, depthPath = self.files[i]
+        color_image = cv2.imread(rgbPath)
+        raw_depth   = cv2.imread(depthPath, cv2.IMREAD_UNCHANGED) if depthPath else None
+
+        if raw_depth is None or raw_depth.dtype != np.uint16:
+            # Colorized depth images cannot be converted back to raw depth
+            raw_depth = np.zeros((self.height, self.width), dtype=np.uint16)
+
+        return color_image, raw_depth
+
+def findFramePairs(path: str) -> list:
+    """Lists the RGB images of a folder and their paired depth image
+
+    Returns:
+        list: (rgbPath, depthPath) tuples sorted by name, depthPath is None if
+              not found
+    """
+    fileNames = set(os.listdir(path))
+    pairs     = []
+
+    for fileName in sorted(fileNames):
+        if not (fileName.startswith("RGB_") and fileName.endswith(".jpeg")):
+            continue
+
+        stem      = fileName[len("RGB_"):-len(".jpeg")]
+        depthPath = None
+
+        for extension in (".png", ".tiff"):
+            if "D_" + stem + extension in fileNames:
+                depthPath = os.path.join(path, "D_" + stem + extension)
+
+        pairs.append((os.path.join(path, fileName), depthPath))
+
+    return pairs
+
+def openSource(source: str = "camera"):
+    """Creates the source of frames described by a string
+
+    Args:
+        source (str): "camera" for the first connected RealSense device,
+                      "multi" for every connected RealSense device,
+                      a .bag file recorded by a RealSense device,
+                      "synthetic" or "synthetic:<width>x<height>[@<fps>]",
+                      or a folder of saved frames / .session container
+
+    Returns:
+        CameraWrapper or FrameSource: object exposing getNextFrames() and
+                                      getCalibration(), or MultiCamera
+    """
+    if source == "multi":
+        import multiCamera as mc
+        return mc.MultiCamera()
+
+    if source == "camera" or source.endswith(".bag"):
+        # Imported here so that the other sources do not need pyrealsense2
+        import cameraWrapper as cw
+        return cw.CameraWrapper(bagFile=source if source.endswith(".bag") else None)
+
+    if source.startswith("synthetic"):
+        if ":" not in source:
+            return SyntheticSource()
+
+        size, _, fps  = source.split(":")[1].partition("@")
+        width, height = size.split("x")
+        return SyntheticSource(int(width), int(height), float(fps) if fps else TARGET_FPS)
+
+    return DirectorySource(source)
@@ -0,0 +1,221 @@
+import framePool as pl
+import contextlib
+import threading
+import queue
+import time
+import lazyModules as lm
+import os
+
+cv2 = lm.lazyImport("cv2")
+
+WRITER_THREADS    = 2   # Number of threads encoding and writing frames
+WRITER_QUEUE_SIZE = 32  # Maximum number of pending jobs before submit() blocks
+
+class FrameWriter:
+
+    def __init__(self, workers: int = WRITER_THREADS,
+                 maxQueueSize: int = WRITER_QUEUE_SIZE, fsync: bool = False):
+        """Pool of threads writing frames on disk in the background. Jobs are
+           taken from a bounded queue: when it is full, submit() blocks until a
+           worker is available (backpressure).
+
+        Args:
+            workers (int): number of writer threads
+            maxQueueSize (int): maximum number of pending jobs
+            fsync (bool): if true, every file is flushed to the disk before the
+                          job is considered done
+        """
+        self.fsync: bool            = fsync
+        self.writtenFiles: int      = 0
+        self.writtenBytes: int      = 0
+        self.totalLatency: float    = 0.
+        self.maxLatency: float      = 0.
+        self.blockedTime: float     = 0.
+        self.errors: int            = 0
+        self.lastError: Exception   = None
+        self.startTime: float       = None
+
+        self.queue   = queue.Queue(maxsize=maxQueueSize)
+        self.lock    = threading.Lock()
+        self.local   = threading.local()  # Batch of the jobs submitted by each thread, see batch()
+        self.threads = [threading.Thread(target=self.run, name=f"FrameWriter-{i}", daemon=True)
+                        for i in range(workers)]
+
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, function, *args):
+        """Queues a job, blocks while the queue is full
+
+        Args:
+            function (callable): called with *args by a worker thread, must
+                                 return the number of bytes written. Pooled
+                                 images and frames in args are retained until
+                                 the job is done
+        """
+        pl.sharedPool.retain(*args)
+
+        batch = getattr(self.local, "batch", None)
+
+        if batch:
+            with self.lock:
+                batch[0] += 1
+
+        if self.startTime is None:
+            self.startTime = time.perf_counter()
+
+        start = time.perf_counter()
+        self.queue.put((function, args, batch))
+        self.blockedTime += time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def batch(self, onDone):
+        """Groups the jobs submitted by the calling thread inside a with
+           block, e.g. the files of a frame: onDone is called by the worker
+           finishing the last one, or when the block exits if they are all
+           done (or none was submitted). Batches can be nested, the outer
+           batch is only done once the inner ones are
+
+        Args:
+            onDone (callable): called without arguments, once. None to only
+                               group the jobs
+        """
+        parent = getattr(self.local, "batch", None)
+        batch  = [1, onDone, parent]  # Pending jobs, plus one until the block exits
+
+        if parent:
+            with self.lock:
+                parent[0] += 1
+
+        self.local.batch = batch
+
+        try:
+            yield
+        finally:
+            self.local.batch = parent
+            self.completeJob(batch)
+
+    def completeJob(self, batch: list):
+        with self.lock:
+            batch[0] -= 1
+            done      = batch[0] == 0
+
+        if not done:
+            return
+
+        if batch[1]:
+            batch[1]()
+
+        if batch[2]:
+            self.completeJob(batch[2])
+
+    def writeImage(self, path: str, image, params: list = None):
+        """Queues the encoding and writing of an image, the format is deduced
+           from the extension of path
+
+        Args:
+            path (str): destination of the image
+            image (np.array): image to write, must not be modified afterwards
+            params (list, optional): encoding parameters given to cv2.imencode
+        """
+        self.submit(writeImageFile, path, image, params or [], self.fsync)
+
+    def run(self):
+        """Worker loop, executed in each writer thread
+        """
+        while True:
+            job = self.queue.get()
+
+            if job is None:
+                self.queue.task_done()
+                break
+
+            function, args, batch = job
+            start = time.perf_counter()
+
+            try:
+                size = function(*args)
+            except Exception as e:
+                print(e)
+                size = 0
+                with self.lock:
+                    self.errors   += 1
+                    self.lastError = e
+            finally:
+                pl.sharedPool.release(*args)
+
+            latency = time.perf_counter() - start
+
+            with self.lock:
+                self.writtenFiles += 1
+                self.writtenBytes += size or 0
+                self.totalLatency += latency
+                self.maxLatency    = max(self.maxLatency, latency)
+
+            if batch:
+                self.completeJob(batch)
+
+            self.queue.task_done()
+
+    def flush(self):
+        """Blocks until every queued job is written
+        """
+        self.queue.join()
+
+    def close(self):
+        """Writes the pending jobs then stops the worker threads
+        """
+        self.flush()
+
+        for _ in self.threads:
+            self.queue.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+    def getStats(self) -> dict:
+        """Returns the current state of the writer
+
+        Returns:
+            dict: queueDepth, writtenFiles, throughput (MB/s), meanLatency and
+                  maxLatency (ms), blockedTime (s, time spent waiting in submit)
+                  and errors
+        """
+        with self.lock:
+            elapsed = time.perf_counter() - self.startTime if self.startTime else 0.
+
+            return {
+                "queueDepth":   self.queue.qsize(),
+                "writtenFiles": self.writtenFiles,
+                "throughput":   self.writtenBytes / elapsed / 1e6 if elapsed else 0.,
+                "meanLatency":  1000 * self.totalLatency / self.writtenFiles if self.writtenFiles else 0.,
+                "maxLatency":   1000 * self.maxLatency,
+                "blockedTime":  self.blockedTime,
+                "errors":       self.errors
+            }
+
+def writeImageFile(path: str, image, params: list, fsync: bool) -> int:
+    """Encodes an image and writes it on disk
+
+    Args:
+        path (str): destination of the image
+        image (np.array): image to write
+        params (list): encoding parameters given to cv2.imencode
+        fsync (bool): if true, waits for the file to be written on the disk
+
+    Returns:
+        int: number of bytes written
+    """
+    ok, buffer = cv2.imencode(os.path.splitext(path)[1], image, params)
+
+    if not ok:
+        raise IOError(f"Could not encode {path}")
+
+    with open(path, "wb") as f:
+        f.write(buffer)
+
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+    return buffer.nbytes
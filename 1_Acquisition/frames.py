@@ -0,0 +1,77 @@
+from collections import namedtuple
+import numpy as np
+import time
+import lazyModules as lm
+
+cv2 = lm.lazyImport("cv2")  # Loaded on first use, the window is shown before
+
+# color: BGR image, depth: colorized depth (preview only), rawDepth: z16 depth,
+# metadata: dict describing the capture (see cameraWrapper.getFrameMetadata)
+Frames = namedtuple("Frames", ["color", "depth", "rawDepth", "metadata"])
+
+# views: Frames of each camera indexed by serial number, metadata: timestamp
+# (ms) and syncError (ms, spread of the timestamps of the views)
+MultiFrames = namedtuple("MultiFrames", ["views", "metadata"])
+
+PREVIEW_DEPTH_RANGE = 4000  # Raw depth value displayed in white by colorizeDepth
+
+# Depth post-processing filters of CameraWrapper, in the order they are applied
+DEPTH_FILTERS = ["decimation", "spatial", "temporal", "hole_filling"]
+
+class StageTimer:
+
+    def __init__(self):
+        """Measures the duration of the consecutive stages of a frame
+        """
+        self.times: dict = {}
+        self.last: float = time.perf_counter()
+
+    def lap(self, stage: str):
+        """Ends a stage, started at the end of the previous one
+
+        Args:
+            stage (str): name of the stage, its duration is stored in times (ms)
+        """
+        now = time.perf_counter()
+        self.times[stage] = 1000 * (now - self.last)
+        self.last = now
+
+def colorizeDepth(rawDepth: np.ndarray, depthRange: int = PREVIEW_DEPTH_RANGE) -> np.ndarray:
+    """Converts a raw depth image to a BGR image for display, used by the
+       sources that do not have a RealSense colorizer
+
+    Args:
+        rawDepth (np.ndarray): z16 depth image
+        depthRange (int): raw value mapped to white
+
+    Returns:
+        np.ndarray: 8-bit BGR image
+    """
+    gray = cv2.convertScaleAbs(rawDepth, alpha=255 / depthRange)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+def estimateCalibration(width: int, height: int, depthScale: float = 0.001) -> dict:
+    """Returns a calibration with the typical intrinsics of a RealSense D400
+       color stream (69 x 42 degrees field of view), for sources without one
+
+    Returns:
+        dict: same layout as CameraWrapper.getCalibration()
+    """
+    intrinsics = {
+        "width":  width,
+        "height": height,
+        "ppx":    width / 2,
+        "ppy":    height / 2,
+        "fx":     width / (2 * np.tan(np.radians(69 / 2))),
+        "fy":     height / (2 * np.tan(np.radians(42 / 2))),
+        "model":  "distortion.none",
+        "coeffs": [0., 0., 0., 0., 0.]
+    }
+
+    return {
+        "depthScale": depthScale,
+        "alignedTo":  "color",
+        "estimated":  True,
+        "color":      intrinsics,
+        "depth":      dict(intrinsics)
+    }
@@ -0,0 +1,34 @@
+import importlib.util
+import sys
+
+def lazyImport(name: str):
+    """Imports a module without executing it: it is executed the first time
+       one of its attributes is used. The module is registered in sys.modules,
+       but an "import" statement executes it: the modules that should not load
+       it call lazyImport() too
+
+    Args:
+        name (str): name of the module, e.g. "cv2"
+
+    Returns:
+        module: lazy module
+
+    Raises:
+        ImportError: If the module is not installed
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+
+    if spec is None:
+        raise ImportError(f"No module named {name}")
+
+    loader      = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module      = importlib.util.module_from_spec(spec)
+
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    return module
@@ -0,0 +1,232 @@
+from datetime import datetime
+import threading
+import bisect
+import json
+import time
+import os
+
+METRICS_PERIOD    = 2.                 # Seconds between two updates of the overlay and the files
+METRICS_HISTORY   = "metrics.jsonl"    # One snapshot appended per period
+METRICS_TEXTFILE  = "metrics.prom"     # Prometheus textfile (node_exporter textfile collector), replaced each period
+HISTORY_MAX_SIZE  = 16 * 1024 ** 2     # Bytes of METRICS_HISTORY before it is rotated
+HISTORY_FILES     = 3                  # Rotated files kept: metrics.jsonl.1 (newest) to metrics.jsonl.3
+METRIC_PREFIX     = "acquisition_"
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # Upper bounds (ms)
+
+class Counter:
+
+    def __init__(self, name: str, description: str):
+        """Total that only increases, e.g. a number of frames
+        """
+        self.name         = name
+        self.description  = description
+        self.value: float = 0.
+
+    def inc(self, amount: float = 1.):
+        self.value += amount
+
+    def set(self, total: float):
+        """Sets the total, for counts kept by another object
+        """
+        self.value = total
+
+class Gauge:
+
+    def __init__(self, name: str, description: str):
+        """Value that goes up and down, e.g. the depth of a queue
+        """
+        self.name         = name
+        self.description  = description
+        self.value: float = 0.
+
+    def set(self, value: float):
+        self.value = value
+
+class Histogram:
+
+    def __init__(self, name: str, description: str, buckets: tuple = HISTOGRAM_BUCKETS):
+        """Distribution of durations, counted in buckets as Prometheus does
+
+        Args:
+            name (str): name of the metric
+            description (str): description of the metric
+            buckets (tuple): upper bounds of the buckets, increasing
+        """
+        self.name         = name
+        self.description  = description
+        self.buckets      = buckets
+        self.counts: list = [0] * (len(buckets) + 1)  # The last bucket has no upper bound
+        self.count: int   = 0
+        self.sum: float   = 0.
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum   += value
+
+    def getPercentile(self, percentile: float) -> float:
+        """Returns the upper bound of the bucket holding a percentile,
+           infinity if it is beyond the last bucket
+        """
+        rank  = percentile / 100 * self.count
+        total = 0
+
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+
+            if count and total >= rank:
+                return bound
+
+        return 0.
+
+class MetricsRegistry:
+
+    def __init__(self):
+        """Metrics of the acquisition, updated by the GUI thread. snapshot()
+           also gives the rate of the counters and the mean of the histograms
+           since the previous snapshot
+        """
+        self.metrics: dict = {}
+        self.lock          = threading.Lock()
+        self.previous      = (time.perf_counter(), {})  # Time and values of the last snapshot
+
+    def counter(self, name: str, description: str = "") -> Counter:
+        return self.register(Counter, name, description)
+
+    def gauge(self, name: str, description: str = "") -> Gauge:
+        return self.register(Gauge, name, description)
+
+    def histogram(self, name: str, description: str = "",
+                  buckets: tuple = HISTOGRAM_BUCKETS) -> Histogram:
+        return self.register(Histogram, name, description, buckets)
+
+    def register(self, metricType, name: str, description: str, *args):
+        """Returns the metric of a name, created on first use
+        """
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = metricType(name, description, *args)
+
+            return self.metrics[name]
+
+    def snapshot(self) -> dict:
+        """Returns the current value of every metric
+
+        Returns:
+            dict: time, and per metric: value and rate (per second since the
+                  previous snapshot) of counters, value of gauges, count, sum,
+                  mean (since the previous snapshot), p50, p95 and buckets of
+                  histograms
+        """
+        with self.lock:
+            now                    = time.perf_counter()
+            previousTime, previous = self.previous
+            elapsed                = max(now - previousTime, 1e-6)
+            snapshot               = {"time": datetime.now().isoformat()}
+            values                 = {}
+
+            for name, metric in self.metrics.items():
+                if isinstance(metric, Histogram):
+                    count, total = previous.get(name, (0, 0.))
+                    periodCount  = metric.count - count
+
+                    snapshot[name] = {
+                        "count":   metric.count,
+                        "sum":     metric.sum,
+                        "mean":    (metric.sum - total) / periodCount if periodCount else 0.,
+                        "p50":     metric.getPercentile(50),
+                        "p95":     metric.getPercentile(95),
+                        "buckets": list(metric.counts)
+                    }
+                    values[name] = (metric.count, metric.sum)
+                elif isinstance(metric, Counter):
+                    snapshot[name] = {
+                        "value": metric.value,
+                        "rate":  (metric.value - previous.get(name, 0.)) / elapsed
+                    }
+                    values[name] = metric.value
+                else:
+                    snapshot[name] = {"value": metric.value}
+
+            self.previous = (now, values)
+
+            return snapshot
+
+    def toPrometheus(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format
+        """
+        lines = []
+
+        with self.lock:
+            for name, metric in self.metrics.items():
+                fullName   = METRIC_PREFIX + name
+                metricType = type(metric).__name__.lower()
+
+                lines.append(f"# HELP {fullName} {metric.description}")
+                lines.append(f"# TYPE {fullName} {metricType}")
+
+                if isinstance(metric, Histogram):
+                    total = 0
+
+                    for bound, count in zip(metric.buckets + ("+Inf",), metric.counts):
+                        total += count
+                        lines.append(f'{fullName}_bucket{{le="{bound}"}} {total}')
+
+                    lines.append(f"{fullName}_sum {metric.sum}")
+                    lines.append(f"{fullName}_count {metric.count}")
+                else:
+                    lines.append(f"{fullName} {metric.value}")
+
+        return "\n".join(lines) + "\n"
+
+    def writeFiles(self, directory: str, snapshot: dict):
+        """Appends a snapshot to METRICS_HISTORY, rotated once it reaches
+           HISTORY_MAX_SIZE, and replaces METRICS_TEXTFILE, atomically so
+           that the collector never reads half a file
+
+        Args:
+            directory (str): folder of the files
+            snapshot (dict): returned by snapshot()
+        """
+        historyPath = os.path.join(directory, METRICS_HISTORY)
+
+        if os.path.exists(historyPath) and os.path.getsize(historyPath) >= HISTORY_MAX_SIZE:
+            rotateFile(historyPath, HISTORY_FILES)
+
+        with open(historyPath, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
+
+        path          = os.path.join(directory, METRICS_TEXTFILE)
+        temporaryPath = path + ".tmp"
+
+        with open(temporaryPath, "w") as f:
+            f.write(self.toPrometheus())
+
+        os.replace(temporaryPath, path)
+
+def rotateFile(path: str, count: int):
+    """Renames path to path.1, path.1 to path.2... up to path.<count>, the
+       oldest file is overwritten
+    """
+    for i in range(count - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+
+    os.replace(path, f"{path}.1")
+
+def formatSummary(snapshot: dict) -> str:
+    """Returns the line displayed in the GUI: capture rate, frames dropped,
+       mean detector time (of the recorded frames while recording), writer
+       queue depth and disk throughput
+    """
+    def value(name: str, key: str = "value") -> float:
+        return snapshot.get(name, {}).get(key, 0.)
+
+    detector = "recorded_detector_ms" if value("recording") else "detector_ms"
+
+    return (f"{value('frames_captured_total', 'rate'):.1f} fps | "
+            f"{value('frames_dropped_total'):.0f} dropped | "
+            f"detector {value(detector, 'mean'):.1f} ms "
+            f"(p95 {value(detector, 'p95'):g}) | "
+            f"queue {value('writer_queue_depth'):.0f} | "
+            f"{value('written_bytes_total', 'rate') / 1e6:.1f} MB/s")
@@ -0,0 +1,248 @@
+from collections import deque
+from frames import MultiFrames
+import frameProducer as fp
+import cameraWrapper as cw
+import frameWriter as fw
+import framePool as pl
+import pyrealsense2 as rs
+import numpy as np
+import argparse
+import time
+
+SYNC_TOLERANCE = 50.    # Maximum spread (ms) of the timestamps of the views of a record, ~1/3 of a frame at 6 FPS
+HARDWARE_SYNC  = False  # True if the cameras are connected with a sync cable, the first one is the master
+BENCH_DURATION = 10     # Seconds measured by --bench
+SYNC_WINDOW    = 1000   # Records over which the sync error statistics are computed
+
+class MultiCamera:
+
+    def __init__(self, serials: list = None):
+        """Captures from several RealSense cameras at once. Each camera has its
+           own pipeline, capture thread (FrameProducer) and writer queue, the
+           frames are matched by hardware timestamp. Exposes the interface of
+           FrameProducer, getLatestFrames() returning MultiFrames
+
+        Args:
+            serials (list, optional): serial numbers of the cameras, every
+                                      connected camera by default
+
+        Raises:
+            Exception: If no realsense device is connected
+        """
+        if serials is None:
+            serials = [device.get_info(rs.camera_info.serial_number)
+                       for device in cw.getCameras()]
+
+        if not serials:
+            raise Exception("Could not find any RealSense Device")
+
+        self.cameras   = {serial: cw.CameraWrapper(serial=serial) for serial in serials}
+        self.producers = {serial: fp.FrameProducer(camera)
+                          for serial, camera in self.cameras.items()}
+        self.writers   = {serial: fw.FrameWriter() for serial in serials}
+
+        self.syncedFrames: int   = 0
+        self.rejectedFrames: int = 0
+        self.syncErrors          = deque(maxlen=SYNC_WINDOW)  # Spread of the timestamps of the last records (ms)
+
+        if HARDWARE_SYNC:
+            setSyncModes(self.cameras)
+
+    @property
+    def capturedFrames(self) -> int:
+        return self.syncedFrames
+
+    @property
+    def droppedFrames(self) -> int:
+        return sum(producer.droppedFrames for producer in self.producers.values())
+
+    @property
+    def enableAnonymization(self) -> bool:
+        return all(producer.enableAnonymization for producer in self.producers.values())
+
+    @enableAnonymization.setter
+    def enableAnonymization(self, enabled: bool):
+        for producer in self.producers.values():
+            producer.enableAnonymization = enabled
+
+    @property
+    def onNewFrames(self):
+        return next(iter(self.producers.values())).onNewFrames
+
+    @onNewFrames.setter
+    def onNewFrames(self, callback):
+        for producer in self.producers.values():
+            producer.onNewFrames = callback
+
+    @property
+    def fullDetection(self) -> bool:
+        return all(camera.anonymizer.fullDetection for camera in self.cameras.values())
+
+    @fullDetection.setter
+    def fullDetection(self, enabled: bool):
+        for camera in self.cameras.values():
+            camera.anonymizer.fullDetection = enabled
+
+    @property
+    def alignRecordedFrames(self) -> bool:
+        return all(camera.alignRecordedFrames for camera in self.cameras.values())
+
+    @alignRecordedFrames.setter
+    def alignRecordedFrames(self, enabled: bool):
+        for camera in self.cameras.values():
+            camera.alignRecordedFrames = enabled
+
+    def start(self):
+        for producer in self.producers.values():
+            producer.start()
+
+    def pause(self):
+        for producer in self.producers.values():
+            producer.pause()
+
+    def resume(self):
+        for producer in self.producers.values():
+            producer.resume()
+
+    def stop(self):
+        """Stops the capture threads and waits for the pending writes
+        """
+        for producer in self.producers.values():
+            producer.stop()
+
+        for writer in self.writers.values():
+            writer.close()
+
+    def setFilterEnabled(self, name: str, enabled: bool):
+        for camera in self.cameras.values():
+            camera.setFilterEnabled(name, enabled)
+
+    def getCalibration(self) -> dict:
+        """Returns the calibration of each camera
+
+        Returns:
+            dict: views (calibrations indexed by serial number) and alignedTo,
+                  see CameraWrapper.getCalibration()
+        """
+        views = {serial: camera.getCalibration() for serial, camera in self.cameras.items()}
+
+        return {
+            "views":     views,
+            "alignedTo": next(iter(views.values()))["alignedTo"]
+        }
+
+    def getLatestFrames(self) -> MultiFrames:
+        """Returns the most recent record whose views were captured at the same
+           time: the latest frames of the camera that is the most behind, and
+           the closest frames of the others
+
+        Returns:
+            MultiFrames: frames of each camera, None if a camera has no new
+                         frames or if the views are more than SYNC_TOLERANCE
+                         apart. The caller must release the frames
+        """
+        timestamps = [producer.getLatestTimestamp() for producer in self.producers.values()]
+
+        if None in timestamps:
+            return None
+
+        target = min(timestamps)
+        views  = {serial: producer.getFramesNear(target)
+                  for serial, producer in self.producers.items()}
+
+        viewTimestamps = [frames.metadata["timestamp"] for frames in views.values()]
+        syncError      = max(viewTimestamps) - min(viewTimestamps)
+
+        self.syncErrors.append(syncError)
+
+        if syncError > SYNC_TOLERANCE:
+            pl.sharedPool.release(*views.values())
+            self.rejectedFrames += 1
+            return None
+
+        self.syncedFrames += 1
+
+        metadata = {
+            "timestamp":     target,
+            "syncError":     syncError,
+            "alignedTo":     next(iter(views.values())).metadata["alignedTo"],
+            "anonymized":    all(frames.metadata["anonymized"] for frames in views.values()),
+            "fullDetection": all(frames.metadata["fullDetection"] for frames in views.values())
+        }
+
+        return MultiFrames(views, metadata)
+
+    def release(self, frames: MultiFrames):
+        """Releases frames returned by getLatestFrames()
+        """
+        pl.sharedPool.release(frames)
+
+    def getStats(self) -> dict:
+        """Returns the synchronization statistics
+
+        Returns:
+            dict: records synced and rejected, mean, p99 and max sync error
+                  (ms) of the last SYNC_WINDOW records
+        """
+        errors = np.array(self.syncErrors) if self.syncErrors else np.zeros(1)
+
+        return {
+            "synced":        self.syncedFrames,
+            "rejected":      self.rejectedFrames,
+            "meanSyncError": float(errors.mean()),
+            "p99SyncError":  float(np.percentile(errors, 99)),
+            "maxSyncError":  float(errors.max())
+        }
+
+def setSyncModes(cameras: dict):
+    """Makes the first camera the master of the hardware sync signal and the
+       others its slaves (D400 inter_cam_sync_mode)
+    """
+    for i, camera in enumerate(cameras.values()):
+        sensor = camera.profile.get_device().first_depth_sensor()
+
+        if sensor.supports(rs.option.inter_cam_sync_mode):
+            sensor.set_option(rs.option.inter_cam_sync_mode, 1 if i == 0 else 2)
+
+def bench(duration: float = BENCH_DURATION):
+    """Captures from every connected camera and reports the FPS of each one
+       and the synchronization error
+    """
+    cameras = MultiCamera()
+    cameras.start()
+
+    start = time.perf_counter()
+
+    while time.perf_counter() - start < duration:
+        frames = cameras.getLatestFrames()
+
+        if frames:
+            cameras.release(frames)
+
+        time.sleep(0.005)
+
+    elapsed = time.perf_counter() - start
+    cameras.stop()
+
+    for serial, producer in cameras.producers.items():
+        print(f"{serial}: {producer.capturedFrames / elapsed:.1f} fps, "
+              f"{producer.droppedFrames} frames dropped")
+
+    stats = cameras.getStats()
+    print(f"{stats['synced'] / elapsed:.1f} synced records/s, {stats['rejected']} rejected")
+    print(f"sync error: mean {stats['meanSyncError']:.2f} ms, "
+          f"p99 {stats['p99SyncError']:.2f} ms, max {stats['maxSyncError']:.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-camera acquisition")
+    parser.add_argument("--bench",    action="store_true",
+                        help="reports the FPS of each camera and the sync error")
+    parser.add_argument("--duration", type=float, default=BENCH_DURATION)
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.duration)
+    else:
+        for device in cw.getCameras():
+            print(device.get_info(rs.camera_info.serial_number),
+                  device.get_info(rs.camera_info.name))
@@ -0,0 +1,83 @@
+import numpy as np
+import time
+import lazyModules as lm
+
+cv2 = lm.lazyImport("cv2")
+
+PREVIEW_FPS   = 15   # Maximum refresh rate of the images displayed in the GUI
+PREVIEW_SCALE = 1.0  # Scale of the displayed images relative to the captured ones
+
+class Preview:
+
+    def __init__(self, fps: float = PREVIEW_FPS, scale: float = PREVIEW_SCALE):
+        """Displays frames in sg.Image elements, at most fps times per second,
+           independently of the capture rate. Images are given to Tk as PPM
+           (raw pixels with a short header), which needs no compression
+
+        Args:
+            fps (float): maximum number of updates per second
+            scale (float): scale applied to the images before display
+        """
+        self.period: float     = 1 / fps
+        self.scale: float      = scale
+        self.lastUpdate: float = 0.
+
+    def isDue(self) -> bool:
+        """Returns True if the period since the last update is elapsed
+        """
+        return time.perf_counter() - self.lastUpdate >= self.period
+
+    def update(self, window, images: dict):
+        """Displays images in the window
+
+        Args:
+            window (sg.Window): window holding the sg.Image elements
+            images (dict): BGR images (np.array) indexed by element keys
+        """
+        self.lastUpdate = time.perf_counter()
+
+        for key, image in images.items():
+            window[key].update(data=toPPM(image, self.scale))
+
+def toPPM(image, scale: float = 1.) -> bytes:
+    """Converts a BGR image to a binary PPM (P6) buffer, readable by Tk
+
+    Args:
+        image (np.array): BGR image
+        scale (float): scale applied to the image
+
+    Returns:
+        bytes: PPM data
+    """
+    if scale != 1.:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    image         = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    height, width = image.shape[:2]
+
+    return f"P6 {width} {height} 255 ".encode() + image.tobytes()
+
+def tileImages(images: list, width: int, height: int) -> np.ndarray:
+    """Arranges images in a grid fitting in width x height, to display the
+       views of several cameras in one element
+
+    Args:
+        images (list): BGR images
+        width (int): width of the grid
+        height (int): height of the grid
+
+    Returns:
+        np.ndarray: BGR image, black where there is no image
+    """
+    columns = int(np.ceil(np.sqrt(len(images))))
+    rows    = int(np.ceil(len(images) / columns))
+    tileW   = width  // columns
+    tileH   = height // rows
+    grid    = np.zeros((tileH * rows, tileW * columns, 3), dtype=np.uint8)
+
+    for i, image in enumerate(images):
+        row, column = divmod(i, columns)
+        grid[row * tileH:(row + 1) * tileH, column * tileW:(column + 1) * tileW] = \
+            cv2.resize(image, (tileW, tileH), interpolation=cv2.INTER_AREA)
+
+    return grid
@@ -0,0 +1,360 @@
+from datetime import datetime
+import sessionStore as ss
+import calibration as cb
+import frameWriter as fw
+import frameIndex as fi
+import videoStore as vs
+import blobStore as bs
+import threading
+import cv2
+import os
+
+FRAME_INDEX_FILE      = "frames{}" + fi.INDEX_EXTENSION
+DEPTH_PNG_COMPRESSION = 1  # 0-9, lossless in any case, higher is smaller and slower
+
+class FileRecorder:
+
+    def __init__(self, directory: str, writer, calibration: dict,
+                 depthFormat: str = "raw"):
+        """Records each frame as a JPEG image and a depth image in directory
+
+        Args:
+            directory (str): destination folder, must exist
+            writer (FrameWriter): writer pool used to write the files
+            calibration (dict): depth scale and intrinsics of the camera
+            depthFormat (str): "raw" for 16-bit PNG files and a calibration.json
+                               sidecar, "colorized" for 8-bit TIFF files
+        """
+        self.directory   = directory
+        self.writer      = writer
+        self.depthFormat = depthFormat
+
+        # One index per recording, several recordings may share the directory
+        startTime  = datetime.now().strftime("_%Y%m%d_%H%M%S")
+        self.index = fi.FrameIndexWriter(os.path.join(directory, 
+                                                      FRAME_INDEX_FILE.format(startTime)))
+
+        if depthFormat == "raw":
+            cb.writeCalibration(directory, calibration)
+
+    def write(self, frames, frameCount: int, onWritten=None):
+        """Queues the writing of the frames
+
+        Args:
+            frames (Frames): frames returned by the camera
+            frameCount (int): position of the frames in the recording
+            onWritten (callable, optional): called without arguments once the
+                                            frames are written
+        """
+        dateTime         = datetime.now().strftime("%Y%m%d_%H%M%S")
+        frameCountString = '{:0>5}'.format(frameCount)
+
+        rgbImagePath = os.path.join(self.directory,
+                                    f"RGB_{dateTime}_{frameCountString}.jpeg")
+
+        with self.writer.batch(onWritten):
+            self.writer.writeImage(rgbImagePath, frames.color)
+
+            if self.depthFormat == "raw":
+                depthImagePath = os.path.join(self.directory,
+                                              f"D_{dateTime}_{frameCountString}.png")
+                self.writer.writeImage(depthImagePath, frames.rawDepth,
+                                       [cv2.IMWRITE_PNG_COMPRESSION, DEPTH_PNG_COMPRESSION])
+            else:
+                depthImagePath = os.path.join(self.directory,
+                                              f"D_{dateTime}_{frameCountString}.tiff")
+                self.writer.writeImage(depthImagePath, frames.depth)
+
+        self.index.append(frameCount, frames.metadata)
+
+    def close(self):
+        """Waits for every frame to be written and saves the frame index
+        """
+        self.writer.flush()
+        self.index.close()
+
+class SessionRecorder:
+
+    def __init__(self, directory: str, writer, calibration: dict):
+        """Records the frames of the session in a single chunked container
+           (see sessionStore.py), in a <date>.session folder of directory
+
+        Args:
+            directory (str): destination folder, must exist
+            writer (FrameWriter): writer pool used to write the frames
+            calibration (dict): depth scale and intrinsics of the camera
+        """
+        sessionName = datetime.now().strftime("%Y%m%d_%H%M%S") + ss.SESSION_EXTENSION
+        colorStream = calibration.get("alignedTo") or "color"
+        depthStream = calibration.get("alignedTo") or "depth"
+
+        sessionPath = os.path.join(directory, sessionName)
+
+        self.writer  = writer
+        self.session = ss.SessionWriter(sessionPath,
+                                        calibration[colorStream]["width"],
+                                        calibration[colorStream]["height"],
+                                        calibration,
+                                        depthWidth=calibration[depthStream]["width"],
+                                        depthHeight=calibration[depthStream]["height"])
+        self.index   = fi.FrameIndexWriter(os.path.join(sessionPath, 
+                                                        FRAME_INDEX_FILE.format("")))
+
+    def write(self, frames, frameCount: int, onWritten=None):
+        """Queues the writing of the frames
+
+        Args:
+            frames (Frames): frames returned by the camera
+            frameCount (int): position of the frames in the recording
+            onWritten (callable, optional): called without arguments once the
+                                            frames are written
+        """
+        with self.writer.batch(onWritten):
+            self.writer.submit(self.session.append, frameCount, frames.color,
+                               frames.rawDepth, frames.metadata["timestamp"],
+                               frames.metadata["frameNumber"])
+
+        self.index.append(frameCount, frames.metadata)
+
+    def close(self):
+        """Waits for every frame to be written, closes the session and saves
+           the frame index
+        """
+        self.writer.flush()
+        self.session.close()
+        self.index.close()
+
+class MultiRecorder:
+
+    def __init__(self, directory: str, writers: dict, calibration: dict,
+                 recordingFormat: str = "files", depthFormat: str = "raw",
+                 blobStore=None, fps: float = None):
+        """Records the views of several cameras, each in a subfolder named
+           after the serial number of the camera, with its own writer queue.
+           The views of a record share the same frame count
+
+        Args:
+            directory (str): destination folder, must exist
+            writers (dict): FrameWriter of each camera, indexed by serial number
+            calibration (dict): calibrations of the cameras, see MultiCamera.getCalibration()
+            recordingFormat (str): format of each view, see createRecorder()
+            depthFormat (str): "raw" or "colorized", see FileRecorder
+            blobStore (BlobStore, optional): store of the "blobs" format, shared by the views
+            fps (float, optional): frame rate of the "video" format
+        """
+        self.recorders = {}
+        self.lock      = threading.Lock()
+
+        for serial, viewCalibration in calibration["views"].items():
+            viewDirectory = os.path.join(directory, serial)
+            os.makedirs(viewDirectory, exist_ok=True)
+
+            self.recorders[serial] = createRecorder(viewDirectory, writers[serial], viewCalibration,
+                                                    recordingFormat, depthFormat, blobStore, fps)
+
+    def write(self, frames, frameCount: int, onWritten=None):
+        """Queues the writing of the views
+
+        Args:
+            frames (MultiFrames): synchronized frames of the cameras
+            frameCount (int): position of the record in the recording
+            onWritten (callable, optional): called without arguments once
+                                            every view is written
+        """
+        pending = [len(frames.views)]
+
+        def viewWritten():
+            with self.lock:
+                pending[0] -= 1
+                done        = pending[0] == 0
+
+            if done and onWritten:
+                onWritten()
+
+        for serial, viewFrames in frames.views.items():
+            self.recorders[serial].write(viewFrames, frameCount, viewWritten)
+
+    def close(self):
+        for recorder in self.recorders.values():
+            recorder.close()
+
+class BlobRecorder:
+
+    def __init__(self, directory: str, writer, calibration: dict, store):
+        """Records the frames in a content-addressed store shared by the whole
+           database. The directory of the recording only holds the references
+           to the blobs of each frame, its calibration and its frame index.
+           Frames close to a frame already recorded in the directory are
+           flagged as near-duplicates
+
+        Args:
+            directory (str): destination folder, must exist
+            writer (FrameWriter): writer pool used to hash and write the frames
+            calibration (dict): depth scale and intrinsics of the camera
+            store (bs.BlobStore): store of the images
+        """
+        self.directory = directory
+        self.writer    = writer
+        self.store     = store
+        self.lock      = threading.Lock()
+
+        startTime           = datetime.now().strftime("_%Y%m%d_%H%M%S")
+        self.referencesPath = os.path.join(directory, bs.REFERENCES_FILE.format(startTime))
+        self.references     = []
+        self.index          = fi.FrameIndexWriter(os.path.join(directory,
+                                                               FRAME_INDEX_FILE.format(startTime)))
+
+        # Frames are compared with the previous recordings of the directory only,
+        # consecutive frames of a recording are always close
+        self.previousHashes = [reference["perceptualHash"]
+                               for reference in bs.readReferences(directory)]
+
+        cb.writeCalibration(directory, calibration)
+
+    def write(self, frames, frameCount: int, onWritten=None):
+        """Queues the hashing and writing of the frames
+
+        Args:
+            frames (Frames): frames returned by the camera
+            frameCount (int): position of the frames in the recording
+            onWritten (callable, optional): called without arguments once the
+                                            frames are written
+        """
+        with self.writer.batch(onWritten):
+            self.writer.submit(self.writeFrames, frames, frameCount)
+        self.index.append(frameCount, frames.metadata)
+
+    def writeFrames(self, frames, frameCount: int) -> int:
+        """Stores the images of the frames and records their references,
+           executed by a writer thread
+
+        Returns:
+            int: number of bytes written
+        """
+        colorKey, colorSize = self.store.putImage(frames.color, ".jpeg")
+        depthKey, depthSize = self.store.putImage(frames.rawDepth, ".png",
+                                                  [cv2.IMWRITE_PNG_COMPRESSION, DEPTH_PNG_COMPRESSION])
+
+        perceptualHash = bs.getPerceptualHash(frames.color)
+        nearDuplicate  = any(bs.hammingDistance(perceptualHash, other) <= bs.NEAR_DUPLICATE_DISTANCE
+                             for other in self.previousHashes)
+
+        with self.lock:
+            self.references.append({
+                "frameCount":     frameCount,
+                "color":          colorKey,
+                "depth":          depthKey,
+                "perceptualHash": perceptualHash,
+                "nearDuplicate":  nearDuplicate
+            })
+
+        return colorSize + depthSize
+
+    def close(self):
+        """Waits for every frame to be written and saves the references and
+           the frame index
+        """
+        self.writer.flush()
+
+        with self.lock:
+            references = sorted(self.references, key=lambda reference: reference["frameCount"])
+
+        if references:
+            ss.writeJsonAtomic(self.referencesPath, references)
+
+        self.index.close()
+
+class VideoRecorder:
+
+    def __init__(self, directory: str, calibration: dict, fps: float):
+        """Records the color images as an MJPG video and the raw depth images
+           as a lossless delta-compressed stream (see videoStore.py): two
+           files per recording and one write per image, instead of a file per
+           image. Frames are encoded in order by a dedicated writer thread
+
+        Args:
+            directory (str): destination folder, must exist
+            calibration (dict): depth scale and intrinsics of the camera
+            fps (float): frame rate written in the video
+        """
+        startTime = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        self.colorPath   = os.path.join(directory, f"RGB_{startTime}" + vs.COLOR_EXTENSION)
+        self.depthPath   = os.path.join(directory, f"D_{startTime}" + vs.DEPTH_EXTENSION)
+        self.fps         = fps
+        self.writer      = fw.FrameWriter(workers=1)
+        self.colorStream = None
+        self.depthStream = None
+        self.index       = fi.FrameIndexWriter(os.path.join(directory, 
+                                                            FRAME_INDEX_FILE.format("_" + startTime)))
+
+        cb.writeCalibration(directory, calibration)
+
+    def write(self, frames, frameCount: int, onWritten=None):
+        """Queues the encoding of the frames
+
+        Args:
+            frames (Frames): frames returned by the camera
+            frameCount (int): position of the frames in the recording, the
+                              frames are stored in the order they are given
+            onWritten (callable, optional): called without arguments once the
+                                            frames are encoded
+        """
+        with self.writer.batch(onWritten):
+            self.writer.submit(self.writeFrames, frames)
+        self.index.append(frameCount, frames.metadata)
+
+    def writeFrames(self, frames) -> int:
+        """Appends the frames to the streams, executed by the writer thread
+
+        Returns:
+            int: number of depth bytes written (the video writer does not 
+                 report its size)
+        """
+        if self.colorStream is None:
+            height, width    = frames.color.shape[:2]
+            self.colorStream = cv2.VideoWriter(self.colorPath, 
+                                               cv2.VideoWriter_fourcc(*vs.COLOR_CODEC),
+                                               self.fps, (width, height))
+            self.depthStream = vs.DepthStreamWriter(self.depthPath, *frames.rawDepth.shape[::-1])
+
+        self.colorStream.write(frames.color)
+
+        return self.depthStream.append(frames.rawDepth)
+
+    def close(self):
+        """Waits for every frame to be encoded, closes the streams and saves
+           the frame index
+        """
+        self.writer.close()
+
+        if self.colorStream is not None:
+            self.colorStream.release()
+            self.depthStream.close()
+
+        self.index.close()
+
+def createRecorder(directory: str, writer, calibration: dict, recordingFormat: str = "files",
+                   depthFormat: str = "raw", blobStore=None, fps: float = None):
+    """Creates the recorder of a recording format
+
+    Args:
+        directory (str): destination folder, must exist
+        writer (FrameWriter): writer queue of the recorder
+        calibration (dict): see CameraWrapper.getCalibration()
+        recordingFormat (str): "files", "session", "video" or "blobs", see 
+                               app.RECORDING_FORMAT
+        depthFormat (str): "raw" or "colorized", see FileRecorder
+        blobStore (BlobStore, optional): store of the "blobs" format
+        fps (float, optional): frame rate of the "video" format
+    """
+    if recordingFormat == "session":
+        return SessionRecorder(directory, writer, calibration)
+
+    if recordingFormat == "video":
+        return VideoRecorder(directory, calibration, fps)
+
+    if recordingFormat == "blobs":
+        return BlobRecorder(directory, writer, calibration, blobStore)
+
+    return FileRecorder(directory, writer, calibration, depthFormat)
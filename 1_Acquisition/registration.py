@@ -0,0 +1,107 @@
+import batchAnonymize as ba
+import deprojection as dp
+import frameSources as fs
+import calibration as cb
+import numpy as np
+import argparse
+import cv2
+import os
+
+CHECKPOINT_FILE = "registration_checkpoint.txt"  # Depth images of a folder already aligned, removed once the folder is done
+ALIGNED_PREFIX  = ".aligned_"  # Aligned depth image waiting to replace the original
+
+def alignDepthToColor(depth: np.ndarray, calibration: dict) -> np.ndarray:
+    """Reprojects an unaligned depth image in the color image, as rs.align
+       does during the acquisition. Each depth pixel covers the color pixels
+       of its footprint, the closest depth is kept where they overlap
+
+    Args:
+        depth (np.ndarray): z16 depth image recorded without alignment
+        calibration (dict): calibration of the recording, with extrinsics
+                            (see CameraWrapper.getCalibration())
+
+    Returns:
+        np.ndarray: z16 depth image of the size of the color images
+    """
+    color      = calibration["color"]
+    extrinsics = calibration["depthToColor"]
+
+    points = dp.deprojectDepth(depth, calibration["depth"], calibration["depthScale"])
+    valid  = depth > 0
+    points = points[valid] @ np.array(extrinsics["rotation"], dtype=np.float32).T \
+             + np.array(extrinsics["translation"], dtype=np.float32)
+    values = depth[valid]
+
+    u, v = dp.projectPoints(points, color)
+
+    # Number of color pixels covered by a depth pixel
+    footprint = max(1, int(np.ceil(color["fx"] / calibration["depth"]["fx"])))
+    u = np.round(u - (footprint - 1) / 2).astype(np.int64)
+    v = np.round(v - (footprint - 1) / 2).astype(np.int64)
+
+    aligned = np.full(color["height"] * color["width"], np.iinfo(np.uint16).max,
+                      dtype=np.uint16)
+
+    for dy in range(footprint):
+        for dx in range(footprint):
+            x, y   = u + dx, v + dy
+            inside = (x >= 0) & (x < color["width"]) & (y >= 0) & (y < color["height"])
+            np.minimum.at(aligned, y[inside] * color["width"] + x[inside], values[inside])
+
+    aligned[aligned == np.iinfo(np.uint16).max] = 0
+
+    return aligned.reshape(color["height"], color["width"])
+
+def alignFolder(path: str):
+    """Aligns in place the raw depth images of a folder recorded without
+       alignment, and updates its calibration.json. An interrupted run is
+       resumed: each aligned image is written next to the original and
+       listed in CHECKPOINT_FILE before replacing it, so that no image is
+       aligned twice
+    """
+    if not os.path.exists(os.path.join(path, cb.CALIBRATION_FILE)):
+        return
+
+    calibration = dict(cb.loadCalibration(path))
+
+    if calibration.get("alignedTo"):
+        return
+
+    pairs = [pair for pair in fs.findFramePairs(path)
+             if pair[1] and pair[1].endswith(".png")]
+
+    checkpointPath = os.path.join(path, CHECKPOINT_FILE)
+    done           = ba.loadCheckpoint(checkpointPath)
+
+    with open(checkpointPath, "a") as checkpoint:
+        for i, (_, depthPath) in enumerate(pairs, 1):
+            fileName    = os.path.basename(depthPath)
+            alignedPath = os.path.join(path, ALIGNED_PREFIX + fileName)
+
+            if fileName not in done:
+                depth = cv2.imread(depthPath, cv2.IMREAD_UNCHANGED)
+                ba.writeImageAtomic(alignedPath, alignDepthToColor(depth, calibration))
+
+                checkpoint.write(fileName + "\n")
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+
+            # Missing if the original was already replaced
+            if os.path.exists(alignedPath):
+                os.replace(alignedPath, depthPath)
+
+            print(f"{path}: {i}/{len(pairs)}", end="\r")
+
+    calibration["alignedTo"] = "color"
+    cb.writeCalibration(path, calibration)
+    os.remove(checkpointPath)
+    print(f"{path}: {len(pairs)} depth images aligned")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aligns the depth images recorded "
+                                                 "with cameraWrapper.ALIGN_MODE = \"offline\"")
+    parser.add_argument("--database", default=ba.DATABASE_PATH)
+    args = parser.parse_args()
+
+    for directory, _, _ in os.walk(args.database):
+        alignFolder(directory)
@@ -0,0 +1,124 @@
+from datetime import datetime
+import sessionStore as ss
+import threading
+import json
+import os
+
+JOURNAL_FILE = "journal.jsonl"
+FSYNC_EVENTS = ("id", "location", "start", "stop", "recovered")  # Events forced to disk immediately
+
+class SessionJournal:
+
+    def __init__(self, path: str):
+        """Append-only log of the acquisition sessions, one JSON object per
+           line. Lines are only ever appended, a crash can at worst truncate
+           the last one, which is ignored when the journal is read back
+
+           The state of the acquisition (see getState()) is replayed when the
+           journal is opened and kept up to date by log()
+
+        Args:
+            path (str): journal file, created if needed
+        """
+        self.path  = path
+        self.lock  = threading.Lock()
+        self.state = getState(path)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+
+        # Terminates a line truncated by a crash, so that it stays alone
+        if self.file.tell() and not endsWithNewline(path):
+            self.file.write("\n")
+
+    def log(self, event: str, **fields):
+        """Appends an event to the journal
+
+        Args:
+            event (str): "id", "location", "start", "frame" (written), "stop"
+                         or "recovered"
+            fields: JSON serializable values describing the event
+        """
+        entry = {"time": datetime.now().isoformat(), "event": event, **fields}
+        line  = json.dumps(entry)
+
+        with self.lock:
+            applyEvent(self.state, entry)
+            self.file.write(line + "\n")
+            self.file.flush()
+
+            if event in FSYNC_EVENTS:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def endsWithNewline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def readJournal(path: str):
+    """Reads the events of a journal, skipping a truncated last line
+
+    Yields:
+        dict: time, event and the fields given to SessionJournal.log()
+    """
+    if not os.path.exists(path):
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def getState(path: str) -> dict:
+    """Replays a journal
+
+    Returns:
+        dict: nextID and location (None if never logged), recording: the
+              "start" event of a recording that was never stopped with the
+              number of frames written and the frameCount of the last one,
+              None if the last recording was stopped
+    """
+    state = {"nextID": None, "location": None, "recording": None}
+
+    for entry in readJournal(path):
+        applyEvent(state, entry)
+
+    return state
+
+def applyEvent(state: dict, entry: dict):
+    """Updates the state of a journal with one of its events
+    """
+    event = entry["event"]
+
+    if event == "id":
+        state["nextID"] = entry["nextID"]
+    elif event == "location":
+        state["location"] = entry["location"]
+    elif event == "start":
+        state["recording"] = dict(entry, frames=0, lastFrame=None)
+    elif event == "frame" and state["recording"]:
+        state["recording"]["frames"]   += 1
+        state["recording"]["lastFrame"] = entry["frameCount"]
+    elif event in ("stop", "recovered"):
+        state["recording"] = None
+
+def writeConfig(path: str, state: dict, config: dict = None):
+    """Derives config.json from the state of the journal, atomically
+
+    Args:
+        path (str): config.json
+        state (dict): see getState()
+        config (dict, optional): other settings kept in config.json
+    """
+    config = dict(config or {})
+
+    if state["nextID"] is not None:
+        config["nextID"] = state["nextID"]
+
+    ss.writeJsonAtomic(path, config)
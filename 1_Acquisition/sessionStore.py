@@ -0,0 +1,197 @@
+from datetime import datetime
+import numpy as np
+import threading
+import json
+import os
+
+SESSION_EXTENSION = ".session"
+HEADER_FILE       = "header.json"
+INDEX_FILE        = "index.bin"
+CHUNK_FILE        = "chunk_{:05d}.bin"
+CHUNK_FRAMES      = 64  # Number of frames stored in each chunk file
+
+# One fixed size record per frame in index.bin, at offset frameIndex * itemsize
+INDEX_DTYPE = np.dtype([("frameIndex",  "<i8"),
+                        ("frameNumber", "<i8"),
+                        ("timestamp",   "<f8"),
+                        ("valid",       "u1")])
+
+def frameDtype(width: int, height: int, depthWidth: int = None,
+               depthHeight: int = None) -> np.dtype:
+    """Returns the dtype of a frame record in the chunk files
+
+    Args:
+        width (int): width of the frames
+        height (int): height of the frames
+        depthWidth (int, optional): width of the depth images if they are not
+                                    aligned with the color images
+        depthHeight (int, optional): height of the depth images
+
+    Returns:
+        np.dtype: BGR color image followed by the z16 depth image
+    """
+    return np.dtype([("color", np.uint8,  (height, width, 3)),
+                     ("depth", "<u2",     (depthHeight or height, depthWidth or width))])
+
+class SessionWriter:
+
+    def __init__(self, path: str, width: int, height: int,
+                 calibration: dict = None, chunkFrames: int = CHUNK_FRAMES,
+                 depthWidth: int = None, depthHeight: int = None):
+        """Creates an append-only session container. Frames are stored
+           uncompressed in fixed size records, grouped in chunk files of
+           chunkFrames frames, so they can be read back with memory maps.
+
+        Args:
+            path (str): directory of the session, created if needed
+            width (int): width of the frames
+            height (int): height of the frames
+            calibration (dict, optional): depth scale and intrinsics of the camera
+            chunkFrames (int): number of frames per chunk file
+            depthWidth (int, optional): width of the depth images, if unaligned
+            depthHeight (int, optional): height of the depth images, if unaligned
+        """
+        self.path         = path
+        self.chunkFrames  = chunkFrames
+        self.dtype        = frameDtype(width, height, depthWidth, depthHeight)
+        self.chunks: dict = {}
+        self.lock         = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+        header = {
+            "version":     1,
+            "created":     datetime.now().isoformat(),
+            "width":       width,
+            "height":      height,
+            "depthWidth":  depthWidth or width,
+            "depthHeight": depthHeight or height,
+            "chunkFrames": chunkFrames,
+            "calibration": calibration
+        }
+
+        writeJsonAtomic(os.path.join(path, HEADER_FILE), header)
+
+        indexPath  = os.path.join(path, INDEX_FILE)
+        self.index = open(indexPath, "r+b" if os.path.exists(indexPath) else "w+b")
+
+    def append(self, frameIndex: int, color, depth,
+               timestamp: float, frameNumber: int = -1) -> int:
+        """Writes a frame at its place in the session. Thread safe, frames may
+           be written in any order
+
+        Args:
+            frameIndex (int): position of the frame in the session
+            color (np.array): BGR image
+            depth (np.array): z16 depth image
+            timestamp (float): capture time of the frame (ms)
+            frameNumber (int, optional): frame number given by the camera
+
+        Returns:
+            int: number of bytes written
+        """
+        record = np.empty((), dtype=self.dtype)
+        record["color"] = color
+        record["depth"] = depth
+
+        entry = np.array((frameIndex, frameNumber, timestamp, 1), dtype=INDEX_DTYPE)
+
+        chunkNumber, position = divmod(frameIndex, self.chunkFrames)
+
+        with self.lock:
+            chunk = self.getChunk(chunkNumber)
+            chunk.seek(position * self.dtype.itemsize)
+            chunk.write(record.tobytes())
+            chunk.flush()
+
+            # The index entry is written last: a valid entry implies valid data
+            self.index.seek(frameIndex * INDEX_DTYPE.itemsize)
+            self.index.write(entry.tobytes())
+            self.index.flush()
+
+        return self.dtype.itemsize + INDEX_DTYPE.itemsize
+
+    def getChunk(self, chunkNumber: int):
+        """Returns the file of a chunk, opened for writing
+        """
+        if chunkNumber not in self.chunks:
+            chunkPath = os.path.join(self.path, CHUNK_FILE.format(chunkNumber))
+            mode      = "r+b" if os.path.exists(chunkPath) else "w+b"
+            self.chunks[chunkNumber] = open(chunkPath, mode)
+
+        return self.chunks[chunkNumber]
+
+    def close(self):
+        with self.lock:
+            for chunk in self.chunks.values():
+                chunk.close()
+
+            self.chunks.clear()
+            self.index.close()
+
+class SessionReader:
+
+    def __init__(self, path: str):
+        """Opens a session written by SessionWriter. Frames are memory mapped,
+           nothing is loaded until it is accessed
+
+        Args:
+            path (str): directory of the session
+        """
+        self.path = path
+
+        with open(os.path.join(path, HEADER_FILE), "r") as f:
+            self.header = json.load(f)
+
+        self.calibration  = self.header["calibration"]
+        self.chunkFrames  = self.header["chunkFrames"]
+        self.dtype        = frameDtype(self.header["width"], self.header["height"],
+                                       self.header.get("depthWidth"),
+                                       self.header.get("depthHeight"))
+        self.chunks: dict = {}
+
+        index = np.fromfile(os.path.join(path, INDEX_FILE), dtype=INDEX_DTYPE)
+
+        # Entries of frames that were never completely written are ignored
+        self.index = index[index["valid"] == 1]
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> tuple:
+        """Returns the i-th valid frame of the session
+
+        Returns:
+            color (np.array), depth (np.array): read-only memory mapped views
+        """
+        frameIndex          = int(self.index["frameIndex"][i])
+        chunkNumber, offset = divmod(frameIndex, self.chunkFrames)
+        record              = self.getChunk(chunkNumber)[offset]
+
+        return record["color"], record["depth"]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def getChunk(self, chunkNumber: int) -> np.memmap:
+        """Returns the memory map of a chunk file
+        """
+        if chunkNumber not in self.chunks:
+            chunkPath = os.path.join(self.path, CHUNK_FILE.format(chunkNumber))
+            frames    = os.path.getsize(chunkPath) // self.dtype.itemsize
+            self.chunks[chunkNumber] = np.memmap(chunkPath, dtype=self.dtype,
+                                                 mode="r", shape=(frames,))
+
+        return self.chunks[chunkNumber]
+
+def writeJsonAtomic(path: str, data):
+    """Writes a JSON file through a temporary file, so that it is never left
+       half written
+    """
+    temporaryPath = path + ".tmp"
+
+    with open(temporaryPath, "w") as f:
+        json.dump(data, f, indent=4)
+
+    os.replace(temporaryPath, path)
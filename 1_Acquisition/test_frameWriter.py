@@ -0,0 +1,41 @@
+from frames import Frames
+import frameWriter as fw
+import recorders as rc
+import numpy as np
+import os
+
+def getFrames() -> Frames:
+    color = np.zeros((48, 64, 3), dtype=np.uint8)
+    depth = np.zeros((48, 64), dtype=np.uint16)
+
+    return Frames(color, color, depth, {"timestamp": 0., "frameNumber": 1})
+
+def test_nestedBatchWaitsForFiles(tmp_path):
+    writer = fw.FrameWriter()
+    paths  = [str(tmp_path / "a.png"), str(tmp_path / "b.png")]
+    done   = []
+
+    with writer.batch(lambda: done.append(all(map(os.path.exists, paths)))):
+        with writer.batch(None):
+            for path in paths:
+                writer.writeImage(path, getFrames().color)
+
+    writer.close()
+
+    assert done == [True]
+
+def test_onWrittenAfterFiles(tmp_path):
+    writer   = fw.FrameWriter()
+    recorder = rc.createRecorder(str(tmp_path), writer, {}, depthFormat="colorized")
+    done     = []
+
+    def onWritten():
+        done.append(sorted(fileName[:2] for fileName in os.listdir(tmp_path)
+                           if not fileName.startswith("frames")))
+
+    # Same call as the writer process of framePipeline.runWriter()
+    recorder.write(getFrames(), 0, onWritten)
+    recorder.close()
+    writer.close()
+
+    assert done == [["D_", "RG"]]
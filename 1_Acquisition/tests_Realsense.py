@@ -5,6 +5,7 @@ import cv2
 TARGET_WIDTH  = 640
 TARGET_HEIGHT = 480
 TARGET_FPS    = 30
+FILTER_DEPTH  = False  # Applies the depth post-processing filters
 
 def getCamera():
     cameras = list()
@@ -58,23 +59,27 @@ def run():
         print("No depth sensor")
         return
     
+    # Created once, the temporal filter keeps the previous frames in its state
+    filters = [rs.decimation_filter(2),
+               rs.disparity_transform(True),
+               rs.spatial_filter(),
+               rs.temporal_filter(),
+               rs.disparity_transform(False),
+               rs.hole_filling_filter()] if FILTER_DEPTH else []
+    
     cv2.namedWindow('RGB',   cv2.WINDOW_AUTOSIZE)
     cv2.namedWindow('Depth', cv2.WINDOW_AUTOSIZE)
     
     while True:
         frameset = pipe.wait_for_frames()                  
         
+        for depth_filter in filters:
+            frameset = depth_filter.process(frameset).as_frameset()
+        
         aligned_frames = align.process(frameset)
         color_frame    = aligned_frames.first(rs.stream.color)
         depth_frame    = aligned_frames.get_depth_frame()
 
-        # depth_frame = rs.decimation_filter(1).process(depth_frame)
-        # depth_frame = rs.disparity_transform(True).process(depth_frame)
-        # depth_frame = rs.spatial_filter().process(depth_frame)
-        # depth_frame = rs.temporal_filter().process(depth_frame)
-        # depth_frame = rs.disparity_transform(False).process(depth_frame)
-        # depth_frame = rs.hole_filling_filter().process(depth_frame)
-        
         if not depth_frame or not color_frame:
             continue
 
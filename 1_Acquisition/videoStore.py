@@ -0,0 +1,218 @@
+import numpy as np
+import struct
+import zlib
+import cv2
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COLOR_EXTENSION   = ".avi"
+COLOR_CODEC       = "MJPG"  # Intra-only: every frame can be decoded alone
+DEPTH_EXTENSION   = ".depth"
+INDEX_EXTENSION   = ".index.npy"
+KEYFRAME_INTERVAL = 30      # Depth frames between two keyframes, a seek decodes at most this many deltas
+ZLIB_LEVEL        = 1
+
+MAGIC         = b"DPTH"
+FILE_HEADER   = struct.Struct("<4sHHH8s")  # magic, width, height, keyframe interval, codec
+RECORD_HEADER = struct.Struct("<IIB")      # frame position, compressed size, keyframe
+
+# Seek index of a depth stream, one entry per frame
+INDEX_DTYPE = np.dtype([("offset",   "<u8"),
+                        ("size",     "<u4"),
+                        ("keyframe", "u1")])
+
+def getCodec() -> str:
+    return "zstd" if zstandard else "zlib"
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=1).compress(data)
+
+    return zlib.compress(data, ZLIB_LEVEL)
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    return zlib.decompress(data)
+
+class DepthStreamWriter:
+
+    def __init__(self, path: str, width: int, height: int,
+                 keyframeInterval: int = KEYFRAME_INTERVAL):
+        """Writes z16 depth images losslessly in a single file: keyframes are
+           stored whole, the other frames as their difference with the
+           previous frame (uint16, wrapping), both compressed with zstd if
+           available or zlib. Must be called from a single thread
+
+        Args:
+            path (str): destination of the stream, the seek index is written
+                        next to it when closed
+            width (int): width of the images
+            height (int): height of the images
+            keyframeInterval (int): number of frames between two keyframes
+        """
+        self.path             = path
+        self.keyframeInterval = keyframeInterval
+        self.codec            = getCodec()
+        self.previous         = None
+        self.index: list      = []
+
+        self.file = open(path, "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, width, height, keyframeInterval,
+                                         self.codec.encode()))
+
+    def append(self, depth: np.ndarray) -> int:
+        """Appends a depth image to the stream
+
+        Returns:
+            int: number of bytes written
+        """
+        keyframe = len(self.index) % self.keyframeInterval == 0
+
+        if keyframe:
+            data = depth.astype("<u2").tobytes()
+        else:
+            data = np.subtract(depth, self.previous, dtype=np.uint16).astype("<u2").tobytes()
+
+        self.previous = depth.copy()
+        data          = compress(data, self.codec)
+        offset        = self.file.tell()
+
+        # One write per frame, the header allows rebuilding a lost index
+        self.file.write(RECORD_HEADER.pack(len(self.index), len(data), keyframe) + data)
+        self.index.append((offset, len(data), keyframe))
+
+        return RECORD_HEADER.size + len(data)
+
+    def close(self):
+        """Closes the stream and writes its seek index
+        """
+        self.file.close()
+
+        with open(self.path + INDEX_EXTENSION, "wb") as f:
+            np.save(f, np.array(self.index, dtype=INDEX_DTYPE))
+
+class DepthStreamReader:
+
+    def __init__(self, path: str):
+        """Reads a stream written by DepthStreamWriter, in any order
+
+        Args:
+            path (str): path of the stream
+        """
+        self.file = open(path, "rb")
+
+        magic, self.width, self.height, self.keyframeInterval, codec = \
+            FILE_HEADER.unpack(self.file.read(FILE_HEADER.size))
+
+        if magic != MAGIC:
+            raise IOError(f"{path} is not a depth stream")
+
+        self.codec = codec.rstrip(b"\0").decode()
+
+        indexPath = path + INDEX_EXTENSION
+
+        # The index is missing if the recording was interrupted
+        self.index = np.load(indexPath) if os.path.exists(indexPath) else self.rebuildIndex()
+
+        self.position: int    = -1    # Position of the last decoded frame
+        self.last: np.ndarray = None
+
+    def rebuildIndex(self) -> np.ndarray:
+        """Reads the headers of the records to rebuild the seek index, a
+           truncated last record is ignored
+        """
+        index  = []
+        offset = FILE_HEADER.size
+        end    = os.fstat(self.file.fileno()).st_size
+
+        while offset + RECORD_HEADER.size <= end:
+            self.file.seek(offset)
+            _, size, keyframe = RECORD_HEADER.unpack(self.file.read(RECORD_HEADER.size))
+
+            if offset + RECORD_HEADER.size + size > end:
+                break
+
+            index.append((offset, size, keyframe))
+            offset += RECORD_HEADER.size + size
+
+        return np.array(index, dtype=INDEX_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def readRecord(self, i: int) -> np.ndarray:
+        offset, size, _ = self.index[i]
+
+        self.file.seek(int(offset) + RECORD_HEADER.size)
+        data = decompress(self.file.read(int(size)), self.codec)
+
+        return np.frombuffer(data, dtype="<u2").reshape(self.height, self.width)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        """Decodes the i-th depth image, from the last decoded frame when
+           reading forward, from the previous keyframe otherwise
+
+        Returns:
+            np.ndarray: z16 depth image
+        """
+        if i < 0:
+            i += len(self)
+
+        keyframe = i - i % self.keyframeInterval
+
+        if self.last is not None and keyframe <= self.position <= i:
+            depth, start = self.last, self.position + 1
+        else:
+            depth, start = None, keyframe
+
+        for position in range(start, i + 1):
+            record = self.readRecord(position)
+            depth  = record.copy() if depth is None else np.add(depth, record, dtype=np.uint16)
+
+        self.position = i
+        self.last     = depth
+
+        return depth.copy()
+
+    def close(self):
+        self.file.close()
+
+class VideoReader:
+
+    def __init__(self, colorPath: str, depthPath: str):
+        """Reads the frames of a video recording (see recorders.VideoRecorder)
+
+        Args:
+            colorPath (str): MJPG video of the color images
+            depthPath (str): depth stream
+        """
+        self.color    = cv2.VideoCapture(colorPath)
+        self.depth    = DepthStreamReader(depthPath)
+        self.position = 0  # Position of the next color frame
+
+    def __len__(self) -> int:
+        return len(self.depth)
+
+    def __getitem__(self, i: int) -> tuple:
+        """Returns the color and depth images of the i-th frame
+        """
+        if i != self.position:
+            self.color.set(cv2.CAP_PROP_POS_FRAMES, i)
+
+        ok, color     = self.color.read()
+        self.position = i + 1
+
+        if not ok:
+            raise IndexError(f"Could not read color frame {i}")
+
+        return color, self.depth[i]
+
+    def close(self):
+        self.color.release()
+        self.depth.close()